@@ -1,13 +1,44 @@
 from flask import Flask
 from flask_cors import CORS
+from app.config import APP_SERVICES, SERVICE_WARMUP
 
-def create_app():
+def create_app(services=None, warm_up=None):
+    """
+    Build the Flask app without loading any dataset.
+
+    services lists the modalities to serve (default APP_SERVICES); warm_up
+    is 'lazy', 'background' or 'eager' (default SERVICE_WARMUP). Services
+    are constructed on first use unless warmed up here or via warm_up_services.
+    """
     app = Flask(__name__)
     CORS(app)
+    services = APP_SERVICES if services is None else services
+    warm_up = warm_up or SERVICE_WARMUP
     
-    # Register both blueprints
-    from app.routes import audio_routes, image_routes
-    app.register_blueprint(audio_routes.bp, url_prefix='/api/audio')
-    app.register_blueprint(image_routes.bp, url_prefix='/api/image')
+    # Register the enabled blueprints; their services load lazily
+    lazy_services = {}
+    if 'audio' in services:
+        from app.routes import audio_routes
+        app.register_blueprint(audio_routes.bp, url_prefix='/api/audio')
+        lazy_services['audio'] = audio_routes.audio_service
+    if 'image' in services:
+        from app.routes import image_routes
+        app.register_blueprint(image_routes.bp, url_prefix='/api/image')
+        lazy_services['image'] = image_routes.image_service
+
+    from app.routes import health_routes
+    app.register_blueprint(health_routes.bp, url_prefix='/api')
+    # Prometheus scrapes /metrics at the root
+    from app.routes import metrics_routes
+    app.register_blueprint(metrics_routes.bp)
+    app.config['SERVICES'] = lazy_services
+
+    if warm_up != 'lazy':
+        warm_up_services(app, background=warm_up == 'background')
     
-    return app
\ No newline at end of file
+    return app
+
+def warm_up_services(app, background=True):
+    """Start constructing every enabled service (e.g. from a WSGI server's post-fork hook)"""
+    for service in app.config['SERVICES'].values():
+        service.warm_up(background=background)
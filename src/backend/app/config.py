@@ -1,7 +1,8 @@
 import os
 
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-STORAGE_DIR = os.path.join(BASE_DIR, 'storage')
+# Datasets and caches live here; override to run against another tree (e.g. benchmarks)
+STORAGE_DIR = os.environ.get('STORAGE_DIR', os.path.join(BASE_DIR, 'storage'))
 
 # Audio directories
 AUDIO_DATASET_DIR = os.path.join(STORAGE_DIR, 'dataset', 'midi')
@@ -11,12 +12,71 @@ AUDIO_TEMP_DIR = os.path.join(STORAGE_DIR, 'temp', 'audio')
 IMAGE_DATASET_DIR = os.path.join(STORAGE_DIR, 'dataset', 'images')
 IMAGE_TEMP_DIR = os.path.join(STORAGE_DIR, 'temp', 'images')
 
+# Feature cache directories
+CACHE_DIR = os.path.join(STORAGE_DIR, 'cache')
+AUDIO_CACHE_DIR = os.path.join(CACHE_DIR, 'audio')
+IMAGE_CACHE_DIR = os.path.join(CACHE_DIR, 'images')
+
+# Feature extraction: worker processes for dataset builds (<= 1 disables the pool)
+AUDIO_EXTRACT_WORKERS = int(os.environ.get('AUDIO_EXTRACT_WORKERS', os.cpu_count() or 1))
+AUDIO_EXTRACT_CHUNK_SIZE = int(os.environ.get('AUDIO_EXTRACT_CHUNK_SIZE', 16))
+
+# MIDI parsing for song-level features: 'fast' (note-only SMF reader, pretty_midi fallback) or 'pretty_midi'
+AUDIO_MIDI_READER = os.environ.get('AUDIO_MIDI_READER', 'fast')
+
+# Sliding-window (segment-level) audio index: 20-beat windows sliding by 4 beats
+AUDIO_WINDOWED_INDEX = os.environ.get('AUDIO_WINDOWED_INDEX', '0') == '1'
+AUDIO_WINDOW_SIZE = int(os.environ.get('AUDIO_WINDOW_SIZE', 20))
+AUDIO_WINDOW_SLIDE = int(os.environ.get('AUDIO_WINDOW_SLIDE', 4))
+
+# Audio search: 'exact' scans every song, 'ivf' scores only the nprobe closest IVF lists
+AUDIO_SEARCH_MODE = os.environ.get('AUDIO_SEARCH_MODE', 'exact')
+AUDIO_IVF_LISTS = int(os.environ.get('AUDIO_IVF_LISTS', 0))  # 0 = sqrt(N)
+AUDIO_IVF_NPROBE = int(os.environ.get('AUDIO_IVF_NPROBE', 8))
+
+# Key-invariant audio search: try query pitch shifts up to this many semitones either way (0 = off)
+AUDIO_TRANSPOSE_RANGE = int(os.environ.get('AUDIO_TRANSPOSE_RANGE', 0))
+
+# Image PCA solver: 'exact', 'randomized', 'incremental' or 'auto'
+IMAGE_PCA_SOLVER = os.environ.get('IMAGE_PCA_SOLVER', 'auto')
+IMAGE_PCA_BATCH_SIZE = int(os.environ.get('IMAGE_PCA_BATCH_SIZE', 1000))
+# Compute dtype of PCA centering, components and projections ('float32' or 'float64')
+IMAGE_PCA_DTYPE = os.environ.get('IMAGE_PCA_DTYPE', 'float32')
+# Threads decoding dataset images (Pillow releases the GIL while decoding)
+IMAGE_DECODE_WORKERS = int(os.environ.get('IMAGE_DECODE_WORKERS', min(32, (os.cpu_count() or 1) + 4)))
+# Full PCA refit once images added since the last fit exceed this fraction of the dataset (0 = never)
+IMAGE_REFIT_FRACTION = float(os.environ.get('IMAGE_REFIT_FRACTION', 0.2))
+
+# Sharded search: split the index across this many local worker processes and/or the
+# comma-separated host:port shard hosts (python -m app.utils.shard_pool); 0 and '' = in-process
+AUDIO_SHARDS = int(os.environ.get('AUDIO_SHARDS', 0))
+AUDIO_SHARD_HOSTS = [a for a in os.environ.get('AUDIO_SHARD_HOSTS', '').split(',') if a.strip()]
+IMAGE_SHARDS = int(os.environ.get('IMAGE_SHARDS', 0))
+IMAGE_SHARD_HOSTS = [a for a in os.environ.get('IMAGE_SHARD_HOSTS', '').split(',') if a.strip()]
+# Shared secret of the shard hosts (required when any are configured)
+SHARD_AUTHKEY = os.environ.get('SHARD_AUTHKEY')
+
+# Archive ingest: saved members handed to the indexer per batch, and the largest member accepted
+ARCHIVE_BATCH_SIZE = int(os.environ.get('ARCHIVE_BATCH_SIZE', 256))
+ARCHIVE_MAX_MEMBER_SIZE = int(os.environ.get('ARCHIVE_MAX_MEMBER_SIZE', 64 * 2 ** 20))
+
+# Query result cache (keyed by upload content hash + dataset version)
+QUERY_CACHE_SIZE = int(os.environ.get('QUERY_CACHE_SIZE', 1024))
+QUERY_CACHE_TTL = float(os.environ.get('QUERY_CACHE_TTL', 300))
+
+# Modalities this process serves ('audio', 'image'); unlisted ones are never imported
+APP_SERVICES = [s.strip() for s in os.environ.get('APP_SERVICES', 'audio,image').split(',') if s.strip()]
+# Service construction: 'lazy' (first request), 'background' (thread at startup) or 'eager' (block create_app)
+SERVICE_WARMUP = os.environ.get('SERVICE_WARMUP', 'background')
+
 # Create all required directories
 for dir_path in [
     STORAGE_DIR, 
     AUDIO_DATASET_DIR, 
     AUDIO_TEMP_DIR,
     IMAGE_DATASET_DIR, 
-    IMAGE_TEMP_DIR
+    IMAGE_TEMP_DIR,
+    AUDIO_CACHE_DIR,
+    IMAGE_CACHE_DIR
 ]:
     os.makedirs(dir_path, exist_ok=True)
\ No newline at end of file
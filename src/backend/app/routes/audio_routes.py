@@ -1,13 +1,50 @@
 # app/routes/audio_routes.py
 from flask import Blueprint, request, jsonify, send_file
 from werkzeug.utils import secure_filename  
-from app.services.audio_service import AudioService
 from app.utils.audio.file_handler import save_dataset_file, allowed_file
-from app.config import AUDIO_DATASET_DIR, AUDIO_TEMP_DIR
+from app.utils.archive_ingest import ingest_archive
+from app.utils.lazy_service import LazyService
+from app.utils.metrics import QUERIES, QUERY_CACHE_HITS, INGEST_FAILURES
+from app.utils.rebuild_scheduler import RebuildScheduler
+from app.config import AUDIO_DATASET_DIR, AUDIO_TEMP_DIR, ARCHIVE_BATCH_SIZE, ARCHIVE_MAX_MEMBER_SIZE
+import io
 import os
+import time
 
 bp = Blueprint('audio', __name__)
-audio_service = AudioService()
+
+def _create_audio_service():
+    # Imported here so pretty_midi is only loaded once the audio service is needed
+    from app.services.audio_service import AudioService
+    service = AudioService()
+    # Approximate queries before the IVF lists exist have them trained by a background reload
+    service.request_rebuild = audio_rebuilds.trigger
+    return service
+
+audio_service = LazyService('audio', _create_audio_service)
+# Dataset uploads are indexed in the background; queries keep using the old index meanwhile
+audio_rebuilds = RebuildScheduler(
+    'audio', lambda paths, progress: audio_service.get().rebuild(paths, progress)
+)
+
+def _search_options():
+    """
+    (windowed, exact, nprobe, transpose) from the query string; None means the service default.
+
+    ?mode=window|song overrides the default index, ?search=exact|ivf and
+    ?nprobe=N trade recall for latency, and ?transpose=N matches the query
+    in any key up to N semitones away (0 turns it off). Raises ValueError
+    for values the service does not know.
+    """
+    mode = request.args.get('mode')
+    search = request.args.get('search')
+    if mode not in (None, 'window', 'song'):
+        raise ValueError(f"Unsupported mode '{mode}' (expected window or song)")
+    if search not in (None, 'exact', 'ivf'):
+        raise ValueError(f"Unsupported search '{search}' (expected exact or ivf)")
+    windowed = {'window': True, 'song': False}.get(mode)
+    exact = {'exact': True, 'ivf': False}.get(search)
+    return windowed, exact, request.args.get('nprobe', type=int), request.args.get('transpose', type=int)
 
 @bp.route('/play/<filename>')
 def play_audio(filename):
@@ -35,6 +72,7 @@ def play_audio(filename):
 
 @bp.route('/upload', methods=['POST'])
 def upload_audio():
+    service = audio_service.get()
     if 'file' not in request.files:
         return jsonify({'error': 'No file part'}), 400
     
@@ -43,29 +81,105 @@ def upload_audio():
         return jsonify({'error': 'No selected file'}), 400
     
     try:
-        # Save file temporarily
-        temp_path = os.path.join(AUDIO_TEMP_DIR, secure_filename(file.filename))
-        file.save(temp_path)
-        
-        # Process audio and get matches
-        matches = audio_service.find_matches(temp_path)
-        
-        # Clean up
-        os.remove(temp_path)
+        start_time = time.time()
+        content = file.read()
+        windowed, exact, nprobe, transpose = _search_options()
+
+        # Repeated uploads of the same file skip extraction and scoring
+        cache_key = service.query_cache.make_key(
+            content, service.dataset_version, 1, windowed, exact, nprobe, transpose
+        )
+        matches = service.query_cache.get(cache_key)
+        QUERIES.labels('audio', 'single').inc()
+        if matches is not None:
+            QUERY_CACHE_HITS.labels('audio').inc()
+            return jsonify({
+                'matches': matches,
+                'executionTime': (time.time() - start_time) * 1000,
+                'cached': True
+            })
+
+        # Parse straight from memory, the query never touches disk; only successful results are cached
+        matches = service.find_matches(
+            io.BytesIO(content), windowed=windowed, exact=exact, nprobe=nprobe, transpose=transpose
+        )
+        service.query_cache.put(cache_key, matches)
+        # Timed per request so concurrent queries never see each other's timings
+        execution_time = (time.time() - start_time) * 1000
         
         print("Sending response:", {  # Debug print
             'matches': matches,
-            'executionTime': audio_service.last_execution_time
+            'executionTime': execution_time
         })
         
         return jsonify({
             'matches': matches,
-            'executionTime': audio_service.last_execution_time
+            'executionTime': execution_time
         })
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         print("Error processing query:", str(e))
         return jsonify({'error': str(e)}), 500
 
+@bp.route('/upload/batch', methods=['POST'])
+def upload_audio_batch():
+    """Match many query MIDIs (multipart 'files[]') in one request"""
+    service = audio_service.get()
+    files = [file for file in request.files.getlist('files[]') if file and file.filename]
+    if not files:
+        return jsonify({'error': 'No files uploaded'}), 400
+
+    try:
+        start_time = time.time()
+        windowed, exact, nprobe, transpose = _search_options()
+        top_n = max(1, request.args.get('top_n', default=1, type=int))
+
+        # Cached queries are answered directly, the rest are scored as one batch
+        results = [None] * len(files)
+        keys = []
+        pending = []
+        for i, file in enumerate(files):
+            content = file.read()
+            key = service.query_cache.make_key(
+                content, service.dataset_version, top_n, windowed, exact, nprobe, transpose
+            )
+            keys.append(key)
+            matches = service.query_cache.get(key)
+            if matches is not None:
+                results[i] = {'matches': matches, 'executionTime': 0.0, 'cached': True}
+            else:
+                pending.append((i, content))
+        QUERIES.labels('audio', 'batch').inc(len(files))
+        QUERY_CACHE_HITS.labels('audio').inc(len(files) - len(pending))
+
+        batch = service.find_matches_batch(
+            [content for _, content in pending], top_n=top_n,
+            windowed=windowed, exact=exact, nprobe=nprobe, transpose=transpose
+        ) if pending else []
+        for (i, _), result in zip(pending, batch):
+            if 'error' not in result:
+                service.query_cache.put(keys[i], result['matches'])
+            results[i] = result
+
+        for file, result in zip(files, results):
+            result['filename'] = file.filename
+        return jsonify({
+            'results': results,
+            'executionTime': (time.time() - start_time) * 1000
+        })
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        print("Error processing batch query:", str(e))
+        return jsonify({'error': str(e)}), 500
+
+@bp.route('/cache', methods=['GET'])
+def get_cache_stats():
+    """Hit/miss counters of the query result cache"""
+    service = audio_service.get()
+    return jsonify(service.query_cache.stats())
+
 @bp.route('/dataset', methods=['POST'])
 def upload_dataset():
     if 'files[]' not in request.files:
@@ -82,16 +196,66 @@ def upload_dataset():
         if filepath:
             uploaded_files.append(os.path.basename(filepath))
 
+    if not uploaded_files:
+        return jsonify({'message': 'No valid files uploaded', 'files': [], 'jobId': None})
+
+    # Index in the background; poll /jobs/<jobId> for progress and per-file failures
+    job_id = audio_rebuilds.trigger(
+        [os.path.join(AUDIO_DATASET_DIR, f) for f in uploaded_files]
+    )
+    return jsonify({
+        'message': f'Uploaded {len(uploaded_files)} files, indexing in background',
+        'files': uploaded_files,
+        'jobId': job_id
+    }), 202
+
+@bp.route('/dataset/archive', methods=['POST'])
+def upload_dataset_archive():
+    """
+    Bulk-add MIDIs from a zip or tar(.gz/.bz2/.xz) request body (not multipart).
+
+    Members are saved as they stream in and handed to the background indexer
+    every ARCHIVE_BATCH_SIZE files, so extraction overlaps with the upload.
+    """
+    job_ids = []
+
+    def index_batch(paths):
+        job_id = audio_rebuilds.trigger(paths)
+        if job_id not in job_ids:
+            job_ids.append(job_id)
+
     try:
-        audio_service._load_dataset()
-        message = f'Successfully uploaded {len(uploaded_files)} files and reloaded dataset'
+        result = ingest_archive(
+            request.stream, AUDIO_DATASET_DIR, allowed_file, index_batch,
+            batch_size=ARCHIVE_BATCH_SIZE, max_member_size=ARCHIVE_MAX_MEMBER_SIZE,
+            spool_dir=AUDIO_TEMP_DIR
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e), 'jobIds': job_ids}), 400
     except Exception as e:
-        message = f'Uploaded {len(uploaded_files)} files, but failed to reload dataset: {str(e)}'
-    
+        print(f"Error ingesting archive: {str(e)}")
+        return jsonify({'error': str(e), 'jobIds': job_ids}), 500
+    INGEST_FAILURES.labels('audio').inc(len(result['failed']))
+
     return jsonify({
-        'message': message,
-        'files': uploaded_files
-    })
+        'message': f'Extracted {len(result["saved"])} files, indexing in background',
+        'files': result['saved'],
+        'failed': result['failed'],
+        'jobIds': job_ids
+    }), 202
+
+@bp.route('/jobs', methods=['GET'])
+def get_jobs():
+    """Recent background indexing jobs, newest first"""
+    return jsonify(audio_rebuilds.jobs())
+
+@bp.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """Progress of one background indexing job"""
+    status = audio_rebuilds.status(job_id)
+    if status is None:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(status)
 
 @bp.route('/dataset', methods=['GET'])
 def get_dataset():
@@ -99,4 +263,20 @@ def get_dataset():
         files = [f for f in os.listdir(AUDIO_DATASET_DIR) if allowed_file(f)]
         return jsonify(files)
     except Exception as e:
-        return jsonify({'error': str(e)}), 500
\ No newline at end of file
+        return jsonify({'error': str(e)}), 500
+
+@bp.route('/dataset/<filename>', methods=['DELETE'])
+def delete_dataset_file(filename):
+    """Remove a MIDI file from the dataset and the index"""
+    service = audio_service.get()
+    safe_filename = secure_filename(filename)
+    file_path = os.path.join(AUDIO_DATASET_DIR, safe_filename)
+    if not os.path.exists(file_path):
+        return jsonify({'error': 'File not found'}), 404
+
+    try:
+        os.remove(file_path)
+        service.remove_files([safe_filename])
+        return jsonify({'message': f'Removed {safe_filename}'})
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
@@ -0,0 +1,26 @@
+# app/routes/health_routes.py
+from flask import Blueprint, jsonify, current_app
+
+bp = Blueprint('health', __name__)
+
+@bp.route('/health', methods=['GET'])
+def health():
+    """Liveness: the process is up and serving requests"""
+    return jsonify({'status': 'ok'})
+
+@bp.route('/ready', methods=['GET'])
+def ready():
+    """
+    Readiness: 200 once every enabled service has loaded its dataset, 503 before.
+
+    Services that have not started loading yet are warmed up in the
+    background, so lazy workers become ready without a real request.
+    """
+    services = {}
+    for name, service in current_app.config['SERVICES'].items():
+        status = service.status()
+        if status['state'] == 'idle':
+            service.warm_up(background=True)
+        services[name] = status
+    is_ready = all(status['state'] == 'ready' for status in services.values())
+    return jsonify({'ready': is_ready, 'services': services}), 200 if is_ready else 503
@@ -1,21 +1,37 @@
 from flask import Blueprint, request, jsonify, send_file
-from werkzeug.utils import secure_filename
-from ..services.image_services import ImageService
+from ..utils.archive_ingest import ingest_archive
+from ..utils.lazy_service import LazyService
+from ..utils.metrics import QUERIES, QUERY_CACHE_HITS, INGEST_FAILURES
+from ..config import IMAGE_DATASET_DIR, IMAGE_TEMP_DIR, ARCHIVE_BATCH_SIZE, ARCHIVE_MAX_MEMBER_SIZE
+from ..utils.rebuild_scheduler import RebuildScheduler
+import io
 import os
 import json
+import time
 
 bp = Blueprint('image', __name__)
-image_service = ImageService()
+
+def _create_image_service():
+    # Imported here so PIL and the PCA stack are only loaded once the image service is needed
+    from ..services.image_services import ImageService
+    return ImageService()
+
+image_service = LazyService('image', _create_image_service)
+# Dataset uploads and mapper reloads run in the background; queries keep using the old index meanwhile
+image_rebuilds = RebuildScheduler(
+    'image', lambda paths, progress: image_service.get().rebuild(paths, progress)
+)
 
 @bp.route('/dataset', methods=['GET'])
 def get_dataset():
     """Get all images in dataset with their mapped audio files"""
+    service = image_service.get()
     try:
-        files = image_service.get_dataset_files()
+        files = service.get_dataset_files()
         # Include mapper information
         result = [{
             'filename': filename,
-            'audioFile': image_service.mapper.get(filename)
+            'audioFile': service.mapper.get(filename)
         } for filename in files]
         return jsonify(result)
     except Exception as e:
@@ -24,34 +40,83 @@ def get_dataset():
 @bp.route('/dataset', methods=['POST'])
 def upload_dataset():
     """Upload multiple images to dataset"""
+    service = image_service.get()
     if 'files[]' not in request.files:
         return jsonify({'error': 'No files uploaded'}), 400
     
-    files = request.files.getlist('files[]')
-    uploaded_files = []
+    files = [file for file in request.files.getlist('files[]') if file and file.filename]
     
     try:
-        for file in files:
-            if file and file.filename:
-                filename = secure_filename(file.filename)
-                uploaded_files.append(filename)
-                image_service.save_dataset_image(file, filename)
-        
-        # Reload dataset after new files added
-        image_service.load_dataset()
-        
+        saved, failed = service.save_dataset_images(files)
+        INGEST_FAILURES.labels('image').inc(len(failed))
+        if not saved:
+            return jsonify({'message': 'No valid files uploaded', 'files': [], 'failed': failed, 'jobId': None})
+
+        # Only the new images are decoded and projected, in the background
+        job_id = image_rebuilds.trigger(saved)
         return jsonify({
-            'message': f'Successfully uploaded {len(uploaded_files)} files',
-            'files': uploaded_files
-        })
+            'message': f'Uploaded {len(saved)} files, indexing in background',
+            'files': [os.path.basename(path) for path in saved],
+            'failed': failed,
+            'jobId': job_id
+        }), 202
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@bp.route('/dataset/archive', methods=['POST'])
+def upload_dataset_archive():
+    """
+    Bulk-add images from a zip or tar(.gz/.bz2/.xz) request body (not multipart).
+
+    Members are saved as they stream in and handed to the background indexer
+    every ARCHIVE_BATCH_SIZE files, so decoding overlaps with the upload.
+    """
+    from ..utils.image.image_loader import IMAGE_EXTENSIONS
+    job_ids = []
+
+    def index_batch(paths):
+        job_id = image_rebuilds.trigger(paths)
+        if job_id not in job_ids:
+            job_ids.append(job_id)
+
+    try:
+        result = ingest_archive(
+            request.stream, IMAGE_DATASET_DIR, lambda f: f.lower().endswith(IMAGE_EXTENSIONS),
+            index_batch, batch_size=ARCHIVE_BATCH_SIZE, max_member_size=ARCHIVE_MAX_MEMBER_SIZE,
+            spool_dir=IMAGE_TEMP_DIR
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e), 'jobIds': job_ids}), 400
+    except Exception as e:
+        return jsonify({'error': str(e), 'jobIds': job_ids}), 500
+    INGEST_FAILURES.labels('image').inc(len(result['failed']))
+
+    return jsonify({
+        'message': f'Extracted {len(result["saved"])} files, indexing in background',
+        'files': result['saved'],
+        'failed': result['failed'],
+        'jobIds': job_ids
+    }), 202
+
+@bp.route('/jobs', methods=['GET'])
+def get_jobs():
+    """Recent background indexing jobs, newest first"""
+    return jsonify(image_rebuilds.jobs())
+
+@bp.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """Progress of one background indexing or reload job"""
+    status = image_rebuilds.status(job_id)
+    if status is None:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(status)
+
 @bp.route('/mapper', methods=['GET'])
 def get_mapper():
     """Get current image-to-audio mapping"""
+    service = image_service.get()
     try:
-        mapper = image_service.get_mapper()
+        mapper = service.get_mapper()
         return jsonify(mapper)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -59,6 +124,7 @@ def get_mapper():
 @bp.route('/mapper', methods=['POST'])
 def upload_mapper():
     """Upload new image-to-audio mapping file"""
+    service = image_service.get()
     if 'file' not in request.files:
         return jsonify({'error': 'No file uploaded'}), 400
         
@@ -69,7 +135,7 @@ def upload_mapper():
     try:
         if file.filename.endswith('.json'):
             mapping = json.load(file)
-            image_service.update_mapper(mapping)
+            service.update_mapper(mapping)
         elif file.filename.endswith('.txt'):
             # Parse text file format
             mapping = {}
@@ -80,17 +146,13 @@ def upload_mapper():
                 if len(parts) >= 2:
                     audio_file, pic_name = parts[:2]
                     mapping[pic_name] = audio_file
-            image_service.update_mapper(mapping)
+            service.update_mapper(mapping)
         else:
             return jsonify({'error': 'Invalid file format'}), 400
-        try:
-            image_service.load_dataset()
-            image_service.load_mapper()
-            message = f'Successfully uploaded files and reloaded dataset'
-        except Exception as e:
-            message = f'Uploaded files, but failed to reload dataset: {str(e)}'
-            
-        return jsonify({'message': 'Mapper updated successfully'})
+
+        # The new mapping is live already; the dataset reload runs in the background
+        job_id = image_rebuilds.trigger()
+        return jsonify({'message': 'Mapper updated successfully', 'jobId': job_id}), 202
 
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -98,6 +160,7 @@ def upload_mapper():
 @bp.route('/upload', methods=['POST'])
 def upload_query():
     """Process query image and find matches"""
+    service = image_service.get()
     if 'file' not in request.files:
         return jsonify({'error': 'No file uploaded'}), 400
         
@@ -106,20 +169,87 @@ def upload_query():
         return jsonify({'error': 'Empty file'}), 400
         
     try:
-        matches = image_service.find_matches(file)
+        start_time = time.time()
+        content = file.read()
+
+        # Repeated uploads of the same image skip decoding and projection
+        cache_key = service.query_cache.make_key(content, service.dataset_version, 5)
+        matches = service.query_cache.get(cache_key)
+        QUERIES.labels('image', 'single').inc()
+        if matches is not None:
+            QUERY_CACHE_HITS.labels('image').inc()
+            return jsonify({
+                'matches': matches,
+                'executionTime': (time.time() - start_time) * 1000,
+                'cached': True
+            })
+
+        matches = service.find_matches(io.BytesIO(content))
+        service.query_cache.put(cache_key, matches)
         return jsonify({
             'matches': matches,
-            'executionTime': image_service.last_execution_time
+            'executionTime': (time.time() - start_time) * 1000
         })
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@bp.route('/upload/batch', methods=['POST'])
+def upload_query_batch():
+    """Find matches for many query images (multipart 'files[]') in one request"""
+    service = image_service.get()
+    files = [file for file in request.files.getlist('files[]') if file and file.filename]
+    if not files:
+        return jsonify({'error': 'No files uploaded'}), 400
+
+    try:
+        start_time = time.time()
+
+        # Cached queries are answered directly, the rest are decoded and scored as one batch
+        results = [None] * len(files)
+        keys = []
+        pending = []
+        for i, file in enumerate(files):
+            content = file.read()
+            key = service.query_cache.make_key(content, service.dataset_version, 5)
+            keys.append(key)
+            matches = service.query_cache.get(key)
+            if matches is not None:
+                results[i] = {'matches': matches, 'executionTime': 0.0, 'cached': True}
+            else:
+                pending.append((i, content))
+        QUERIES.labels('image', 'batch').inc(len(files))
+        QUERY_CACHE_HITS.labels('image').inc(len(files) - len(pending))
+
+        batch = service.find_matches_batch(
+            [io.BytesIO(content) for _, content in pending]
+        ) if pending else []
+        for (i, _), result in zip(pending, batch):
+            if 'error' not in result:
+                service.query_cache.put(keys[i], result['matches'])
+            results[i] = result
+
+        for file, result in zip(files, results):
+            result['filename'] = file.filename
+        return jsonify({
+            'results': results,
+            'executionTime': (time.time() - start_time) * 1000
+        })
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@bp.route('/cache', methods=['GET'])
+def get_cache_stats():
+    """Hit/miss counters of the query result cache"""
+    service = image_service.get()
+    return jsonify(service.query_cache.stats())
+
 @bp.route('/view/<filename>')
 def view_image(filename):
     """Serve an image from the dataset"""
+    service = image_service.get()
     try:
         # Get the full path from the image service to ensure proper security
-        image_path = image_service.get_image_path(filename)
+        image_path = service.get_image_path(filename)
         if not image_path:
             return jsonify({'error': 'Image not found'}), 404
         
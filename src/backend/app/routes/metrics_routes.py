@@ -0,0 +1,10 @@
+# app/routes/metrics_routes.py
+from flask import Blueprint, Response
+from app.utils.metrics import REGISTRY
+
+bp = Blueprint('metrics', __name__)
+
+@bp.route('/metrics', methods=['GET'])
+def metrics():
+    """Stage latencies, counters and index gauges in the Prometheus text format"""
+    return Response(REGISTRY.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
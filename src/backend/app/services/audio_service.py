@@ -1,197 +1,732 @@
-from app.utils.audio.feature_extraction import extract_features
-from app.config import AUDIO_DATASET_DIR, AUDIO_TEMP_DIR
+from app.utils.audio.audio_index import (
+    AudioIndex, WindowIndex, FEATURE_WEIGHTS, query_matrices, transposed_query_matrices, transposition_shifts
+)
+from app.utils.audio.ivf_index import IVFIndex
+from app.utils.audio.parallel_extractor import extract_many
+from app.utils.audio.smf_reader import read_notes
+from app.utils.audio.window_processor import window_bounds, window_histograms
+from app.utils.query_cache import QueryCache
+from app.utils.shard_pool import ShardPool
+from app.utils.feature_store import FeatureStore, file_signature, signature_matches
+from app.utils.metrics import stage_timer, INDEX_SIZE, INDEX_BYTES, INGEST_FAILURES
+from app.config import (
+    AUDIO_DATASET_DIR, AUDIO_TEMP_DIR, AUDIO_CACHE_DIR,
+    AUDIO_EXTRACT_WORKERS, AUDIO_EXTRACT_CHUNK_SIZE, AUDIO_MIDI_READER,
+    AUDIO_WINDOWED_INDEX, AUDIO_WINDOW_SIZE, AUDIO_WINDOW_SLIDE,
+    AUDIO_SEARCH_MODE, AUDIO_IVF_LISTS, AUDIO_IVF_NPROBE, AUDIO_TRANSPOSE_RANGE,
+    AUDIO_SHARDS, AUDIO_SHARD_HOSTS, SHARD_AUTHKEY,
+    QUERY_CACHE_SIZE, QUERY_CACHE_TTL
+)
+from typing import NamedTuple, Optional
 import numpy as np
+import io
 import os
+import threading
 import time
 import warnings
 import pretty_midi
 
+# Bump whenever _extract_features or the stored layout changes so stale caches are rebuilt
+FEATURE_VERSION = 2
+
+PARSE_SECONDS = stage_timer('audio', 'midi_parse')
+HISTOGRAM_SECONDS = stage_timer('audio', 'histogram_build')
+RELOAD_SECONDS = stage_timer('audio', 'dataset_reload')
+
+# One row per melody note
+NOTE_DTYPE = np.dtype([
+    ('pitch', np.int16),
+    ('duration', np.float64),
+    ('velocity', np.int16),
+    ('start', np.float64)
+])
+
+class AudioSnapshot(NamedTuple):
+    """Everything a query reads, published together with one reference swap"""
+    index: AudioIndex
+    window_index: Optional[WindowIndex]
+    signatures: dict
+    failures: dict
+    version: int
+    # ShardPool generation holding index's rows (0 = search in-process)
+    shard_generation: int = 0
+
 class AudioService:
-    def __init__(self):
-        self.dataset_features = {}
-        self.last_execution_time = 0
+    def __init__(self, windowed=AUDIO_WINDOWED_INDEX):
+        self.windowed = windowed
+        self.snapshot = AudioSnapshot(
+            AudioIndex.empty(), WindowIndex.empty() if windowed else None, {}, {}, 0
+        )
+        # Serializes reloads and updates; queries never take it
+        self._write_lock = threading.RLock()
         self.similarity_threshold = 0.55  # 55% minimum threshold
+        self.search_mode = AUDIO_SEARCH_MODE
+        # IVF lists are trained by reloads and add_files once approximate search is wanted
+        self.ann_wanted = self.search_mode == 'ivf'
+        # Schedules a background full reload (set by the routes to RebuildScheduler.trigger)
+        self.request_rebuild = None
+        self.ivf_lists = AUDIO_IVF_LISTS
+        self.ivf_nprobe = AUDIO_IVF_NPROBE
+        self.transpose_range = AUDIO_TRANSPOSE_RANGE
+        self.extract_workers = AUDIO_EXTRACT_WORKERS
+        self.extract_chunk_size = AUDIO_EXTRACT_CHUNK_SIZE
+        self.last_load_report = {}
+        self.query_cache = QueryCache(QUERY_CACHE_SIZE, QUERY_CACHE_TTL)
+        self.feature_store = FeatureStore(AUDIO_CACHE_DIR, FEATURE_VERSION)
+        self.shards = ShardPool('audio', AUDIO_SHARDS, AUDIO_SHARD_HOSTS, SHARD_AUTHKEY)
         self._load_dataset()
-    
-    def _load_dataset(self):
-        """Load dan extract features dari semua file MIDI di dataset"""
+
+    @property
+    def index(self):
+        return self.snapshot.index
+
+    @property
+    def window_index(self):
+        return self.snapshot.window_index
+
+    @property
+    def dataset_version(self):
+        return self.snapshot.version
+
+    def _load_dataset(self, progress=None):
+        """Load features dari cache, extract ulang hanya file MIDI yang baru/berubah"""
+        with self._write_lock, RELOAD_SECONDS.time():
+            self._reload(progress)
+
+    def rebuild(self, paths=None, progress=None):
+        """
+        Full reload (paths None) or add_files(paths), reporting progress(processed, total).
+
+        Entry point of the background RebuildScheduler; returns the load report
+        or the add_files result.
+        """
+        if paths is None:
+            self._load_dataset(progress)
+            return dict(self.last_load_report)
+        return self.add_files(paths, progress)
+
+    def _reload(self, progress=None):
         print("Loading dataset...")
-        for filename in os.listdir(AUDIO_DATASET_DIR):
-            if filename.endswith(('.mid', '.midi')):
-                filepath = os.path.join(AUDIO_DATASET_DIR, filename)
-                try:
-                    features = self._extract_features(filepath)
-                    self.dataset_features[filename] = features
-                    print(f"Successfully loaded {filename}")
-                except Exception as e:
-                    print(f"Error loading {filename}: {str(e)}")
-
-    def _extract_features(self, midi_file):
-        """Extract ATB, RTB, and FTB features from MIDI file"""
+        start_time = time.time()
+        cached_index, cached_windows, cached_entries, cached_failures = self._load_cache()
+
+        reused = []
+        pending = []
+        signatures = {}
+        failures = {}
+        touched = False
+        for filename in sorted(os.listdir(AUDIO_DATASET_DIR)):
+            if not filename.endswith(('.mid', '.midi')):
+                continue
+            filepath = os.path.join(AUDIO_DATASET_DIR, filename)
+
+            entry = cached_entries.get(filename)
+            if entry is not None:
+                mtime = entry['mtime']
+                if signature_matches(entry, filepath):
+                    reused.append(filename)
+                    signatures[filename] = entry
+                    touched = touched or entry['mtime'] != mtime
+                    continue
+            failure = cached_failures.get(filename)
+            if failure is not None and signature_matches(failure, filepath):
+                failures[filename] = failure
+                continue
+            pending.append(filepath)
+
+        extracted, extracted_windows, errors = self._extract_batch(pending, signatures, failures, progress)
+
+        # Reuse the memory-mapped cache as-is when nothing was dropped
+        unchanged = reused == cached_index.filenames
+        index = cached_index if unchanged else cached_index.take(reused)
+        if extracted is not None:
+            index = index.merge(extracted)
+        window_index = None
+        if self.windowed:
+            window_index = cached_windows if unchanged else cached_windows.take(reused)
+            if extracted_windows is not None:
+                window_index = window_index.merge(extracted_windows)
+
+        # Train the IVF lists up front so the first approximate query stays fast
+        ann_index = self._with_ann(index)
+        touched = touched or ann_index is not index
+        index = ann_index
+
+        snapshot = self._publish(index, window_index, signatures, failures)
+        self.last_load_report = {
+            'total': len(index),
+            'cached': len(reused),
+            'extracted': len(pending) - len(errors),
+            'failed': errors,
+            'seconds': round(time.time() - start_time, 3)
+        }
+        print(f"Loaded {len(index)} files ({len(pending) - len(errors)} extracted, "
+              f"{len(reused)} from cache, {len(errors)} failed)")
+
+        if (pending or touched or len(reused) != len(cached_index)
+                or set(failures) != set(cached_failures)):
+            self._save_cache(snapshot)
+
+    def _extract_batch(self, paths, signatures, failures, progress=None):
+        """
+        Extract features for paths using the configured process pool.
+
+        Fills signatures/failures in place and returns (AudioIndex of the
+        extracted files or None, WindowIndex of their windows or None,
+        {filename: error}).
+        """
+        if not paths:
+            return None, None, {}
+        file_signatures = {path: file_signature(path) for path in paths}
+        extract = AudioService._extract_windowed_features if self.windowed else AudioService._extract_features
+        results, path_errors = extract_many(
+            extract, paths, workers=self.extract_workers, chunk_size=self.extract_chunk_size,
+            progress=progress
+        )
+
+        names = []
+        features = []
+        for path, feature in results:
+            filename = os.path.basename(path)
+            names.append(filename)
+            features.append(feature)
+            signatures[filename] = file_signatures[path]
+            failures.pop(filename, None)
+        errors = {}
+        for path, error in path_errors.items():
+            filename = os.path.basename(path)
+            errors[filename] = error
+            failures[filename] = file_signatures[path]
+        if errors:
+            INGEST_FAILURES.labels('audio').inc(len(errors))
+
+        if not names:
+            return None, None, errors
+        index = AudioIndex.from_features(names, features)
+        window_index = None
+        if self.windowed:
+            window_index = WindowIndex.from_windows(names, [f['windows'] for f in features])
+        return index, window_index, errors
+
+    def add_files(self, paths, progress=None):
+        """
+        Extract features for new or replaced MIDI files and merge them into the dataset.
+
+        Only the given files are parsed; the merged index is published as a
+        new snapshot so concurrent queries see either the old or the new one.
+        Returns {'added': [filenames], 'failed': {filename: error}}.
+        """
+        with self._write_lock:
+            current = self.snapshot
+            signatures = dict(current.signatures)
+            failures = dict(current.failures)
+            extracted, extracted_windows, errors = self._extract_batch(
+                paths, signatures, failures, progress
+            )
+
+            index, window_index = current.index, current.window_index
+            if extracted is not None:
+                index = index.merge(extracted)
+                if self.windowed:
+                    window_index = window_index.merge(extracted_windows)
+                index = self._with_ann(index)
+            snapshot = self._publish(index, window_index, signatures, failures,
+                                     changed=extracted is not None)
+            if extracted is not None or errors:
+                self._save_cache(snapshot)
+
+        return {'added': extracted.filenames if extracted is not None else [], 'failed': errors}
+
+    def remove_files(self, filenames):
+        """
+        Drop files from the in-memory index and the feature cache.
+
+        The MIDI files themselves are left alone; callers that delete them from
+        AUDIO_DATASET_DIR should call this afterwards. Returns the removed names.
+        """
+        with self._write_lock:
+            current = self.snapshot
+            removed = [f for f in filenames if f in current.index]
+            dropped_failures = [f for f in filenames if f in current.failures]
+            if not removed and not dropped_failures:
+                return []
+
+            signatures = {f: e for f, e in current.signatures.items() if f not in removed}
+            failures = {f: e for f, e in current.failures.items() if f not in dropped_failures}
+            window_index = current.window_index
+            if self.windowed:
+                window_index = window_index.without(removed)
+            snapshot = self._publish(current.index.without(removed), window_index,
+                                     signatures, failures)
+            self._save_cache(snapshot)
+        return removed
+
+    def _with_ann(self, index):
+        """index with IVF lists once approximate search is wanted (callers hold _write_lock)"""
+        if self.ann_wanted and index.ann is None:
+            return index.with_ann(self.ivf_lists)
+        return index
+
+    def build_ann(self):
+        """Train the IVF lists of the current index now and publish them"""
+        with self._write_lock:
+            self.ann_wanted = True
+            current = self.snapshot
+            index = self._with_ann(current.index)
+            if index is not current.index:
+                snapshot = self._publish(index, current.window_index, current.signatures,
+                                         current.failures, changed=False)
+                self._save_cache(snapshot)
+
+    def _ann_ready(self, index):
+        """
+        Whether index can answer approximate queries.
+
+        Queries never train the IVF lists themselves: the first approximate
+        query without them marks them wanted and schedules a background
+        reload, and is answered by exact search meanwhile.
+        """
+        if index.ann is not None or len(index) == 0:
+            return True
+        if not self.ann_wanted:
+            self.ann_wanted = True
+            if self.request_rebuild is not None:
+                self.request_rebuild()
+        return False
+
+    def _publish(self, index, window_index, signatures, failures, changed=True):
+        """
+        Swap in a new snapshot (callers hold _write_lock).
+
+        Queries read self.snapshot once, so they see either the old or the
+        new snapshot in full. When the indexed data changed the dataset
+        version is bumped and cached query results are dropped.
+        """
+        version = self.snapshot.version + 1 if changed else self.snapshot.version
+        # Shards get the new rows before the snapshot points at them
+        snapshot = AudioSnapshot(index, window_index, signatures, failures, version,
+                                 self._load_shards(index))
+        self.snapshot = snapshot
+        if changed:
+            self.query_cache.clear()
+        matrices = list(index.matrices().values())
+        if window_index is not None:
+            matrices += list(window_index.matrices().values())
+        INDEX_SIZE.labels('audio').set(len(index))
+        INDEX_BYTES.labels('audio').set(sum(matrix.nbytes for matrix in matrices))
+        return snapshot
+
+    def _load_shards(self, index):
+        """Split the song index across the shard pool; returns its generation (0 = not sharded)"""
+        current = self.snapshot
+        if not self.shards.enabled or len(index) == 0:
+            return 0
+        if index is current.index and current.shard_generation:
+            return current.shard_generation
+        return self.shards.load('audio', index.matrices())
+
+    def _load_cache(self):
+        """
+        Read the cached song index, window index (None unless windowed),
+        {filename: manifest entry} and {filename: failure}.
+        """
+        manifest, arrays = self.feature_store.load()
+        if manifest is None or manifest.get('windowed', False) != self.windowed:
+            return AudioIndex.empty(), WindowIndex.empty() if self.windowed else None, {}, {}
+
+        filenames = [entry['name'] for entry in manifest['files']]
+        entries = dict(zip(filenames, manifest['files']))
+        ann = None
+        if 'ivf_centroids' in arrays:
+            ann = IVFIndex(np.asarray(arrays['ivf_centroids']), np.asarray(arrays['ivf_labels']),
+                           FEATURE_WEIGHTS)
+        index = AudioIndex(filenames, arrays['atb'], arrays['rtb'], arrays['ftb'], ann=ann)
+        window_index = None
+        if self.windowed:
+            window_index = WindowIndex(
+                filenames, [entry['windows'] for entry in manifest['files']],
+                arrays['win_atb'], arrays['win_rtb'], arrays['win_ftb'], arrays['win_start']
+            )
+        return index, window_index, entries, manifest.get('failed', {})
+
+    def _save_cache(self, snapshot):
+        """
+        Persist a snapshot's index and its file signatures (callers hold _write_lock).
+
+        Once the shards hold a published index, its rows here are only read
+        by updates and the in-process fallback, so they are swapped for the
+        memory-mapped copy just saved instead of staying resident.
+        """
+        index = snapshot.index
+        window_index = snapshot.window_index
+        files = [dict(snapshot.signatures[f], name=f) for f in index.filenames]
+        arrays = index.matrices()
+        if index.ann is not None:
+            arrays['ivf_centroids'] = index.ann.centroids
+            arrays['ivf_labels'] = index.ann.labels
+        if self.windowed:
+            if window_index.filenames != index.filenames:
+                window_index = window_index.take(index.filenames)
+            for entry, count in zip(files, window_index.counts):
+                entry['windows'] = int(count)
+            arrays.update({f'win_{name}': m for name, m in window_index.matrices().items()})
         try:
-            with warnings.catch_warnings():
-                warnings.simplefilter("ignore")
-                midi_data = pretty_midi.PrettyMIDI(midi_file)
-            
-            # Get all non-drum tracks
-            melody_notes = []
-            for instrument in midi_data.instruments:
-                if not instrument.is_drum:
-                    melody_notes.extend([
-                        {
-                            'pitch': note.pitch,
-                            'duration': note.end - note.start,
-                            'velocity': note.velocity,
-                            'start': note.start
-                        } 
-                        for note in instrument.notes
-                    ])
-            
-            if not melody_notes:
-                raise ValueError("No melody found in MIDI file")
-            
-            # Sort notes by start time
-            melody_notes.sort(key=lambda x: x['start'])
-            
-            # Extract and normalize features
-            atb = self._normalize_histogram(self._calculate_atb(melody_notes))
-            rtb = self._normalize_histogram(self._calculate_rtb(melody_notes))
-            ftb = self._normalize_histogram(self._calculate_ftb(melody_notes))
-            
-            return {'atb': atb, 'rtb': rtb, 'ftb': ftb}
-            
-        except Exception as e:
-            print(f"Error processing MIDI file {midi_file}: {str(e)}")
-            raise
+            mapped = self.feature_store.save(
+                {'files': files, 'failed': snapshot.failures, 'windowed': self.windowed}, arrays
+            )
+        except OSError as e:
+            print(f"Error saving feature cache: {str(e)}")
+            return
+        if snapshot.shard_generation and snapshot is self.snapshot:
+            self.snapshot = snapshot._replace(index=AudioIndex(
+                index.filenames, mapped['atb'], mapped['rtb'], mapped['ftb'], ann=index.ann
+            ))
+
+    @staticmethod
+    def _load_melody(midi_file):
+        """
+        Parse a MIDI file into (PrettyMIDI, non-drum notes sorted by start).
 
-    def _calculate_atb(self, notes):
+        midi_file may be a path, a binary file object or raw bytes, so
+        uploaded queries can be parsed without touching disk.
+        """
+        if isinstance(midi_file, (bytes, bytearray, memoryview)):
+            midi_file = io.BytesIO(midi_file)
+        with warnings.catch_warnings(), PARSE_SECONDS.time():
+            warnings.simplefilter("ignore")
+            midi_data = pretty_midi.PrettyMIDI(midi_file)
+        
+        # Get all non-drum tracks
+        instruments = [i for i in midi_data.instruments if not i.is_drum]
+        melody_notes = np.fromiter(
+            (
+                (note.pitch, note.end - note.start, note.velocity, note.start)
+                for instrument in instruments
+                for note in instrument.notes
+            ),
+            dtype=NOTE_DTYPE,
+            count=sum(len(i.notes) for i in instruments)
+        )
+        
+        if len(melody_notes) == 0:
+            raise ValueError("No melody found in MIDI file")
+        
+        # Sort notes by start time (stable, like list.sort)
+        return midi_data, melody_notes[np.argsort(melody_notes['start'], kind='stable')]
+
+    @staticmethod
+    def _read_melody(midi_file):
+        """
+        Non-drum notes of a MIDI file sorted by start, without building a PrettyMIDI object.
+
+        Song-level features only need the notes, so they come from the fast
+        SMF reader (same notes as pretty_midi) unless AUDIO_MIDI_READER is
+        'pretty_midi'.
+        """
+        with PARSE_SECONDS.time():
+            notes = read_notes(midi_file, fast=AUDIO_MIDI_READER == 'fast')
+        notes = notes[~notes['drum']]
+        if len(notes) == 0:
+            raise ValueError("No melody found in MIDI file")
+
+        melody_notes = np.empty(len(notes), dtype=NOTE_DTYPE)
+        melody_notes['pitch'] = notes['pitch']
+        melody_notes['duration'] = notes['end'] - notes['start']
+        melody_notes['velocity'] = notes['velocity']
+        melody_notes['start'] = notes['start']
+        return melody_notes[np.argsort(melody_notes['start'], kind='stable')]
+
+    @staticmethod
+    def _extract_windowed_features(midi_file):
+        """Song-level features plus per-window histograms under the 'windows' key"""
+        # Window bounds need the beat grid, so this path keeps the full PrettyMIDI parse
+        midi_data, melody_notes = AudioService._load_melody(midi_file)
+        features = AudioService._song_features(melody_notes)
+
+        starts, ends = window_bounds(
+            midi_data.get_beats(), midi_data.get_end_time(), AUDIO_WINDOW_SIZE, AUDIO_WINDOW_SLIDE
+        )
+        with HISTOGRAM_SECONDS.time():
+            windows = window_histograms(melody_notes, starts, ends)
+        windows['start'] = starts
+        features['windows'] = windows
+        return features
+
+    @staticmethod
+    def _extract_features(midi_file):
+        """Extract ATB, RTB, and FTB features from MIDI file (path, file object or bytes)"""
+        return AudioService._song_features(AudioService._read_melody(midi_file))
+
+    @staticmethod
+    def _song_features(melody_notes):
+        """Normalized ATB, RTB and FTB histograms of a sorted note array"""
+        with HISTOGRAM_SECONDS.time():
+            atb = AudioService._normalize_histogram(AudioService._calculate_atb(melody_notes))
+            rtb = AudioService._normalize_histogram(AudioService._calculate_rtb(melody_notes))
+            ftb = AudioService._normalize_histogram(AudioService._calculate_ftb(melody_notes))
+        
+        return {'atb': atb, 'rtb': rtb, 'ftb': ftb}
+
+    @staticmethod
+    def _calculate_atb(notes):
         """Calculate Absolute Tone Based histogram"""
         histogram = np.zeros(128)
-        if not notes:
+        if len(notes) == 0:
             return histogram
             
-        total_duration = sum(note['duration'] for note in notes)
+        # Summed left to right so totals match the original per-note loop exactly
+        total_duration = sum(notes['duration'].tolist())
         if total_duration == 0:
             return histogram
             
-        for note in notes:
-            weight = (note['duration'] / total_duration) * (note['velocity'] / 127)
-            histogram[note['pitch']] += weight
-            
-        return histogram
+        weights = (notes['duration'] / total_duration) * (notes['velocity'] / 127)
+        return np.bincount(notes['pitch'], weights=weights, minlength=128)
 
-    def _calculate_rtb(self, notes):
+    @staticmethod
+    def _calculate_rtb(notes):
         """Calculate Relative Tone Based histogram"""
-        histogram = np.zeros(255)
         if len(notes) < 2:
-            return histogram
+            return np.zeros(255)
             
-        for i in range(1, len(notes)):
-            prev_note, curr_note = notes[i-1], notes[i]
-            diff = curr_note['pitch'] - prev_note['pitch']
-            
-            # Weight calculation
-            avg_duration = (curr_note['duration'] + prev_note['duration']) / 2
-            avg_velocity = (curr_note['velocity'] + prev_note['velocity']) / (2 * 127)
-            weight = avg_duration * avg_velocity
-            
-            # Add to histogram with bounds checking
-            index = diff + 127
-            if 0 <= index < 255:
-                histogram[index] += weight
-                
-        return histogram
+        pitch = notes['pitch'].astype(np.int64)
+        duration = notes['duration']
+        velocity = notes['velocity'].astype(np.int64)
+        
+        # Weight calculation per consecutive pair
+        avg_duration = (duration[1:] + duration[:-1]) / 2
+        avg_velocity = (velocity[1:] + velocity[:-1]) / (2 * 127)
+        weights = avg_duration * avg_velocity
+        
+        # Add to histogram with bounds checking
+        index = np.diff(pitch) + 127
+        valid = (index >= 0) & (index < 255)
+        return np.bincount(index[valid], weights=weights[valid], minlength=255)
 
-    def _calculate_ftb(self, notes):
+    @staticmethod
+    def _calculate_ftb(notes):
         """Calculate First Tone Based histogram"""
-        histogram = np.zeros(255)
         if len(notes) < 2:
-            return histogram
+            return np.zeros(255)
             
         first_note = notes[0]
-        first_weight = first_note['duration'] * first_note['velocity']
+        first_weight = first_note['duration'] * int(first_note['velocity'])
+        if first_weight == 0:
+            raise ZeroDivisionError("float division by zero")
         
-        for note in notes[1:]:
-            diff = note['pitch'] - first_note['pitch']
-            weight = (note['duration'] * note['velocity']) / first_weight
-            
-            index = diff + 127
-            if 0 <= index < 255:
-                histogram[index] += weight
-                
-        return histogram
+        rest = notes[1:]
+        weights = (rest['duration'] * rest['velocity']) / first_weight
+        
+        index = rest['pitch'].astype(np.int64) - int(first_note['pitch']) + 127
+        valid = (index >= 0) & (index < 255)
+        return np.bincount(index[valid], weights=weights[valid], minlength=255)
 
-    def _normalize_histogram(self, histogram):
+    @staticmethod
+    def _normalize_histogram(histogram):
         """Normalize histogram according to specification"""
         sum_h = np.sum(histogram)
         if sum_h > 0:
             return histogram / (127 * sum_h)
         return histogram
 
-    def _calculate_similarity(self, features1, features2):
-        """Calculate similarity between two feature sets"""
-        try:
-            # Calculate basic similarities
-            atb_sim = self._cosine_similarity(features1['atb'], features2['atb'])
-            rtb_sim = self._cosine_similarity(features1['rtb'], features2['rtb'])
-            ftb_sim = self._cosine_similarity(features1['ftb'], features2['ftb'])
-            
-            # Apply more lenient thresholds
-            if atb_sim < 0.3 or rtb_sim < 0.2 or ftb_sim < 0.2:
-                return 0.0
-            
-            # Calculate weighted similarity
-            similarity = (0.4 * atb_sim + 0.3 * rtb_sim + 0.3 * ftb_sim)
-            
-            # Apply threshold and scaling
-            if similarity < self.similarity_threshold:
-                return 0.0
-                
-            # Scale to percentage
-            scaled = ((similarity - self.similarity_threshold) / 
-                     (1 - self.similarity_threshold)) * 100
-                     
-            return round(min(scaled, 100.0), 2)
-            
-        except Exception as e:
-            print(f"Error in similarity calculation: {str(e)}")
-            return 0.0
+    def _transposed_matches(self, snapshot, features, top_n, windowed, transpose):
+        """
+        Key-invariant matches for many query feature dicts, one list per query.
 
-    def _cosine_similarity(self, v1, v2):
-        """Calculate cosine similarity between two vectors"""
-        norm1 = np.linalg.norm(v1)
-        norm2 = np.linalg.norm(v2)
-        
-        if norm1 == 0 or norm2 == 0:
-            return 0.0
-            
-        dot_product = np.dot(v1, v2)
-        return max(0.0, min(1.0, dot_product / (norm1 * norm2)))
+        Each query is scored under every shift in -transpose..+transpose
+        semitones in one pass and matches carry the best 'shift'.
+        """
+        shifts = transposition_shifts(transpose)
+        if windowed:
+            return [
+                [{'filename': filename, 'similarity': similarity, 'offset': round(offset, 3), 'shift': shift}
+                 for filename, similarity, offset, shift in matches]
+                for matches in snapshot.window_index.top_matches_transposed(
+                    features, self.similarity_threshold, shifts, top_n=top_n, min_similarity=65.0
+                )
+            ]
+        return [
+            [{'filename': filename, 'similarity': similarity, 'shift': shift}
+             for filename, similarity, shift in matches]
+            for matches in snapshot.index.top_matches_transposed(
+                features, self.similarity_threshold, shifts, top_n=top_n, min_similarity=65.0
+            )
+        ]
 
-    def find_matches(self, query_path, top_n=1):
-        """Find matches untuk query MIDI file"""
-        start_time = time.time()
+    def _sharded_matches(self, snapshot, features, top_n, transpose):
+        """
+        Exact song-level matches scored by the shard pool, one list per query.
+
+        Every shard scores its rows and returns its own top_n; the merged
+        lists equal an in-process search. Returns None when the shards
+        cannot answer, so callers fall back to the local index.
+        """
+        shifts = transposition_shifts(transpose) if transpose else None
+        request = {
+            'queries': transposed_query_matrices(features, shifts) if transpose else query_matrices(features),
+            'shifts': shifts,
+            'similarity_threshold': self.similarity_threshold,
+            'top_n': top_n,
+            'min_similarity': 65.0
+        }
+        batch = self.shards.search(snapshot.shard_generation, request, len(features))
+        if batch is None:
+            return None
+        filenames = snapshot.index.filenames
+        if transpose:
+            return [
+                [{'filename': filenames[row], 'similarity': similarity, 'shift': shift}
+                 for row, similarity, shift in matches]
+                for matches in batch
+            ]
+        return [
+            [{'filename': filenames[row], 'similarity': similarity} for row, similarity in matches]
+            for matches in batch
+        ]
+
+    def find_matches(self, query, top_n=1, windowed=None, exact=None, nprobe=None, transpose=None):
+        """
+        Find matches untuk query MIDI (path, file object atau bytes).
+
+        With windowed search (default when the window index is built) every
+        song scores as its best window and matches include the window 'offset'
+        in seconds. exact=False searches the IVF index instead of every song,
+        scoring the nprobe closest lists (every song until a background
+        reload has trained them); both default to the configured mode.
+        transpose > 0 makes the search key-invariant: the query is tried
+        under every shift up to that many semitones either way (always an
+        exact search) and matches include the best 'shift'. Exact song-level
+        searches go to the shard pool when sharding is enabled. Raises
+        ValueError for a windowed search without a window index or a query
+        that cannot be parsed, so callers never mistake a failure for "no match".
+        """
+        if windowed is None:
+            windowed = self.windowed
+        if exact is None:
+            exact = self.search_mode != 'ivf'
+        if transpose is None:
+            transpose = self.transpose_range
+        # One read of the published snapshot; a concurrent reload cannot change it underneath
+        snapshot = self.snapshot
+        if windowed and snapshot.window_index is None:
+            raise ValueError("Windowed index is not enabled")
+        if not (exact or windowed or transpose):
+            exact = not self._ann_ready(snapshot.index)
         try:
-            query_features = self._extract_features(query_path)
-            matches = []
-            
-            for filename, features in self.dataset_features.items():
-                similarity = self._calculate_similarity(query_features, features)
-                # Hanya tambahkan jika di atas threshold 65%
-                if similarity >= 65.0:  # Explicit threshold check
-                    matches.append({
-                        'filename': filename,
-                        'similarity': similarity
-                    })
-            
-            matches.sort(key=lambda x: x['similarity'], reverse=True)
-            matches = matches[:top_n]
-            
-            self.last_execution_time = (time.time() - start_time) * 1000
-            
-            # Jika tidak ada matches yang memenuhi threshold, return list kosong
-            return matches if matches else []
-            
+            query_features = self._extract_features(query)
         except Exception as e:
-            print(f"Error finding matches: {str(e)}")
-            return []
\ No newline at end of file
+            # Parsers raise anything on bad input (pretty_midi: a bare EOFError)
+            raise ValueError(str(e) or type(e).__name__) from e
+
+        # Hanya ambil match di atas threshold 65%
+        sharded = None
+        if snapshot.shard_generation and not windowed and (exact or transpose):
+            sharded = self._sharded_matches(snapshot, [query_features], top_n, transpose)
+        if sharded is not None:
+            matches = sharded[0]
+        elif transpose:
+            matches = self._transposed_matches(snapshot, [query_features], top_n, windowed, transpose)[0]
+        elif windowed:
+            matches = [
+                {'filename': filename, 'similarity': similarity, 'offset': round(offset, 3)}
+                for filename, similarity, offset in snapshot.window_index.top_matches(
+                    query_features, self.similarity_threshold, top_n=top_n, min_similarity=65.0
+                )
+            ]
+        else:
+            index = snapshot.index
+            if not exact:
+                nprobe = nprobe or self.ivf_nprobe
+            matches = [
+                {'filename': filename, 'similarity': similarity}
+                for filename, similarity in index.top_matches(
+                    query_features, self.similarity_threshold, top_n=top_n,
+                    min_similarity=65.0, nprobe=None if exact else nprobe
+                )
+            ]
+
+        # Jika tidak ada matches yang memenuhi threshold, return list kosong
+        return matches if matches else []
+
+    def find_matches_batch(self, queries, top_n=1, windowed=None, exact=None, nprobe=None, transpose=None):
+        """
+        find_matches for many query MIDIs in one call.
+
+        Features are extracted per query, then all successfully parsed
+        queries are scored together with one matrix-matrix product per
+        feature. IVF search probes different lists per query, so it scores
+        them one by one; transpose > 0 scores every shift of every query in
+        the same pass (see find_matches). With sharding enabled the exact
+        song-level batch is scored by all shards at once. Returns one
+        {'matches', 'executionTime'} dict per query, in order, with an
+        'error' key instead of matches for queries that could not be parsed;
+        executionTime is the query's own extraction time plus an equal share
+        of the batch scoring time.
+        """
+        if windowed is None:
+            windowed = self.windowed
+        if exact is None:
+            exact = self.search_mode != 'ivf'
+        if transpose is None:
+            transpose = self.transpose_range
+        snapshot = self.snapshot
+        if windowed and snapshot.window_index is None:
+            raise ValueError("Windowed index is not enabled")
+        if not (exact or windowed or transpose):
+            exact = not self._ann_ready(snapshot.index)
+
+        results = []
+        features = []
+        for query in queries:
+            query_start = time.time()
+            try:
+                features.append(self._extract_features(query))
+                results.append({'matches': []})
+            except Exception as e:
+                results.append({'matches': [], 'error': str(e) or type(e).__name__})
+            results[-1]['executionTime'] = (time.time() - query_start) * 1000
+        parsed = [result for result in results if 'error' not in result]
+
+        # Hanya ambil match di atas threshold 65%
+        score_start = time.time()
+        sharded = None
+        if features and snapshot.shard_generation and not windowed and (exact or transpose):
+            sharded = self._sharded_matches(snapshot, features, top_n, transpose)
+        if sharded is not None:
+            for result, matches in zip(parsed, sharded):
+                result['matches'] = matches
+        elif transpose:
+            batch = self._transposed_matches(snapshot, features, top_n, windowed, transpose)
+            for result, matches in zip(parsed, batch):
+                result['matches'] = matches
+        elif windowed:
+            batch = snapshot.window_index.top_matches_batch(
+                features, self.similarity_threshold, top_n=top_n, min_similarity=65.0
+            )
+            for result, matches in zip(parsed, batch):
+                result['matches'] = [
+                    {'filename': filename, 'similarity': similarity, 'offset': round(offset, 3)}
+                    for filename, similarity, offset in matches
+                ]
+        else:
+            index = snapshot.index
+            if exact:
+                batch = index.top_matches_batch(
+                    features, self.similarity_threshold, top_n=top_n, min_similarity=65.0
+                )
+            else:
+                batch = [
+                    index.top_matches(query_features, self.similarity_threshold, top_n=top_n,
+                                      min_similarity=65.0, nprobe=nprobe or self.ivf_nprobe)
+                    for query_features in features
+                ]
+            for result, matches in zip(parsed, batch):
+                result['matches'] = [
+                    {'filename': filename, 'similarity': similarity}
+                    for filename, similarity in matches
+                ]
+
+        if parsed:
+            share = (time.time() - score_start) * 1000 / len(parsed)
+            for result in parsed:
+                result['executionTime'] += share
+        return results
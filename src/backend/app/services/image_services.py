@@ -1,31 +1,119 @@
 import os
+import threading
 import numpy as np
 import time
-from PIL import Image
+from typing import NamedTuple
 from werkzeug.utils import secure_filename
-from app.config import IMAGE_DATASET_DIR
+from app.config import (
+    IMAGE_DATASET_DIR, IMAGE_CACHE_DIR, IMAGE_PCA_SOLVER, IMAGE_PCA_BATCH_SIZE, IMAGE_PCA_DTYPE,
+    IMAGE_REFIT_FRACTION,
+    IMAGE_DECODE_WORKERS, IMAGE_SHARDS, IMAGE_SHARD_HOSTS, SHARD_AUTHKEY,
+    QUERY_CACHE_SIZE, QUERY_CACHE_TTL
+)
 from app.utils.image.pca_processor import PCAProcessor
+from app.utils.image.image_loader import IMAGE_EXTENSIONS, load_image_matrix, load_image_vector
+from app.utils.query_cache import QueryCache
+from app.utils.shard_pool import ShardPool
+from app.utils.feature_store import FeatureStore, file_signature, signature_matches
+from app.utils.metrics import stage_timer, INDEX_SIZE, INDEX_BYTES, INGEST_FAILURES
 import json
 
+# Bump whenever image preprocessing or the stored model layout changes
+IMAGE_FEATURE_VERSION = 2
+
+TRANSFORM_SECONDS = stage_timer('image', 'pca_transform')
+RELOAD_SECONDS = stage_timer('image', 'dataset_reload')
+
+class ImageSnapshot(NamedTuple):
+    """Model, projections and mapper a query reads, published together with one reference swap"""
+    filenames: list
+    features: np.ndarray
+    sq_norms: np.ndarray
+    pca: PCAProcessor
+    signatures: dict
+    failures: dict
+    images_since_fit: int
+    mapper: dict
+    version: int
+    # ShardPool generation holding the projections (0 = search in-process)
+    shard_generation: int = 0
+
 class ImageService:
     def __init__(self):
         print("Initializing ImageService...")
-        self.dataset_features = []
-        self.filenames = []
-        self.pca_processor = PCAProcessor(n_components=2)  
-        self.mapper = {}
-        self.last_execution_time = 0
+        self.refit_fraction = IMAGE_REFIT_FRACTION
+        self.decode_workers = IMAGE_DECODE_WORKERS
+        self.feature_store = FeatureStore(IMAGE_CACHE_DIR, IMAGE_FEATURE_VERSION)
+        self.snapshot = ImageSnapshot(
+            filenames=[], features=np.zeros((0, 0)), sq_norms=np.zeros(0),
+            pca=self._new_pca(), signatures={}, failures={}, images_since_fit=0,
+            mapper={}, version=0
+        )
+        # Serializes reloads and updates; queries never take it
+        self._write_lock = threading.RLock()
+        self.query_cache = QueryCache(QUERY_CACHE_SIZE, QUERY_CACHE_TTL)
+        self.shards = ShardPool('image', IMAGE_SHARDS, IMAGE_SHARD_HOSTS, SHARD_AUTHKEY)
         print("About to load dataset...")
         self.load_dataset()
         print("About to load mapper...")
         self.load_mapper()
         print("ImageService initialization complete")
 
-    def load_dataset(self):
-        """Load and process all images in dataset"""
+    @property
+    def filenames(self):
+        return self.snapshot.filenames
+
+    @property
+    def dataset_features(self):
+        return self.snapshot.features
+
+    @property
+    def dataset_sq_norms(self):
+        return self.snapshot.sq_norms
+
+    @property
+    def pca_processor(self):
+        return self.snapshot.pca
+
+    @property
+    def mapper(self):
+        return self.snapshot.mapper
+
+    @property
+    def dataset_version(self):
+        return self.snapshot.version
+
+    @staticmethod
+    def _new_pca():
+        return PCAProcessor(
+            n_components=2, solver=IMAGE_PCA_SOLVER, batch_size=IMAGE_PCA_BATCH_SIZE,
+            dtype=IMAGE_PCA_DTYPE
+        )
+
+    def load_dataset(self, progress=None):
+        """
+        Load and process all images in dataset.
+
+        When the cached model's manifest still matches every image on disk,
+        the PCA state and projections are memory-mapped from the cache
+        instead of decoding and refitting. The new model is fitted off to the
+        side and published as one snapshot.
+        """
+        with self._write_lock, RELOAD_SECONDS.time():
+            self._reload(progress)
+
+    def _reload(self, progress=None, known_failures=None):
+        """
+        Refit on every image in the dataset directory (callers hold _write_lock).
+
+        Images whose signature matches a known failure (default: the
+        published snapshot's) are skipped instead of being decoded and
+        counted again.
+        """
         print("Loading image dataset...")
-        image_vectors = []
-        self.filenames = []
+        if known_failures is None:
+            known_failures = self.snapshot.failures
+        failures = {}
 
         # Check if directory exists
         print(f"Checking directory: {IMAGE_DATASET_DIR}")
@@ -37,125 +125,415 @@ class ImageService:
         print("Scanning directory for images...")
         files = os.listdir(IMAGE_DATASET_DIR)
         print(f"Found {len(files)} total files")
+
+        cached = self._load_cache(files)
+        if cached is not None:
+            print(f"Loaded PCA model and {len(cached['filenames'])} projections from cache")
+            touched = cached.pop('touched')
+            snapshot = self._publish(**cached)
+            if touched:
+                # Save the refreshed mtimes so touched files are not hashed again next time
+                self._save_cache(snapshot)
+            return
         
-        for filename in files:
-            if filename.lower().endswith(('.png', '.jpg', '.jpeg')):
-                print(f"Processing image: {filename}")
-                try:
-                    filepath = os.path.join(IMAGE_DATASET_DIR, filename)
-                    # Convert to grayscale and resize
-                    img = Image.open(filepath)
-                    print(f"Original image size: {img.size}")
-                    img = img.convert('L')
-                    print("Converted to grayscale")
-                    img = img.resize((100, 100))
-                    print("Resized to 100x100")
-                    # Convert to numpy array and flatten
-                    img_array = np.array(img).flatten()
-                    print(f"Flattened array shape: {img_array.shape}")
-                    image_vectors.append(img_array)
-                    self.filenames.append(filename)
-                    print(f"Successfully processed {filename}")
-                except Exception as e:
-                    print(f"Error processing {filename}: {str(e)}")
-                    continue
-
-        if image_vectors:
-            print(f"\nPreparing PCA for {len(image_vectors)} images...")
-            # Convert to numpy array and apply PCA
-            data_matrix = np.array(image_vectors)
+        images = []
+        for f in files:
+            if not f.lower().endswith(IMAGE_EXTENSIONS):
+                continue
+            failure = known_failures.get(f)
+            if failure is not None and signature_matches(failure, os.path.join(IMAGE_DATASET_DIR, f)):
+                failures[f] = failure
+            else:
+                images.append(f)
+
+        # Decode in parallel straight into one uint8 matrix
+        paths = [os.path.join(IMAGE_DATASET_DIR, f) for f in images]
+        data_matrix, loaded, errors = load_image_matrix(
+            paths, workers=self.decode_workers, progress=progress
+        )
+        filenames = [images[i] for i in loaded]
+        for i, error in errors.items():
+            print(f"Error processing {images[i]}: {error}")
+            failures[images[i]] = file_signature(paths[i])
+        INGEST_FAILURES.labels('image').inc(len(errors))
+
+        if len(filenames) > 0:
+            print(f"\nPreparing PCA for {len(filenames)} images...")
             print(f"Data matrix shape: {data_matrix.shape}")
             print("Starting PCA transformation...")
-            self.dataset_features = self.pca_processor.fit_transform(data_matrix)
-            print(f"PCA transformation complete. Output shape: {self.dataset_features.shape}")
+            pca = self._new_pca()
+            features = pca.fit_transform(data_matrix)
+            print(f"PCA transformation complete. Output shape: {features.shape}")
             
             # Calculate variance explained
-            var_ratio = self.pca_processor.cumulative_explained_variance_ratio()
-            print(f"Processed {len(self.filenames)} images with PCA")
+            var_ratio = pca.cumulative_explained_variance_ratio()
+            print(f"Processed {len(filenames)} images with PCA")
             print(f"Cumulative variance explained: {var_ratio[-1]*100:.2f}%")
+
+            signatures = {
+                filename: file_signature(os.path.join(IMAGE_DATASET_DIR, filename))
+                for filename in filenames
+            }
+            snapshot = self._publish(
+                filenames=filenames,
+                features=features,
+                sq_norms=np.einsum('ij,ij->i', features, features),
+                pca=pca,
+                signatures=signatures,
+                failures=failures,
+                images_since_fit=0
+            )
+            self._save_cache(snapshot)
         else:
             print("No valid images found in dataset")
+            # Nothing left to match against: drop the old model and projections too
+            self._publish(
+                filenames=[], features=np.zeros((0, 0)), sq_norms=np.zeros(0),
+                pca=self._new_pca(), signatures={}, failures=failures, images_since_fit=0
+            )
+            self.feature_store.clear()
+
+    def _load_cache(self, files):
+        """
+        Snapshot fields restored from the cache if its manifest matches files, else None.
+
+        The 'touched' key tells whether signature_matches refreshed the
+        mtime of any entry, in which case the manifest should be saved again.
+        """
+        manifest, arrays = self.feature_store.load()
+        pca = self._new_pca()
+        if (manifest is None
+                or manifest.get('n_components') != pca.n_components
+                or manifest.get('dtype') != pca.dtype.name):
+            return None
+
+        entries = {entry['name']: entry for entry in manifest['files']}
+        failures = manifest.get('failed', {})
+        images = [f for f in files if f.lower().endswith(IMAGE_EXTENSIONS)]
+        if set(images) != set(entries) | set(failures):
+            return None
+        touched = False
+        for filename in images:
+            entry = entries.get(filename, failures.get(filename))
+            mtime = entry.get('mtime')
+            if not signature_matches(entry, os.path.join(IMAGE_DATASET_DIR, filename)):
+                return None
+            touched = touched or entry['mtime'] != mtime
+
+        pca.set_state(arrays, manifest['n_samples_seen'])
+        return {
+            'filenames': [entry['name'] for entry in manifest['files']],
+            'features': arrays['projections'],
+            'sq_norms': arrays['sq_norms'],
+            'pca': pca,
+            'signatures': entries,
+            'failures': failures,
+            'images_since_fit': manifest.get('images_since_fit', 0),
+            'touched': touched
+        }
+
+    def _save_cache(self, snapshot):
+        """
+        Persist a snapshot's PCA model, projections and the manifest of the images they cover.
+
+        While the shards hold the projections, the snapshot keeps only the
+        memory-mapped copy just saved (see AudioService._save_cache).
+        """
+        pca = snapshot.pca
+        arrays = dict(pca.get_state(),
+                      projections=snapshot.features,
+                      sq_norms=snapshot.sq_norms)
+        manifest = {
+            'files': [dict(snapshot.signatures[f], name=f) for f in snapshot.filenames],
+            'failed': snapshot.failures,
+            'n_components': pca.n_components,
+            'dtype': pca.dtype.name,
+            'n_samples_seen': int(pca.n_samples_seen),
+            'images_since_fit': snapshot.images_since_fit
+        }
+        try:
+            mapped = self.feature_store.save(manifest, arrays)
+        except OSError as e:
+            print(f"Error saving image cache: {str(e)}")
+            return
+        if snapshot.shard_generation and snapshot is self.snapshot:
+            self.snapshot = snapshot._replace(features=mapped['projections'], sq_norms=mapped['sq_norms'])
+
+    def _publish(self, changed=True, **fields):
+        """
+        Swap in a copy of the current snapshot with fields replaced (callers hold _write_lock).
+
+        Queries read self.snapshot once, so they see either the old or the
+        new snapshot in full. When the answers can change the dataset
+        version is bumped and cached query results are dropped.
+        """
+        current = self.snapshot
+        if 'features' in fields or 'pca' in fields:
+            # Shards get the new projections before the snapshot points at them
+            fields['shard_generation'] = self._load_shards(
+                fields.get('features', current.features), fields.get('sq_norms', current.sq_norms),
+                fields.get('pca', current.pca)
+            )
+        snapshot = current._replace(version=current.version + 1 if changed else current.version, **fields)
+        self.snapshot = snapshot
+        if changed:
+            self.query_cache.clear()
+        INDEX_SIZE.labels('image').set(len(snapshot.filenames))
+        INDEX_BYTES.labels('image').set(
+            np.asarray(snapshot.features).nbytes + np.asarray(snapshot.sq_norms).nbytes
+        )
+        return snapshot
+
+    def _load_shards(self, features, sq_norms, pca):
+        """Split the projections across the shard pool; returns its generation (0 = not sharded)"""
+        if not self.shards.enabled or len(features) == 0:
+            return 0
+        return self.shards.load(
+            'image', {'projections': features, 'sq_norms': sq_norms},
+            {'n_components': pca.n_components, 'dtype': pca.dtype.name}
+        )
+
+    def _top_k(self, snapshot, query_projections, top_n):
+        """top_k_similarity of the projected queries, fanned out to the shards when they hold the snapshot"""
+        if snapshot.shard_generation:
+            request = {'queries': query_projections, 'top_n': top_n, 'min_similarity': 55.0}
+            similarities = self.shards.search(
+                snapshot.shard_generation, request, len(np.atleast_2d(query_projections))
+            )
+            if similarities is not None:
+                return similarities
+        return snapshot.pca.top_k_similarity(
+            query_projections,
+            snapshot.features,
+            k=top_n,
+            min_similarity=55.0,
+            database_sq_norms=snapshot.sq_norms
+        )
 
     def find_matches(self, file, top_n=5):
         """Find similar images for query image"""
-        start_time = time.time()
+        # One read of the published snapshot; a concurrent reload cannot change it underneath
+        snapshot = self.snapshot
         
         try:
             # Process query image
-            img = Image.open(file).convert('L')
-            img = img.resize((100, 100))
-            query_vector = np.array(img).flatten()
+            query_vector = load_image_vector(file)
             
             # Project query into PCA space
-            query_projection = self.pca_processor.transform(query_vector)
+            with TRANSFORM_SECONDS.time():
+                query_projection = snapshot.pca.transform(query_vector)
             
-            # Get similarity scores
-            similarities = self.pca_processor.compute_similarity(
-                query_projection, 
-                self.dataset_features
-            )
+            # Get the top_n scores above 55% in one vectorized pass
+            similarities = self._top_k(snapshot, query_projection, top_n)[0]
             
-            # Filter and format matches
-            matches = []
-            for idx, similarity in similarities:
-                if similarity >= 55.0:  # Only include matches above 55%
-                    matches.append({
-                        "filename": self.filenames[idx],
-                        "similarity": similarity,
-                        "audioFile": self.mapper.get(self.filenames[idx])
-                    })
-                if len(matches) >= top_n:
-                    break
-            
-            self.last_execution_time = (time.time() - start_time) * 1000
+            # Format matches
+            matches = [{
+                "filename": snapshot.filenames[idx],
+                "similarity": similarity,
+                "audioFile": snapshot.mapper.get(snapshot.filenames[idx])
+            } for idx, similarity in similarities]
             return matches
 
         except Exception as e:
             print(f"Error finding matches: {str(e)}")
             raise
 
+    def find_matches_batch(self, files, top_n=5):
+        """
+        find_matches for many query images in one call.
+
+        Queries are decoded in parallel into one matrix, projected together
+        and scored against the dataset with a single matrix product. Returns
+        one {'matches', 'executionTime'} dict per query, in order, with an
+        'error' key for images that could not be decoded; executionTime is
+        the query's own decode time plus an equal share of the scoring time.
+        """
+        snapshot = self.snapshot
+        durations = np.zeros(len(files))
+        query_matrix, loaded, errors = load_image_matrix(
+            files, workers=self.decode_workers, durations=durations
+        )
+
+        score_start = time.time()
+        similarities = []
+        if loaded:
+            with TRANSFORM_SECONDS.time():
+                query_projections = snapshot.pca.transform(query_matrix)
+            similarities = self._top_k(snapshot, query_projections, top_n)
+        share = (time.time() - score_start) / len(loaded) if loaded else 0.0
+
+        results = [
+            {'matches': [], 'error': errors[i], 'executionTime': durations[i] * 1000}
+            if i in errors else None
+            for i in range(len(files))
+        ]
+        for i, query_similarities in zip(loaded, similarities):
+            results[i] = {
+                'matches': [{
+                    "filename": snapshot.filenames[idx],
+                    "similarity": similarity,
+                    "audioFile": snapshot.mapper.get(snapshot.filenames[idx])
+                } for idx, similarity in query_similarities],
+                'executionTime': (durations[i] + share) * 1000
+            }
+
+        return results
+
     def save_dataset_image(self, file, filename):
-        """Save uploaded image to dataset directory"""
+        """Save uploaded image to dataset directory (call add_images to index it)"""
         filepath = os.path.join(IMAGE_DATASET_DIR, secure_filename(filename))
         file.save(filepath)
-        # Reload dataset after adding new image
-        self.load_dataset()
+        return filepath
+
+    def add_images(self, files):
+        """
+        Save a batch of uploaded images and add them to the index.
+
+        Returns {'added': [filenames], 'failed': {filename: error}}.
+        """
+        saved, failed = self.save_dataset_images(files)
+        result = self.index_images(saved)
+        result['failed'] = dict(failed, **result['failed'])
+        return result
+
+    def save_dataset_images(self, files):
+        """Save uploaded images without indexing them; returns ([paths], {filename: error})"""
+        saved = []
+        failed = {}
+        for file in files:
+            filename = secure_filename(file.filename)
+            try:
+                saved.append(self.save_dataset_image(file, filename))
+            except Exception as e:
+                failed[filename] = str(e)
+        return saved, failed
+
+    def index_images(self, paths, progress=None):
+        """
+        Add images already saved in the dataset directory to the index.
+
+        New images are projected with the current PCA model and appended (or
+        replace same-named rows); existing projections are left untouched.
+        A full refit runs instead when there is no model yet or when the images
+        added since the last fit exceed refit_fraction of the dataset.
+        Returns {'added': [filenames], 'failed': {filename: error}}.
+        """
+        with self._write_lock:
+            return self._index_images(paths, progress)
+
+    def _index_images(self, paths, progress=None):
+        current = self.snapshot
+        failed = {}
+        images = []
+        for filepath in paths:
+            filename = os.path.basename(filepath)
+            if filename.lower().endswith(IMAGE_EXTENSIONS):
+                images.append((filename, filepath))
+            else:
+                failed[filename] = 'Unsupported image type'
+        vectors, loaded, errors = load_image_matrix(
+            [filepath for _, filepath in images], workers=self.decode_workers, progress=progress
+        )
+        names = [images[i][0] for i in loaded]
+        for i, error in errors.items():
+            failed[images[i][0]] = error
+
+        failures = dict(current.failures)
+        for filepath in paths:
+            if os.path.basename(filepath) in failed:
+                failures[os.path.basename(filepath)] = file_signature(filepath)
+        INGEST_FAILURES.labels('image').inc(len(failed))
+        if not names:
+            snapshot = self._publish(changed=False, failures=failures)
+            if paths and snapshot.pca.components is not None:
+                self._save_cache(snapshot)
+            return {'added': [], 'failed': failed}
+
+        added_since_fit = current.images_since_fit + len(names)
+        needs_refit = (
+            current.pca.components is None
+            or (self.refit_fraction > 0
+                and added_since_fit > self.refit_fraction * max(len(current.filenames), 1))
+        )
+        if needs_refit:
+            # The refit decodes every other image again; this batch's failures are already counted
+            with RELOAD_SECONDS.time():
+                self._reload(progress, known_failures=failures)
+            return {'added': names, 'failed': failed}
+
+        projections = current.pca.transform(vectors)
+        replaced = set(names)
+        kept = [i for i, f in enumerate(current.filenames) if f not in replaced]
+        filenames = [current.filenames[i] for i in kept] + names
+        features = np.vstack([np.asarray(current.features)[kept], projections])
+
+        signatures = dict(current.signatures)
+        for filename, filepath in images:
+            if filename in replaced:
+                signatures[filename] = file_signature(filepath)
+                failures.pop(filename, None)
+        snapshot = self._publish(
+            filenames=filenames,
+            features=features,
+            sq_norms=np.einsum('ij,ij->i', features, features),
+            signatures=signatures,
+            failures=failures,
+            images_since_fit=added_since_fit
+        )
+        self._save_cache(snapshot)
+        return {'added': names, 'failed': failed}
+
+    def rebuild(self, paths=None, progress=None):
+        """
+        Full reload (paths None) or index_images(paths), reporting progress(processed, total).
+
+        Entry point of the background RebuildScheduler.
+        """
+        if paths is None:
+            self.load_dataset(progress)
+            self.load_mapper()
+            return {'total': len(self.filenames)}
+        return self.index_images(paths, progress)
 
     def get_dataset_files(self):
         """Get list of all images in dataset"""
         return [f for f in os.listdir(IMAGE_DATASET_DIR) 
-                if f.lower().endswith(('.png', '.jpg', '.jpeg'))]
+                if f.lower().endswith(IMAGE_EXTENSIONS)]
 
     def load_mapper(self):
         """Load image-to-audio mapping from file"""
         mapper_json = os.path.join(IMAGE_DATASET_DIR, 'mapper.json')
         mapper_txt = os.path.join(IMAGE_DATASET_DIR, 'mapper.txt')
         
+        mapper = self.mapper
         if os.path.exists(mapper_json):
             with open(mapper_json, 'r') as f:
-                self.mapper = json.load(f)
+                mapper = json.load(f)
         elif os.path.exists(mapper_txt):
-            self.mapper = {}
+            mapper = {}
             with open(mapper_txt, 'r') as f:
                 lines = f.readlines()
                 for line in lines[1:]:  # Skip header
                     parts = line.strip().split()
                     if len(parts) >= 2:
                         audio_file, pic_name = parts[:2]
-                        self.mapper[pic_name] = audio_file
+                        mapper[pic_name] = audio_file
+        with self._write_lock:
+            self._publish(mapper=mapper)
 
     def update_mapper(self, new_mapping):
         """Update image-to-audio mapping"""
-        self.mapper = new_mapping
+        with self._write_lock:
+            self._publish(mapper=new_mapping)
         # Save to both formats for compatibility
         mapper_json = os.path.join(IMAGE_DATASET_DIR, 'mapper.json')
         with open(mapper_json, 'w') as f:
-            json.dump(self.mapper, f, indent=2)
+            json.dump(new_mapping, f, indent=2)
             
         mapper_txt = os.path.join(IMAGE_DATASET_DIR, 'mapper.txt')
         with open(mapper_txt, 'w') as f:
             f.write("audio_file pic_name\n")
-            for pic_name, audio_file in self.mapper.items():
+            for pic_name, audio_file in new_mapping.items():
                 f.write(f"{audio_file} {pic_name}\n")
 
     def get_mapper(self):
@@ -0,0 +1,133 @@
+# app/utils/archive_ingest.py
+import os
+import shutil
+import tarfile
+import tempfile
+import uuid
+import zipfile
+from werkzeug.utils import secure_filename
+
+COPY_CHUNK_SIZE = 1 << 20
+# Bytes read up front to tell zip from tar
+SNIFF_SIZE = 512
+
+
+class _PrefixedStream:
+    """Read-only stream that replays already-read bytes before the rest of stream"""
+
+    def __init__(self, prefix, stream):
+        self.prefix = prefix
+        self.stream = stream
+
+    def read(self, size=-1):
+        if not self.prefix:
+            return self.stream.read(size)
+        if size is None or size < 0:
+            data, self.prefix = self.prefix + self.stream.read(), b''
+            return data
+        data, self.prefix = self.prefix[:size], self.prefix[size:]
+        if len(data) < size:
+            data += self.stream.read(size - len(data))
+        return data
+
+
+def iter_archive_members(stream, spool_dir=None):
+    """
+    Yield (member name, binary file object) for every regular file in a zip or tar stream.
+
+    Tar archives (plain, .gz, .bz2 or .xz) are read strictly sequentially,
+    so members are yielded while the rest of the upload is still arriving.
+    Zip keeps its directory at the end of the file, so a zip stream is first
+    spooled to a temporary file in spool_dir (disk, not memory).
+    Raises ValueError for anything that is neither.
+    """
+    prefix = stream.read(SNIFF_SIZE)
+    stream = _PrefixedStream(prefix, stream)
+
+    if prefix.startswith(b'PK'):
+        with tempfile.TemporaryFile(dir=spool_dir) as spool:
+            shutil.copyfileobj(stream, spool, COPY_CHUNK_SIZE)
+            spool.seek(0)
+            try:
+                archive = zipfile.ZipFile(spool)
+            except zipfile.BadZipFile as e:
+                raise ValueError(f"Invalid zip archive: {str(e)}")
+            with archive:
+                for info in archive.infolist():
+                    if info.is_dir():
+                        continue
+                    with archive.open(info) as member:
+                        yield info.filename, member
+        return
+
+    try:
+        archive = tarfile.open(fileobj=stream, mode='r|*')
+    except tarfile.TarError as e:
+        raise ValueError(f"Unsupported archive format (expected zip or tar): {str(e)}")
+    with archive:
+        for info in archive:
+            if not info.isfile():
+                continue
+            member = archive.extractfile(info)
+            if member is not None:
+                yield info.name, member
+
+
+def ingest_archive(stream, dest_dir, allowed, on_batch, batch_size=256, max_member_size=None,
+                   spool_dir=None):
+    """
+    Save the allowed members of an archive stream into dest_dir, handing them off in batches.
+
+    Each member is copied in chunks to a temporary name and renamed into
+    place once complete, so dataset scans never see partial files. Every
+    batch_size saved paths go to on_batch(paths) right away (e.g. to a
+    RebuildScheduler), so indexing overlaps with the rest of the upload.
+    spool_dir holds the temporary copy of zip uploads. Members are saved
+    under their basename, so when several folders hold the same name only
+    the first is saved and the later ones are reported as failed.
+    Returns {'saved': [filenames], 'failed': {member name: error}}.
+    """
+    saved = []
+    failed = {}
+    batch = []
+    # filename -> member it was saved from
+    sources = {}
+    for name, member in iter_archive_members(stream, spool_dir=spool_dir):
+        filename = secure_filename(os.path.basename(name))
+        if not filename or not allowed(filename):
+            failed[name] = 'Unsupported file type'
+            continue
+        if filename in sources:
+            failed[name] = f'Duplicate file name {filename} (already saved from {sources[filename]})'
+            continue
+
+        target = os.path.join(dest_dir, filename)
+        partial = os.path.join(dest_dir, f'.{filename}.{uuid.uuid4().hex}.part')
+        try:
+            size = 0
+            with open(partial, 'wb') as out:
+                while True:
+                    chunk = member.read(COPY_CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    size += len(chunk)
+                    if max_member_size is not None and size > max_member_size:
+                        raise ValueError(f'Member larger than {max_member_size} bytes')
+                    out.write(chunk)
+            os.replace(partial, target)
+        except Exception as e:
+            failed[name] = str(e) or type(e).__name__
+            if os.path.exists(partial):
+                os.remove(partial)
+            continue
+
+        saved.append(filename)
+        sources[filename] = name
+        batch.append(target)
+        if len(batch) >= batch_size:
+            on_batch(batch)
+            batch = []
+
+    if batch:
+        on_batch(batch)
+    return {'saved': saved, 'failed': failed}
@@ -0,0 +1,459 @@
+# app/utils/audio/audio_index.py
+import numpy as np
+from app.utils.audio.ivf_index import IVFIndex, weighted_vectors
+from app.utils.metrics import stage_timer
+
+FEATURE_DIMS = {'atb': 128, 'rtb': 255, 'ftb': 255}
+FEATURE_WEIGHTS = {'atb': 0.4, 'rtb': 0.3, 'ftb': 0.3}
+FEATURE_GATES = {'atb': 0.3, 'rtb': 0.2, 'ftb': 0.2}
+# Score matrix entries computed at once by batch queries (queries x rows)
+BATCH_SCORE_ELEMENTS = 1 << 24
+
+SCORING_SECONDS = stage_timer('audio', 'scoring')
+TOP_K_SECONDS = stage_timer('audio', 'top_k')
+
+
+def l2_normalize(matrix):
+    """Scale every row to unit length; all-zero rows stay zero"""
+    matrix = np.asarray(matrix, dtype=np.float64)
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    return np.divide(matrix, norms, out=np.zeros_like(matrix), where=norms > 0)
+
+
+def combine_similarities(atb_sim, rtb_sim, ftb_sim, similarity_threshold):
+    """
+    Gate, weight and rescale per-feature cosine similarities (array version).
+
+    Mirrors the scalar rules: any feature under its gate scores 0, the
+    0.4/0.3/0.3 weighted sum must reach the threshold, and the result is
+    rescaled to a 0-100 percentage rounded to two decimals.
+    """
+    atb_sim = np.clip(atb_sim, 0.0, 1.0)
+    rtb_sim = np.clip(rtb_sim, 0.0, 1.0)
+    ftb_sim = np.clip(ftb_sim, 0.0, 1.0)
+
+    similarity = (FEATURE_WEIGHTS['atb'] * atb_sim
+                  + FEATURE_WEIGHTS['rtb'] * rtb_sim
+                  + FEATURE_WEIGHTS['ftb'] * ftb_sim)
+    passed = ((atb_sim >= FEATURE_GATES['atb'])
+              & (rtb_sim >= FEATURE_GATES['rtb'])
+              & (ftb_sim >= FEATURE_GATES['ftb'])
+              & (similarity >= similarity_threshold))
+
+    scaled = (similarity - similarity_threshold) / (1 - similarity_threshold) * 100
+    scaled = np.round(np.minimum(scaled, 100.0), 2)
+    return np.where(passed, scaled, 0.0)
+
+
+def query_matrices(queries):
+    """Stack raw query feature dicts into normalized Q x dim matrices per feature"""
+    return {
+        name: l2_normalize(np.array([q[name] for q in queries], dtype=np.float64).reshape(-1, dim))
+        for name, dim in FEATURE_DIMS.items()
+    }
+
+
+def transposition_shifts(max_shift):
+    """Pitch shifts 0, -1, +1, ..., -max_shift, +max_shift (ties resolve to the smallest shift)"""
+    max_shift = min(max_shift, FEATURE_DIMS['atb'] - 1)
+    return np.array([0] + [shift for k in range(1, max_shift + 1) for shift in (-k, k)], dtype=np.int64)
+
+
+def transposed_query_matrices(queries, shifts):
+    """
+    query_matrices with the ATB of every query transposed by every shift.
+
+    ATB rows are ordered query by query, shift by shift (Q * S x 128); bins
+    pushed outside 0..127 are dropped before normalizing. RTB and FTB only
+    see intervals, so they are the same for every shift and stay Q x dim.
+    """
+    atb = np.array([q['atb'] for q in queries], dtype=np.float64).reshape(-1, FEATURE_DIMS['atb'])
+    shifted = np.zeros((len(atb), len(shifts), FEATURE_DIMS['atb']))
+    for j, shift in enumerate(shifts):
+        if shift >= 0:
+            shifted[:, j, shift:] = atb[:, :FEATURE_DIMS['atb'] - shift]
+        else:
+            shifted[:, j, :shift] = atb[:, -shift:]
+    matrices = query_matrices(queries)
+    matrices['atb'] = l2_normalize(shifted).reshape(-1, FEATURE_DIMS['atb'])
+    return matrices
+
+
+def best_shift(scores):
+    """Reduce Q x S x N scores over the shift axis: (Q x N best scores, Q x N shift positions)"""
+    best = np.argmax(scores, axis=1)
+    return np.take_along_axis(scores, best[:, None, :], axis=1)[:, 0, :], best
+
+
+def query_blocks(n_queries, n_rows):
+    """Slices of the query batch whose score matrices stay under BATCH_SCORE_ELEMENTS"""
+    step = max(1, BATCH_SCORE_ELEMENTS // max(n_rows, 1))
+    return [slice(start, start + step) for start in range(0, n_queries, step)]
+
+
+def top_indices(scores, top_n, min_score):
+    """Indices of the top_n scores >= min_score, best first (ties keep row order)"""
+    candidates = np.flatnonzero(scores >= min_score)
+    if top_n is not None and len(candidates) > top_n:
+        # Keep every row tied with the top_n-th score, so the cut below falls by row order
+        kth = np.partition(-scores[candidates], top_n - 1)[top_n - 1]
+        candidates = candidates[scores[candidates] >= -kth]
+    order = np.lexsort((candidates, -scores[candidates]))
+    return candidates[order][:top_n]
+
+
+class AudioIndex:
+    """
+    Immutable corpus index: one contiguous, L2-normalized matrix per feature.
+
+    Row i of ``atb`` (N x 128), ``rtb`` (N x 255) and ``ftb`` (N x 255)
+    belongs to ``filenames[i]``. Updates return a new index instead of
+    mutating this one. ``ann`` is an optional IVFIndex over the same rows,
+    carried along by take/merge/without.
+    """
+
+    def __init__(self, filenames, atb, rtb, ftb, ann=None):
+        self.filenames = list(filenames)
+        self.positions = {filename: i for i, filename in enumerate(self.filenames)}
+        self.atb = atb
+        self.rtb = rtb
+        self.ftb = ftb
+        self.ann = ann
+
+    @classmethod
+    def empty(cls):
+        return cls([], *(np.zeros((0, dim)) for dim in FEATURE_DIMS.values()))
+
+    @classmethod
+    def from_features(cls, filenames, features):
+        """Build an index from raw feature dicts (as returned by feature extraction)"""
+        matrices = [
+            l2_normalize(np.array([f[name] for f in features], dtype=np.float64).reshape(-1, dim))
+            for name, dim in FEATURE_DIMS.items()
+        ]
+        return cls(filenames, *matrices)
+
+    def __len__(self):
+        return len(self.filenames)
+
+    def __contains__(self, filename):
+        return filename in self.positions
+
+    def matrices(self):
+        return {'atb': self.atb, 'rtb': self.rtb, 'ftb': self.ftb}
+
+    def take(self, filenames):
+        """New index restricted to the given filenames, in that order"""
+        rows = np.array([self.positions[f] for f in filenames], dtype=np.intp)
+        ann = self.ann.take(rows) if self.ann is not None else None
+        return AudioIndex(filenames, self.atb[rows], self.rtb[rows], self.ftb[rows], ann=ann)
+
+    def merge(self, other):
+        """New index with other's rows added, replacing rows with the same filename"""
+        kept = [f for f in self.filenames if f not in other.positions]
+        base = self.take(kept) if len(kept) != len(self) else self
+        ann = None
+        if base.ann is not None:
+            ann = base.ann.extend(other.atb, other.rtb, other.ftb)
+        return AudioIndex(
+            kept + other.filenames,
+            np.concatenate([base.atb, other.atb]),
+            np.concatenate([base.rtb, other.rtb]),
+            np.concatenate([base.ftb, other.ftb]),
+            ann=ann,
+        )
+
+    def without(self, filenames):
+        """New index without the given filenames"""
+        dropped = set(filenames)
+        return self.take([f for f in self.filenames if f not in dropped])
+
+    def with_ann(self, n_lists=None, seed=0):
+        """New index over the same rows with a freshly trained IVF index (self when empty)"""
+        if len(self) == 0:
+            return self
+        ann = IVFIndex.build(self.atb, self.rtb, self.ftb, FEATURE_WEIGHTS, n_lists=n_lists, seed=seed)
+        return AudioIndex(self.filenames, self.atb, self.rtb, self.ftb, ann=ann)
+
+    def similarities(self, query, similarity_threshold, rows=None):
+        """Score a raw query feature dict against every row, or only the given rows (0-100)"""
+        atb, rtb, ftb = self.atb, self.rtb, self.ftb
+        if rows is not None:
+            atb, rtb, ftb = atb[rows], rtb[rows], ftb[rows]
+        atb_sim = atb @ l2_normalize(query['atb'])
+        rtb_sim = rtb @ l2_normalize(query['rtb'])
+        ftb_sim = ftb @ l2_normalize(query['ftb'])
+        return combine_similarities(atb_sim, rtb_sim, ftb_sim, similarity_threshold)
+
+    def batch_similarities(self, queries, similarity_threshold):
+        """Score Q stacked, normalized query matrices against every row at once (Q x N, 0-100)"""
+        atb_sim = queries['atb'] @ self.atb.T
+        rtb_sim = queries['rtb'] @ self.rtb.T
+        ftb_sim = queries['ftb'] @ self.ftb.T
+        return combine_similarities(atb_sim, rtb_sim, ftb_sim, similarity_threshold)
+
+    def top_matches_batch(self, queries, similarity_threshold, top_n=1, min_similarity=0.0):
+        """
+        top_matches for many raw query feature dicts, exact search only.
+
+        Each block of queries is scored with one matrix-matrix product per
+        feature instead of one matrix-vector product per query.
+        """
+        return [
+            [(self.filenames[row], similarity) for row, similarity in matches]
+            for matches in self.top_rows_batch(
+                query_matrices(queries), similarity_threshold, top_n, min_similarity
+            )
+        ]
+
+    def top_rows_batch(self, matrices, similarity_threshold, top_n=1, min_similarity=0.0):
+        """top_matches_batch for normalized query matrices, as [(row, similarity)] per query"""
+        results = []
+        for block in query_blocks(len(matrices['atb']), len(self)):
+            with SCORING_SECONDS.time():
+                scores = self.batch_similarities(
+                    {name: matrix[block] for name, matrix in matrices.items()}, similarity_threshold
+                )
+            with TOP_K_SECONDS.time():
+                for row_scores in scores:
+                    best = top_indices(row_scores, top_n, min_similarity)
+                    results.append([(int(row), float(row_scores[row])) for row in best])
+        return results
+
+    def transposed_similarities(self, queries, n_shifts, similarity_threshold):
+        """
+        Score transposed query matrices against every row (Q x S x N, 0-100).
+
+        All Q * S shifted ATB rows go through one matrix-matrix product; the
+        RTB and FTB scores are computed once per query and broadcast.
+        """
+        atb_sim = (queries['atb'] @ self.atb.T).reshape(-1, n_shifts, len(self))
+        rtb_sim = (queries['rtb'] @ self.rtb.T)[:, None, :]
+        ftb_sim = (queries['ftb'] @ self.ftb.T)[:, None, :]
+        return combine_similarities(atb_sim, rtb_sim, ftb_sim, similarity_threshold)
+
+    def top_matches_transposed(self, queries, similarity_threshold, shifts, top_n=1, min_similarity=0.0):
+        """
+        Key-invariant top_matches for raw query feature dicts: [(filename, similarity, shift)] per query.
+
+        Every song scores as its best pitch shift of the query; shift is the
+        number of semitones the query was transposed by. Exact search only.
+        """
+        return [
+            [(self.filenames[row], similarity, shift) for row, similarity, shift in matches]
+            for matches in self.top_rows_transposed(
+                transposed_query_matrices(queries, shifts), similarity_threshold, shifts,
+                top_n, min_similarity
+            )
+        ]
+
+    def top_rows_transposed(self, matrices, similarity_threshold, shifts, top_n=1, min_similarity=0.0):
+        """top_matches_transposed for transposed query matrices, as [(row, similarity, shift)] per query"""
+        n_shifts = len(shifts)
+        results = []
+        for block in query_blocks(len(matrices['rtb']), len(self) * n_shifts):
+            atb_rows = slice(block.start * n_shifts, block.stop * n_shifts)
+            with SCORING_SECONDS.time():
+                scores, best = best_shift(self.transposed_similarities(
+                    {'atb': matrices['atb'][atb_rows], 'rtb': matrices['rtb'][block],
+                     'ftb': matrices['ftb'][block]},
+                    n_shifts, similarity_threshold
+                ))
+            with TOP_K_SECONDS.time():
+                for row_scores, row_shifts in zip(scores, best):
+                    rows = top_indices(row_scores, top_n, min_similarity)
+                    results.append([
+                        (int(row), float(row_scores[row]), int(shifts[row_shifts[row]]))
+                        for row in rows
+                    ])
+        return results
+
+    def top_matches(self, query, similarity_threshold, top_n=1, min_similarity=0.0, nprobe=None):
+        """
+        Best matching rows as [(filename, similarity)], best first.
+
+        With nprobe and an ANN index only the rows in the nprobe closest IVF
+        lists are scored (approximate); otherwise every row is scored.
+        """
+        rows = None
+        if nprobe is not None and self.ann is not None:
+            query_vector = weighted_vectors(
+                l2_normalize(query['atb']), l2_normalize(query['rtb']),
+                l2_normalize(query['ftb']), FEATURE_WEIGHTS
+            )
+            rows = self.ann.candidates(query_vector, nprobe)
+
+        with SCORING_SECONDS.time():
+            scores = self.similarities(query, similarity_threshold, rows=rows)
+        with TOP_K_SECONDS.time():
+            best = top_indices(scores, top_n, min_similarity)
+        row_ids = rows[best] if rows is not None else best
+        return [(self.filenames[row], float(scores[i])) for row, i in zip(row_ids, best)]
+
+
+class WindowIndex:
+    """
+    Immutable segment-level index: per-window normalized features in flat matrices.
+
+    Windows of one song occupy consecutive rows; ``counts[s]`` windows belong
+    to ``filenames[s]`` and ``starts`` holds each window's offset in seconds.
+    Matrices are float32 so millions of windows stay within memory and BLAS
+    bandwidth.
+    """
+
+    def __init__(self, filenames, counts, atb, rtb, ftb, starts):
+        self.filenames = list(filenames)
+        self.positions = {filename: i for i, filename in enumerate(self.filenames)}
+        self.counts = np.asarray(counts, dtype=np.int64)
+        self.offsets = np.concatenate([[0], np.cumsum(self.counts)]).astype(np.int64)
+        self.atb = atb
+        self.rtb = rtb
+        self.ftb = ftb
+        self.starts = starts
+
+    @classmethod
+    def empty(cls):
+        matrices = [np.zeros((0, dim), dtype=np.float32) for dim in FEATURE_DIMS.values()]
+        return cls([], [], *matrices, np.zeros(0, dtype=np.float32))
+
+    @classmethod
+    def from_windows(cls, filenames, windows):
+        """Build from per-song window dicts ({'atb', 'rtb', 'ftb': W x dim, 'start': W})"""
+        counts = [len(w['start']) for w in windows]
+        matrices = [
+            l2_normalize(np.concatenate([w[name] for w in windows]) if windows
+                         else np.zeros((0, dim))).astype(np.float32)
+            for name, dim in FEATURE_DIMS.items()
+        ]
+        starts = np.concatenate([w['start'] for w in windows]) if windows else np.zeros(0)
+        return cls(filenames, counts, *matrices, starts.astype(np.float32))
+
+    def __len__(self):
+        return len(self.filenames)
+
+    def __contains__(self, filename):
+        return filename in self.positions
+
+    def matrices(self):
+        return {'atb': self.atb, 'rtb': self.rtb, 'ftb': self.ftb, 'start': self.starts}
+
+    def _rows(self, songs):
+        """Window row indices of the given song positions, in order"""
+        songs = np.asarray(songs, dtype=np.intp)
+        counts = self.counts[songs]
+        if counts.sum() == 0:
+            return np.zeros(0, dtype=np.intp)
+        shift = np.repeat(self.offsets[songs] - np.concatenate([[0], np.cumsum(counts)[:-1]]), counts)
+        return np.arange(counts.sum(), dtype=np.intp) + shift
+
+    def take(self, filenames):
+        """New index restricted to the given songs, in that order"""
+        songs = [self.positions[f] for f in filenames]
+        rows = self._rows(songs)
+        return WindowIndex(filenames, self.counts[songs], self.atb[rows], self.rtb[rows],
+                           self.ftb[rows], self.starts[rows])
+
+    def merge(self, other):
+        """New index with other's songs added, replacing songs with the same filename"""
+        kept = [f for f in self.filenames if f not in other.positions]
+        base = self.take(kept) if len(kept) != len(self) else self
+        return WindowIndex(
+            kept + other.filenames,
+            np.concatenate([base.counts, other.counts]),
+            np.concatenate([base.atb, other.atb]),
+            np.concatenate([base.rtb, other.rtb]),
+            np.concatenate([base.ftb, other.ftb]),
+            np.concatenate([base.starts, other.starts]),
+        )
+
+    def without(self, filenames):
+        """New index without the given songs"""
+        dropped = set(filenames)
+        return self.take([f for f in self.filenames if f not in dropped])
+
+    def similarities(self, query, similarity_threshold):
+        """Score a raw query feature dict against every window (0-100 per window)"""
+        # float32 products, float64 gating so rounding matches the song index
+        atb_sim = (self.atb @ l2_normalize(query['atb']).astype(np.float32)).astype(np.float64)
+        rtb_sim = (self.rtb @ l2_normalize(query['rtb']).astype(np.float32)).astype(np.float64)
+        ftb_sim = (self.ftb @ l2_normalize(query['ftb']).astype(np.float32)).astype(np.float64)
+        return combine_similarities(atb_sim, rtb_sim, ftb_sim, similarity_threshold)
+
+    def batch_similarities(self, queries, similarity_threshold):
+        """Score Q stacked, normalized query matrices against every window at once (Q x W)"""
+        atb_sim = (queries['atb'].astype(np.float32) @ self.atb.T).astype(np.float64)
+        rtb_sim = (queries['rtb'].astype(np.float32) @ self.rtb.T).astype(np.float64)
+        ftb_sim = (queries['ftb'].astype(np.float32) @ self.ftb.T).astype(np.float64)
+        return combine_similarities(atb_sim, rtb_sim, ftb_sim, similarity_threshold)
+
+    def transposed_similarities(self, queries, n_shifts, similarity_threshold):
+        """Score transposed query matrices against every window at once (Q x S x W)"""
+        atb_sim = (queries['atb'].astype(np.float32) @ self.atb.T).astype(np.float64)
+        rtb_sim = (queries['rtb'].astype(np.float32) @ self.rtb.T).astype(np.float64)
+        ftb_sim = (queries['ftb'].astype(np.float32) @ self.ftb.T).astype(np.float64)
+        return combine_similarities(atb_sim.reshape(-1, n_shifts, len(self.starts)),
+                                    rtb_sim[:, None, :], ftb_sim[:, None, :], similarity_threshold)
+
+    def top_matches_transposed(self, queries, similarity_threshold, shifts, top_n=1, min_similarity=0.0):
+        """Key-invariant top_matches: [(filename, similarity, offset, shift)] per query"""
+        if len(self.starts) == 0:
+            return [[] for _ in queries]
+        n_shifts = len(shifts)
+        matrices = transposed_query_matrices(queries, shifts)
+        results = []
+        for block in query_blocks(len(queries), len(self.starts) * n_shifts):
+            atb_rows = slice(block.start * n_shifts, block.stop * n_shifts)
+            with SCORING_SECONDS.time():
+                scores, best = best_shift(self.transposed_similarities(
+                    {'atb': matrices['atb'][atb_rows], 'rtb': matrices['rtb'][block],
+                     'ftb': matrices['ftb'][block]},
+                    n_shifts, similarity_threshold
+                ))
+            with TOP_K_SECONDS.time():
+                results.extend(
+                    self._song_matches(row_scores, top_n, min_similarity, shifts[row_shifts])
+                    for row_scores, row_shifts in zip(scores, best)
+                )
+        return results
+
+    def top_matches(self, query, similarity_threshold, top_n=1, min_similarity=0.0):
+        """
+        Best matching songs as [(filename, similarity, offset)], best first.
+
+        A song scores as its best window; offset is that window's start in seconds.
+        """
+        if len(self.starts) == 0:
+            return []
+        with SCORING_SECONDS.time():
+            scores = self.similarities(query, similarity_threshold)
+        with TOP_K_SECONDS.time():
+            return self._song_matches(scores, top_n, min_similarity)
+
+    def top_matches_batch(self, queries, similarity_threshold, top_n=1, min_similarity=0.0):
+        """top_matches for many raw query feature dicts, scoring blocks of queries at once"""
+        if len(self.starts) == 0:
+            return [[] for _ in queries]
+        matrices = query_matrices(queries)
+        results = []
+        for block in query_blocks(len(queries), len(self.starts)):
+            with SCORING_SECONDS.time():
+                scores = self.batch_similarities(
+                    {name: matrix[block] for name, matrix in matrices.items()}, similarity_threshold
+                )
+            with TOP_K_SECONDS.time():
+                results.extend(self._song_matches(row_scores, top_n, min_similarity) for row_scores in scores)
+        return results
+
+    def _song_matches(self, scores, top_n, min_similarity, shifts=None):
+        """Best songs for one query's per-window scores (plus the best window's shift if given)"""
+        song_scores = np.maximum.reduceat(scores, self.offsets[:-1])
+
+        matches = []
+        for song in top_indices(song_scores, top_n, min_similarity):
+            first, last = self.offsets[song], self.offsets[song + 1]
+            best_window = first + int(np.argmax(scores[first:last]))
+            match = (self.filenames[song], float(song_scores[song]), float(self.starts[best_window]))
+            if shifts is not None:
+                match += (int(shifts[best_window]),)
+            matches.append(match)
+        return matches
@@ -1,32 +1,26 @@
 # app/utils/audio/feature_extraction.py
-import pretty_midi
 import numpy as np
-import warnings
+from ..audio.smf_reader import read_notes
 from ..audio.window_processor import process_audio_window
 from ..audio.tempo_normalizer import normalize_tempo
 
 def extract_features(midi_file):
     """Extract ATB, RTB, and FTB features from MIDI file"""
     try:
-        # Suppress warnings about MIDI format
-        with warnings.catch_warnings():
-            warnings.simplefilter("ignore")
-            midi_data = pretty_midi.PrettyMIDI(midi_file)
+        # Note-only SMF reader (pretty_midi order), pretty_midi for files it cannot read
+        notes = read_notes(midi_file)
         
         # Get all non-drum tracks
-        melody_notes = []
-        for instrument in midi_data.instruments:
-            if not instrument.is_drum:
-                melody_notes.extend(instrument.notes)
+        melody_notes = notes[~notes['drum']]
         
-        if not melody_notes:
+        if len(melody_notes) == 0:
             raise ValueError("No melody found in MIDI file")
 
-        # Sort notes by start time
-        melody_notes.sort(key=lambda x: x.start)
+        # Sort notes by start time (stable, like list.sort)
+        melody_notes = melody_notes[np.argsort(melody_notes['start'], kind='stable')]
         
         # Extract pitches
-        pitches = [note.pitch for note in melody_notes]
+        pitches = melody_notes['pitch'].astype(np.int64)
         
         # Normalize pitches
         normalized_pitches = normalize_tempo(pitches)
@@ -46,36 +40,35 @@ def extract_features(midi_file):
 
 def calculate_atb(pitches):
     """Calculate Absolute Tone Based histogram"""
-    histogram = np.zeros(128)  # MIDI pitches range from 0-127
-    for pitch in pitches:
-        histogram[int(pitch)] += 1
+    # MIDI pitches range from 0-127; negative indices wrap like list indexing
+    index = np.asarray(pitches, dtype=np.float64).astype(np.int64)
+    if np.any((index < -128) | (index >= 128)):
+        raise IndexError("index out of bounds for axis 0 with size 128")
+    index = np.where(index < 0, index + 128, index)
+    histogram = np.bincount(index, minlength=128).astype(np.float64)
     return normalize_histogram(histogram)
 
 def calculate_rtb(pitches):
     """Calculate Relative Tone Based histogram"""
-    histogram = np.zeros(255)  # Range from -127 to +127
-    for i in range(1, len(pitches)):
-        diff = int(pitches[i] - pitches[i-1])
-        # Shift to positive index (diff ranges from -127 to 127)
-        index = diff + 127  # Center at 127
-        if 0 <= index < 255:  # Ensure within bounds
-            histogram[index] += 1
-    return normalize_histogram(histogram)
+    pitches = np.asarray(pitches, dtype=np.float64)
+    # Shift to positive index (diff ranges from -127 to 127), centered at 127
+    index = np.diff(pitches).astype(np.int64) + 127
+    return normalize_histogram(_interval_histogram(index))
 
 def calculate_ftb(pitches):
     """Calculate First Tone Based histogram"""
-    if not pitches:
+    pitches = np.asarray(pitches, dtype=np.float64)
+    if len(pitches) == 0:
         return np.zeros(255)
     
-    histogram = np.zeros(255)  # Range from -127 to +127
-    first_pitch = pitches[0]
-    for pitch in pitches[1:]:
-        diff = int(pitch - first_pitch)
-        # Shift to positive index
-        index = diff + 127  # Center at 127
-        if 0 <= index < 255:  # Ensure within bounds
-            histogram[index] += 1
-    return normalize_histogram(histogram)
+    # Shift to positive index, centered at 127
+    index = (pitches[1:] - pitches[0]).astype(np.int64) + 127
+    return normalize_histogram(_interval_histogram(index))
+
+def _interval_histogram(index):
+    """Count interval indices into a 255-bin histogram (-127 to +127), ignoring out of range"""
+    index = index[(index >= 0) & (index < 255)]
+    return np.bincount(index, minlength=255).astype(np.float64)
 
 def normalize_histogram(histogram):
     """
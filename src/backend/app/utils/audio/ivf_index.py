@@ -0,0 +1,106 @@
+# app/utils/audio/ivf_index.py
+import numpy as np
+
+# Rows per block when assigning vectors to centroids, bounds the N x lists score matrix
+ASSIGN_BLOCK = 65536
+
+
+def weighted_vectors(atb, rtb, ftb, weights):
+    """
+    Concatenate unit ATB/RTB/FTB rows scaled by sqrt(weight), as float32.
+
+    The dot product of two such vectors is the 0.4/0.3/0.3 weighted sum of the
+    per-feature cosines, i.e. the same quantity the exact scorer ranks by.
+    """
+    parts = [
+        np.asarray(matrix, dtype=np.float32) * np.float32(np.sqrt(weights[name]))
+        for name, matrix in (('atb', atb), ('rtb', rtb), ('ftb', ftb))
+    ]
+    return np.concatenate(parts, axis=-1)
+
+
+def assign(vectors, centroids):
+    """Index of the best (max inner product) centroid for every vector"""
+    labels = np.empty(len(vectors), dtype=np.int32)
+    for start in range(0, len(vectors), ASSIGN_BLOCK):
+        block = vectors[start:start + ASSIGN_BLOCK]
+        labels[start:start + len(block)] = np.argmax(block @ centroids.T, axis=1)
+    return labels
+
+
+def spherical_kmeans(vectors, n_clusters, n_iter=10, sample_size=None, seed=0):
+    """
+    Train unit-norm centroids with spherical k-means on a random sample.
+
+    Empty clusters are re-seeded from random sample points.
+    """
+    rng = np.random.default_rng(seed)
+    if sample_size is not None and len(vectors) > sample_size:
+        vectors = vectors[np.sort(rng.choice(len(vectors), sample_size, replace=False))]
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    n_clusters = min(n_clusters, len(vectors))
+
+    centroids = vectors[rng.choice(len(vectors), n_clusters, replace=False)].copy()
+    for _ in range(n_iter):
+        labels = assign(vectors, centroids)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, labels, vectors)
+        empty = np.flatnonzero(np.bincount(labels, minlength=n_clusters) == 0)
+        sums[empty] = vectors[rng.choice(len(vectors), len(empty))]
+        norms = np.linalg.norm(sums, axis=1, keepdims=True)
+        centroids = np.divide(sums, norms, out=sums, where=norms > 0)
+    return centroids
+
+
+class IVFIndex:
+    """
+    Inverted-file index with k-means coarse quantization.
+
+    Rows of the owning index are bucketed by their nearest centroid; a query
+    only scores the rows in its ``nprobe`` closest buckets, so ``nprobe``
+    trades recall for latency (nprobe == n_lists is exhaustive).
+    """
+
+    def __init__(self, centroids, labels, weights):
+        self.centroids = centroids
+        self.labels = labels
+        self.weights = weights
+        order = np.argsort(labels, kind='stable')
+        self.list_rows = order.astype(np.int64)
+        self.list_offsets = np.concatenate(
+            [[0], np.cumsum(np.bincount(labels, minlength=len(centroids)))]
+        )
+
+    @property
+    def n_lists(self):
+        return len(self.centroids)
+
+    @classmethod
+    def build(cls, atb, rtb, ftb, weights, n_lists=None, n_iter=10, seed=0):
+        """Train centroids on the corpus and bucket every row"""
+        vectors = weighted_vectors(atb, rtb, ftb, weights)
+        if n_lists is None or n_lists <= 0:
+            n_lists = int(np.clip(np.sqrt(len(vectors)), 1, 4096))
+        centroids = spherical_kmeans(vectors, n_lists, n_iter=n_iter,
+                                     sample_size=64 * n_lists, seed=seed)
+        return cls(centroids, assign(vectors, centroids), weights)
+
+    def take(self, rows):
+        """Index for a subset/reordering of the owning index's rows"""
+        return IVFIndex(self.centroids, self.labels[rows], self.weights)
+
+    def extend(self, atb, rtb, ftb):
+        """Index with extra rows appended, bucketed by the existing centroids"""
+        labels = assign(weighted_vectors(atb, rtb, ftb, self.weights), self.centroids)
+        return IVFIndex(self.centroids, np.concatenate([self.labels, labels]), self.weights)
+
+    def candidates(self, query_vector, nprobe):
+        """Rows stored in the nprobe lists whose centroids best match the query"""
+        nprobe = max(1, min(nprobe, self.n_lists))
+        scores = self.centroids @ query_vector
+        if nprobe < self.n_lists:
+            lists = np.argpartition(-scores, nprobe - 1)[:nprobe]
+        else:
+            lists = np.arange(self.n_lists)
+        rows = [self.list_rows[self.list_offsets[l]:self.list_offsets[l + 1]] for l in lists]
+        return np.sort(np.concatenate(rows)) if rows else np.zeros(0, dtype=np.int64)
@@ -0,0 +1,80 @@
+# app/utils/audio/parallel_extractor.py
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from app.utils.metrics import STAGE_SECONDS
+
+
+def _safe_extract(extract, filepath):
+    """Run extract in a worker, returning (features, error) instead of raising"""
+    try:
+        return extract(filepath), None
+    except Exception as e:
+        return None, str(e) or type(e).__name__
+
+
+def _pool_extract(extract, filepath):
+    """_safe_extract plus the stage timings it recorded, which would otherwise stay in the worker"""
+    features, error = _safe_extract(extract, filepath)
+    return features, error, STAGE_SECONDS.drain()
+
+
+def pool_context():
+    """
+    Start method for worker pools: never fork.
+
+    Pools are created from background threads of a threaded server, and
+    forking a multi-threaded process can copy locks in a held state.
+    forkserver forks from a clean single-threaded server process; spawn
+    is the fallback where it is unavailable.
+    """
+    methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+
+
+def extract_many(extract, paths, workers=None, chunk_size=16, progress=None):
+    """
+    Run a feature extractor over many files, in a process pool when it pays off.
+
+    Stage timings (midi_parse, histogram_build) recorded by pool workers
+    are shipped back with each result and merged into this process's
+    metrics, so /metrics covers both the pool and the serial path.
+
+    Args:
+        extract: picklable callable (module-level function or staticmethod)
+        paths: file paths to process
+        workers: number of processes; None uses os.cpu_count(), <= 1 runs serially
+        chunk_size: paths handed to a worker per task
+        progress: optional callback(processed, total) called as results arrive
+    Returns:
+        (results, failures) where results is a list of (path, features) in
+        input order and failures maps path -> error message
+    """
+    paths = list(paths)
+    if workers is None:
+        workers = os.cpu_count() or 1
+    workers = min(workers, len(paths))
+
+    if workers <= 1:
+        outcomes = map(partial(_safe_extract, extract), paths)
+        return _collect(paths, outcomes, progress)
+
+    with ProcessPoolExecutor(max_workers=workers, mp_context=pool_context()) as executor:
+        outcomes = executor.map(partial(_pool_extract, extract), paths, chunksize=max(1, chunk_size))
+        return _collect(paths, outcomes, progress)
+
+
+def _collect(paths, outcomes, progress=None):
+    results = []
+    failures = {}
+    for done, (path, (features, error, *timings)) in enumerate(zip(paths, outcomes), 1):
+        if timings:
+            STAGE_SECONDS.merge(timings[0])
+        if progress is not None:
+            progress(done, len(paths))
+        if error is None:
+            results.append((path, features))
+        else:
+            failures[path] = error
+    return results, failures
@@ -0,0 +1,299 @@
+# app/utils/audio/smf_reader.py
+import io
+import math
+import os
+import struct
+import warnings
+import numpy as np
+import pretty_midi
+
+# pretty_midi rejects files whose last tick is beyond this as corrupt
+MAX_TICK = 1e7
+# mido refuses meta and sysex payloads longer than this
+MAX_MESSAGE_LENGTH = 1000000
+
+SEQUENCE_NUMBER = 0x00
+CHANNEL_PREFIX = 0x20
+SET_TEMPO = 0x51
+SMPTE_OFFSET = 0x54
+TIME_SIGNATURE = 0x58
+KEY_SIGNATURE = 0x59
+# Meta types mido knows (text 0x01-0x07 and 0x09, not 0x08); it drops the delta of any other
+KNOWN_META_TYPES = frozenset([0x01, 0x02, 0x03, 0x04, 0x05, 0x06, 0x07, 0x09,
+                              SEQUENCE_NUMBER, CHANNEL_PREFIX, 0x21, 0x2f, SET_TEMPO,
+                              SMPTE_OFFSET, TIME_SIGNATURE, KEY_SIGNATURE, 0x7f])
+# Shortest payload mido can decode for these types
+META_MIN_LENGTH = {CHANNEL_PREFIX: 1, SET_TEMPO: 3, SMPTE_OFFSET: 5, TIME_SIGNATURE: 4, KEY_SIGNATURE: 2}
+DRUM_CHANNEL = 9
+
+# One row per note, in pretty_midi's instrument order and note order
+SMF_NOTE_DTYPE = np.dtype([
+    ('pitch', np.int16),
+    ('velocity', np.int16),
+    ('start', np.float64),
+    ('end', np.float64),
+    ('drum', np.bool_)
+])
+
+
+def _read_varint(data, pos):
+    value = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        value = (value << 7) | (byte & 0x7f)
+        if byte < 0x80:
+            return value, pos
+
+
+def _read_payload(data, pos):
+    """Length-prefixed meta/sysex payload starting at pos; returns (bytes, new pos)"""
+    length, pos = _read_varint(data, pos)
+    if length > MAX_MESSAGE_LENGTH:
+        raise ValueError(f'Message length {length} exceeds maximum length {MAX_MESSAGE_LENGTH}')
+    payload = data[pos:pos + length]
+    if len(payload) < length:
+        raise ValueError('Unexpected end of file')
+    return payload, pos + length
+
+
+def _check_meta(meta_type, payload):
+    """Raise wherever mido's meta decoding would (short payloads, out-of-range fields)"""
+    if len(payload) < META_MIN_LENGTH.get(meta_type, 0):
+        raise ValueError(f'Meta message 0x{meta_type:02x} is too short')
+    if meta_type == SEQUENCE_NUMBER and len(payload) == 1:
+        raise ValueError('Sequence number needs 0 or 2 data bytes')
+    if meta_type == SMPTE_OFFSET:
+        if payload[0] >> 5 > 3:
+            raise ValueError('Unknown SMPTE frame rate')
+        if payload[1] > 59 or payload[2] > 59 or payload[4] > 99:
+            raise ValueError('SMPTE offset out of range')
+    if meta_type == TIME_SIGNATURE and math.log(2 ** payload[1], 2) != payload[1]:
+        # mido checks the power of 2 with a float log, which is inexact for some exponents
+        raise ValueError('denominator must be a power of 2')
+    if meta_type == KEY_SIGNATURE:
+        key = payload[0] - 256 if payload[0] > 127 else payload[0]
+        if not -7 <= key <= 7 or payload[1] not in (0, 1):
+            raise ValueError(f'Could not decode key signature {key}, mode {payload[1]}')
+
+
+def _chunk_header(data, pos, name):
+    header = data[pos:pos + 8]
+    if len(header) < 8:
+        raise ValueError('Unexpected end of file')
+    chunk, size = struct.unpack('>4sL', header)
+    if chunk != name:
+        raise ValueError(f'{name.decode()} chunk not found')
+    return size, pos + 8
+
+
+def _tick_times(ticks, tempo_changes, resolution):
+    """
+    Seconds of each tick under track 0's tempo map, computed like pretty_midi.
+
+    The same float operations in the same order as pretty_midi's tick-to-time
+    table, evaluated only at the ticks that are needed.
+    """
+    tick_scales = [(0, 60.0 / (120.0 * resolution))]
+    for tick, tempo in tempo_changes:
+        if tick == 0:
+            bpm = 6e7 / tempo
+            tick_scales = [(0, 60.0 / (bpm * resolution))]
+        else:
+            _, last_tick_scale = tick_scales[-1]
+            tick_scale = 60.0 / ((6e7 / tempo) * resolution)
+            # Repeated tempos are ignored, as pretty_midi does
+            if tick_scale != last_tick_scale:
+                tick_scales.append((tick, tick_scale))
+
+    starts = np.array([tick for tick, _ in tick_scales], dtype=np.int64)
+    scales = np.array([scale for _, scale in tick_scales], dtype=np.float64)
+    offsets = np.zeros(len(tick_scales))
+    for i in range(1, len(tick_scales)):
+        offsets[i] = offsets[i - 1] + scales[i - 1] * (starts[i] - starts[i - 1])
+
+    ticks = np.asarray(ticks, dtype=np.int64)
+    interval = np.searchsorted(starts, ticks, side='right') - 1
+    return offsets[interval] + scales[interval] * (ticks - starts[interval])
+
+
+def read_smf_notes(data):
+    """
+    Notes of a Standard MIDI File as a SMF_NOTE_DTYPE array, without building a PrettyMIDI object.
+
+    Walks every track chunk once and pairs note-on/note-off events exactly
+    as pretty_midi does: tempo comes from track 0 only, one note-off closes
+    every open note of its channel and pitch started on an earlier tick, and
+    notes are grouped by (program, channel, track) instrument in the order
+    pretty_midi creates those instruments. Raises on anything pretty_midi (or
+    mido) would reject and on rare constructs it does not model (system
+    common messages, running status after sysex), so callers can fall back
+    to pretty_midi for those files.
+    """
+    data = bytes(data)
+    size, pos = _chunk_header(data, 0, b'MThd')
+    header = data[pos:pos + size]
+    if len(header) < 6:
+        raise ValueError('Unexpected end of file')
+    _, n_tracks, resolution = struct.unpack('>hhh', header[:6])
+    pos += size
+    if n_tracks <= 0:
+        raise ValueError('MIDI file has no tracks')
+
+    tempo_changes = []
+    max_tick = 0
+    pitches, velocities, start_ticks, end_ticks, instruments = [], [], [], [], []
+    instrument_ranks = {}
+
+    for track in range(n_tracks):
+        size, pos = _chunk_header(data, pos, b'MTrk')
+        end = pos + size
+        if size == 0:
+            raise ValueError('MIDI track has no events')
+
+        tick = 0
+        last_status = None
+        programs = [0] * 16
+        open_notes = {}
+        while pos != end:
+            if pos > end:
+                raise ValueError('Event crosses the end of its track chunk')
+            delta, pos = _read_varint(data, pos)
+            status = data[pos]
+            pos += 1
+
+            if status < 0x80:
+                if last_status is None:
+                    raise ValueError('Running status without last status')
+                if last_status >= 0xf0:
+                    raise ValueError('Running status after a system message')
+                status = last_status
+                pos -= 1
+            elif status != 0xff:
+                last_status = status
+
+            if status == 0xff:
+                meta_type = data[pos]
+                payload, pos = _read_payload(data, pos + 1)
+                if meta_type not in KNOWN_META_TYPES:
+                    # mido drops the delta of unknown meta types (their time is always 0)
+                    continue
+                _check_meta(meta_type, payload)
+                tick += delta
+                if track == 0:
+                    if meta_type == SET_TEMPO:
+                        tempo_changes.append((tick, (payload[0] << 16) | (payload[1] << 8) | payload[2]))
+                    elif meta_type == TIME_SIGNATURE and payload[0] <= 0:
+                        raise ValueError(f'{payload[0]} is not a valid numerator type or value')
+                continue
+
+            tick += delta
+            if status in (0xf0, 0xf7):
+                payload, pos = _read_payload(data, pos)
+                if payload[:1] == b'\xf0':
+                    payload = payload[1:]
+                if payload[-1:] == b'\xf7':
+                    payload = payload[:-1]
+                if any(byte > 127 for byte in payload):
+                    raise ValueError('data byte must be in range 0..127')
+                continue
+            if status > 0xf0:
+                raise ValueError(f'Unsupported system message 0x{status:02x}')
+
+            kind = status & 0xf0
+            channel = status & 0x0f
+            if kind in (0xc0, 0xd0):
+                value = data[pos]
+                pos += 1
+                if value > 127:
+                    raise ValueError('data byte must be in range 0..127')
+                if kind == 0xc0:
+                    programs[channel] = value
+                continue
+
+            note, velocity = data[pos], data[pos + 1]
+            pos += 2
+            if note > 127 or velocity > 127:
+                raise ValueError('data byte must be in range 0..127')
+
+            if kind == 0x90 and velocity > 0:
+                open_notes.setdefault((channel, note), []).append((tick, velocity))
+            elif kind == 0x80 or kind == 0x90:
+                opened = open_notes.get((channel, note))
+                if opened is None:
+                    continue
+                # Notes started on this very tick stay open, like pretty_midi
+                closing = [(start, vel) for start, vel in opened if start != tick]
+                keeping = [(start, vel) for start, vel in opened if start == tick]
+                if closing:
+                    instrument = (programs[channel], channel, track)
+                    rank = instrument_ranks.setdefault(instrument, len(instrument_ranks))
+                    for start, vel in closing:
+                        pitches.append(note)
+                        velocities.append(vel)
+                        start_ticks.append(start)
+                        end_ticks.append(tick)
+                        instruments.append(rank)
+                if closing and keeping:
+                    open_notes[(channel, note)] = keeping
+                else:
+                    del open_notes[(channel, note)]
+
+        max_tick = max(max_tick, tick)
+
+    if max_tick + 1 > MAX_TICK:
+        raise ValueError(f'MIDI file has a largest tick of {max_tick + 1}, it is likely corrupt')
+
+    # pretty_midi lists notes instrument by instrument (stable within each)
+    order = np.argsort(np.array(instruments, dtype=np.int64), kind='stable')
+    notes = np.empty(len(order), dtype=SMF_NOTE_DTYPE)
+    notes['pitch'] = np.array(pitches, dtype=np.int16)[order]
+    notes['velocity'] = np.array(velocities, dtype=np.int16)[order]
+    times = _tick_times(np.concatenate([start_ticks, end_ticks]), tempo_changes, resolution)
+    notes['start'] = times[:len(order)][order]
+    notes['end'] = times[len(order):][order]
+    drum = np.array([channel == DRUM_CHANNEL for _, channel, _ in instrument_ranks], dtype=bool)
+    notes['drum'] = drum[np.array(instruments, dtype=np.int64)[order]] if len(order) else False
+    return notes
+
+
+def midi_bytes(source):
+    """Raw bytes of a MIDI path, binary file object or bytes-like object"""
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return bytes(source)
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, 'rb') as f:
+            return f.read()
+    return source.read()
+
+
+def pretty_midi_notes(data):
+    """SMF_NOTE_DTYPE notes of MIDI bytes parsed by pretty_midi (the reference reader)"""
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        midi_data = pretty_midi.PrettyMIDI(io.BytesIO(data))
+    return np.fromiter(
+        (
+            (note.pitch, note.velocity, note.start, note.end, instrument.is_drum)
+            for instrument in midi_data.instruments
+            for note in instrument.notes
+        ),
+        dtype=SMF_NOTE_DTYPE,
+        count=sum(len(i.notes) for i in midi_data.instruments)
+    )
+
+
+def read_notes(source, fast=True):
+    """
+    Notes of a MIDI path, file object or bytes as a SMF_NOTE_DTYPE array in pretty_midi order.
+
+    With fast, read_smf_notes is tried first and pretty_midi only parses the
+    files it rejects, so malformed files raise pretty_midi's own errors.
+    """
+    data = midi_bytes(source)
+    if fast:
+        try:
+            return read_smf_notes(data)
+        except Exception:
+            pass
+    return pretty_midi_notes(data)
@@ -5,13 +5,14 @@ def normalize_tempo(pitch_sequence):
     Normalize tempo as specified in requirements
     NP(note) = (note - μ) / σ
     """
-    if not pitch_sequence:
-        return []
+    pitch_sequence = np.asarray(pitch_sequence)
+    if len(pitch_sequence) == 0:
+        return np.zeros(0)
     
     mean = np.mean(pitch_sequence)
     std = np.std(pitch_sequence)
     
     if std == 0:  # Avoid division by zero
-        return [0] * len(pitch_sequence)
+        return np.zeros(len(pitch_sequence))
         
-    return [(note - mean) / std for note in pitch_sequence]
\ No newline at end of file
+    return (pitch_sequence - mean) / std
\ No newline at end of file
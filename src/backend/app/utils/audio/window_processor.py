@@ -1,4 +1,3 @@
-import pretty_midi
 import numpy as np
 
 def process_audio_window(midi_data, window_size=20, sliding_amount=4):
@@ -9,23 +8,79 @@ def process_audio_window(midi_data, window_size=20, sliding_amount=4):
         window_size: size of window in beats (default 20 beats)
         sliding_amount: sliding window amount (default 4 beats)
     """
-    total_time = midi_data.get_end_time()
-    tempo = midi_data.estimate_tempo()
-    
-    # Convert beats to time
-    seconds_per_beat = 60.0 / tempo
-    window_time = window_size * seconds_per_beat
-    slide_time = sliding_amount * seconds_per_beat
-    
-    windows = []
-    start_time = 0
-    
-    while start_time + window_time <= total_time:
-        window = {
-            'start_time': start_time,
-            'end_time': start_time + window_time
-        }
-        windows.append(window)
-        start_time += slide_time
-        
-    return windows
+    starts, ends = window_bounds(
+        midi_data.get_beats(), midi_data.get_end_time(), window_size, sliding_amount
+    )
+    return [
+        {'start_time': float(start), 'end_time': float(end)}
+        for start, end in zip(starts, ends)
+    ]
+
+def window_bounds(beat_times, total_time, window_size=20, sliding_amount=4):
+    """
+    Start/end times of every full window, following the tempo map via beat times.
+    Songs shorter than one window get a single window covering the whole song.
+    """
+    beat_times = np.asarray(beat_times, dtype=np.float64)
+    if len(beat_times) <= window_size:
+        return np.array([0.0]), np.array([max(total_time, 0.0)])
+
+    first_beats = np.arange(0, len(beat_times) - window_size, sliding_amount)
+    return beat_times[first_beats], beat_times[first_beats + window_size]
+
+def window_histograms(notes, window_starts, window_ends):
+    """
+    Weighted ATB/RTB/FTB histograms for every window using prefix sums.
+
+    notes is the structured note array (pitch, duration, velocity, start)
+    sorted by start; a note belongs to a window when it starts inside it.
+    Each histogram is the window difference of one cumulative histogram, so
+    overlapping windows cost O(notes) in total instead of O(notes x windows).
+    The per-window scale factors of the global features (total duration,
+    first-note weight) are left out since cosine similarity ignores them.
+    Returns {'atb': W x 128, 'rtb': W x 255, 'ftb': W x 255}.
+    """
+    start = notes['start']
+    lo = np.searchsorted(start, window_starts, side='left')
+    hi = np.searchsorted(start, window_ends, side='left')
+    rows = np.arange(len(lo))[:, None]
+
+    pitch = notes['pitch'].astype(np.int64)
+    duration = notes['duration']
+    velocity = notes['velocity'].astype(np.int64)
+
+    # ATB: cumulative duration*velocity weight per pitch
+    pitch_bins, pitch_cols = np.unique(pitch, return_inverse=True)
+    note_prefix = _prefix_sums(pitch_cols, duration * velocity, len(pitch_bins))
+    atb = np.zeros((len(lo), 128))
+    atb[:, pitch_bins] = note_prefix[hi] - note_prefix[lo]
+
+    # FTB: same sums without the window's first note, shifted by its pitch
+    after_first = np.minimum(lo + 1, hi)
+    first_pitch = pitch[np.minimum(lo, len(pitch) - 1)]
+    ftb = np.zeros((len(lo), 255))
+    ftb[rows, pitch_bins[None, :] - first_pitch[:, None] + 127] = (
+        note_prefix[hi] - note_prefix[after_first]
+    )
+
+    # RTB: consecutive note pairs that both start inside the window
+    intervals = np.diff(pitch) + 127
+    pair_weights = ((duration[1:] + duration[:-1]) / 2) * ((velocity[1:] + velocity[:-1]) / (2 * 127))
+    interval_bins, interval_cols = np.unique(intervals, return_inverse=True)
+    pair_prefix = _prefix_sums(interval_cols, pair_weights, len(interval_bins))
+    last_pair = np.maximum(hi - 1, lo)
+    rtb = np.zeros((len(lo), 255))
+    rtb[:, interval_bins] = pair_prefix[last_pair] - pair_prefix[lo]
+
+    # Prefix differences can leave tiny negative residues
+    return {
+        'atb': np.maximum(atb, 0.0),
+        'rtb': np.maximum(rtb, 0.0),
+        'ftb': np.maximum(ftb, 0.0)
+    }
+
+def _prefix_sums(columns, weights, n_columns):
+    """Row k holds the per-column sum of the first k weights"""
+    prefix = np.zeros((len(columns) + 1, n_columns))
+    prefix[np.arange(1, len(columns) + 1), columns] = weights
+    return np.cumsum(prefix, axis=0, out=prefix)
@@ -0,0 +1,159 @@
+# app/utils/feature_store.py
+import hashlib
+import json
+import os
+import uuid
+from contextlib import contextmanager
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+MANIFEST_NAME = 'manifest.json'
+LOCK_NAME = '.lock'
+
+
+def file_signature(filepath, with_hash=True):
+    """Build the manifest signature (mtime, size, sha1) of a dataset file"""
+    stat = os.stat(filepath)
+    signature = {'mtime': stat.st_mtime_ns, 'size': stat.st_size}
+    if with_hash:
+        signature['sha1'] = file_hash(filepath)
+    return signature
+
+
+def file_hash(filepath, chunk_size=1 << 20):
+    """SHA1 of a file's content, read in chunks"""
+    digest = hashlib.sha1()
+    with open(filepath, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def signature_matches(entry, filepath):
+    """
+    Check whether a cached manifest entry still describes the file on disk.
+
+    mtime and size are compared first; the content hash is only computed
+    when they differ, so files that were merely touched stay cached.
+    """
+    current = file_signature(filepath, with_hash=False)
+    if entry.get('mtime') == current['mtime'] and entry.get('size') == current['size']:
+        return True
+    if entry.get('size') != current['size'] or 'sha1' not in entry:
+        return False
+    if file_hash(filepath) == entry['sha1']:
+        entry['mtime'] = current['mtime']
+        return True
+    return False
+
+
+class FeatureStore:
+    """
+    Versioned on-disk store for precomputed feature matrices.
+
+    Every matrix is kept as its own ``.npy`` file so it can be opened with
+    ``mmap_mode='r'``; ``manifest.json`` describes which files belong to the
+    current generation plus any per-file metadata the caller wants to keep.
+    The manifest is replaced last, so readers always see a complete generation.
+    Writers (other threads or processes sharing cache_dir) are serialized
+    with a lock file, and each one only deletes the arrays of the manifest
+    it replaced, never another writer's files.
+    """
+
+    def __init__(self, cache_dir, version):
+        self.cache_dir = cache_dir
+        self.version = version
+        self.manifest_path = os.path.join(cache_dir, MANIFEST_NAME)
+
+    def load(self, mmap_mode='r'):
+        """
+        Load the stored manifest and matrices.
+
+        Returns (manifest, arrays), or (None, {}) when the store is missing,
+        written by another feature version, or otherwise unreadable.
+        """
+        try:
+            # Shared lock: a concurrent save cannot unlink the arrays before they are opened
+            with self._locked(shared=True):
+                with open(self.manifest_path, 'r') as f:
+                    manifest = json.load(f)
+                if manifest.get('version') != self.version:
+                    return None, {}
+                arrays = {
+                    name: np.load(os.path.join(self.cache_dir, array_file), mmap_mode=mmap_mode)
+                    for name, array_file in manifest.get('arrays', {}).items()
+                }
+            return manifest, arrays
+        except (OSError, ValueError, KeyError):
+            return None, {}
+
+    @contextmanager
+    def _locked(self, shared=False):
+        """Lock on cache_dir: exclusive for writers, shared for readers (a no-op without fcntl)"""
+        os.makedirs(self.cache_dir, exist_ok=True)
+        with open(os.path.join(self.cache_dir, LOCK_NAME), 'a') as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _published_arrays(self):
+        """Array files named by the current manifest (read under the lock)"""
+        try:
+            with open(self.manifest_path, 'r') as f:
+                return set(json.load(f).get('arrays', {}).values())
+        except (OSError, ValueError, AttributeError):
+            return set()
+
+    def save(self, manifest, arrays):
+        """
+        Write a new generation of matrices and publish it via the manifest.
+
+        Returns the saved arrays memory-mapped, opened before another writer
+        can replace them, so callers can drop their in-memory copies.
+        """
+        with self._locked():
+            replaced = self._published_arrays()
+            generation = uuid.uuid4().hex[:12]
+
+            array_files = {}
+            for name, array in arrays.items():
+                array_file = f"{name}-{generation}.npy"
+                np.save(os.path.join(self.cache_dir, array_file), np.ascontiguousarray(array))
+                array_files[name] = array_file
+
+            manifest = dict(manifest, version=self.version, arrays=array_files)
+            tmp_path = f"{self.manifest_path}.{generation}.tmp"
+            with open(tmp_path, 'w') as f:
+                json.dump(manifest, f)
+            os.replace(tmp_path, self.manifest_path)
+
+            self._remove_files(replaced - set(array_files.values()))
+            return {
+                name: np.load(os.path.join(self.cache_dir, array_file), mmap_mode='r')
+                for name, array_file in array_files.items()
+            }
+
+    def clear(self):
+        """Drop the manifest so the next load starts from scratch"""
+        with self._locked():
+            replaced = self._published_arrays()
+            if os.path.exists(self.manifest_path):
+                os.remove(self.manifest_path)
+            self._remove_files(replaced)
+
+    def _remove_files(self, names):
+        # Readers that still have an old generation mapped keep their pages;
+        # unlinking only removes the directory entry.
+        for name in names:
+            try:
+                os.remove(os.path.join(self.cache_dir, name))
+            except OSError:
+                pass
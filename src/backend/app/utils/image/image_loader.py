@@ -0,0 +1,71 @@
+import numpy as np
+import time
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image
+from app.utils.metrics import stage_timer
+
+IMAGE_SIZE = (100, 100)
+IMAGE_VECTOR_LENGTH = IMAGE_SIZE[0] * IMAGE_SIZE[1]
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+
+DECODE_SECONDS = stage_timer('image', 'image_decode')
+
+
+def load_image_vector(source, out=None):
+    """
+    Grayscale, resize to 100x100 and flatten an image path or file object.
+
+    JPEGs are decoded with draft() so libjpeg downscales and converts to
+    grayscale while decoding instead of producing a full-size RGB image first.
+    The result is written into out (a uint8 row) when given.
+    """
+    with DECODE_SECONDS.time(), Image.open(source) as img:
+        img.draft('L', IMAGE_SIZE)
+        img = img.convert('L').resize(IMAGE_SIZE)
+        vector = np.asarray(img, dtype=np.uint8).reshape(-1)
+    if out is None:
+        return vector
+    out[:] = vector
+    return out
+
+
+def load_image_matrix(paths, workers=None, durations=None, progress=None):
+    """
+    Decode many images (paths or file objects) into one preallocated uint8 N x 10000 matrix.
+
+    Pillow releases the GIL while decoding, so a thread pool scales across
+    cores; each worker writes straight into its row. Rows of images that fail
+    are dropped. When durations (a length-N array) is given, each image's
+    decode time in seconds is stored in it. progress(processed, total) is
+    called as images finish, in input order.
+    Returns (matrix, loaded_indices, {index: error}).
+    """
+    matrix = np.empty((len(paths), IMAGE_VECTOR_LENGTH), dtype=np.uint8)
+
+    def decode(i):
+        start = time.perf_counter()
+        try:
+            load_image_vector(paths[i], out=matrix[i])
+            return None
+        except Exception as e:
+            return str(e)
+        finally:
+            if durations is not None:
+                durations[i] = time.perf_counter() - start
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        outcomes = []
+        for outcome in executor.map(decode, range(len(paths))):
+            outcomes.append(outcome)
+            if progress is not None:
+                progress(len(outcomes), len(paths))
+
+    errors = {i: error for i, error in enumerate(outcomes) if error is not None}
+    loaded = [i for i in range(len(paths)) if i not in errors]
+    if errors:
+        # Compact in place so no second full-size matrix is allocated
+        for row, i in enumerate(loaded):
+            if row != i:
+                matrix[row] = matrix[i]
+        matrix = matrix[:len(loaded)]
+    return matrix, loaded, errors
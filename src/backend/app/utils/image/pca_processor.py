@@ -1,53 +1,74 @@
 import numpy as np
 from typing import Tuple, List
+from app.utils.metrics import stage_timer
+
+# Above this many images the 'auto' solver switches from the N x N Gram matrix to randomized SVD
+AUTO_RANDOMIZED_MIN_SAMPLES = 1000
+
+SCORING_SECONDS = stage_timer('image', 'scoring')
+TOP_K_SECONDS = stage_timer('image', 'top_k')
 
 class PCAProcessor:
-    def __init__(self, n_components: int = 50):
+    def __init__(self, n_components: int = 50, solver: str = 'auto',
+                 n_oversamples: int = 10, n_power_iter: int = 7, random_state: int = 0,
+                 batch_size: int = 1000, dtype=np.float32, block_size: int = 2048):
+        """
+        Args:
+            n_components: number of principal components to keep (max 50)
+            solver: 'exact' (eigendecomposition of the N x N Gram matrix),
+                'randomized' (Halko et al. range finder, O(N * k) extra memory),
+                'incremental' (partial_fit over mini-batches of batch_size)
+                or 'auto' (randomized for more than AUTO_RANDOMIZED_MIN_SAMPLES images)
+            n_oversamples: extra random directions sampled by the randomized solver
+            n_power_iter: power iterations of the randomized solver
+            random_state: seed of the randomized solver
+            batch_size: rows per partial_fit call of the incremental solver
+            dtype: floating point type used for centering, components and projections
+            block_size: rows centered at a time, so no full centered copy of the data exists
+        """
         print("Initializing PCAProcessor...")
+        if solver not in ('auto', 'exact', 'randomized', 'incremental'):
+            raise ValueError(f"Unknown PCA solver: {solver}")
         self.n_components = min(n_components, 50)
+        self.solver = solver
+        self.n_oversamples = n_oversamples
+        self.n_power_iter = n_power_iter
+        self.random_state = random_state
+        self.batch_size = max(batch_size, self.n_components)
+        self.dtype = np.dtype(dtype)
+        self.block_size = max(block_size, 1)
         self.mean_face = None
         self.components = None
+        # float64 copy of components that transform projects with, refreshed whenever they change
+        self._components64 = None
         self.explained_variance = None
+        self.singular_values = None
+        self.n_samples_seen = 0
         print(f"PCAProcessor initialized with {self.n_components} components")
 
     def fit_transform(self, data_matrix: np.ndarray) -> np.ndarray:
         print("Starting PCA fit_transform...")
         print(f"Input data shape: {data_matrix.shape}")
         try:
-            # 1. Center the data
+            if self.solver == 'incremental':
+                return self._fit_transform_incremental(data_matrix)
+
+            # 1. Compute the mean face; data is centered block by block later on
             print("Computing mean face...")
-            self.mean_face = np.mean(data_matrix, axis=0)
-            print("Centering data...")
-            centered_data = data_matrix - self.mean_face
-
-            # 2. Compute SVD on centered data directly
-            print("Computing SVD...")
-            # Use smaller covariance matrix (N x N) instead of (D x D)
-            C = centered_data @ centered_data.T  # Shape: (N x N)
-            print(f"Small covariance matrix shape: {C.shape}")
-            
-            eigenvalues, eigenvectors = np.linalg.eigh(C)
-            print("Eigendecomposition complete")
-
-            # Sort eigenvalues and eigenvectors in descending order
-            idx = np.argsort(eigenvalues)[::-1]
-            eigenvalues = eigenvalues[idx]
-            eigenvectors = eigenvectors[:, idx]
-
-            # Get the actual principal components
-            print("Computing principal components...")
-            # Normalize the eigenvectors
-            components = centered_data.T @ eigenvectors
-            norms = np.sqrt(np.sum(components ** 2, axis=0))
-            self.components = components / norms
-
-            # Keep only n_components
-            self.components = self.components[:, :self.n_components]
-            self.explained_variance = eigenvalues[:self.n_components] / (data_matrix.shape[0] - 1)
+            self.mean_face = np.mean(data_matrix, axis=0, dtype=np.float64).astype(self.dtype)
+
+            # 2. Compute principal components of the centered data
+            solver = self.solver
+            if solver == 'auto':
+                solver = 'randomized' if data_matrix.shape[0] > AUTO_RANDOMIZED_MIN_SAMPLES else 'exact'
+            if solver == 'randomized':
+                self._fit_randomized(data_matrix)
+            else:
+                self._fit_exact(data_matrix)
 
             # Project the data
             print("Projecting data...")
-            projected_data = centered_data @ self.components
+            projected_data = self.transform(data_matrix)
             print(f"Projection complete. Shape: {projected_data.shape}")
 
             return projected_data
@@ -56,26 +77,244 @@ class PCAProcessor:
             print(f"Error in PCA fit_transform: {str(e)}")
             raise
 
+    def _centered_blocks(self, data_matrix: np.ndarray, dtype=None):
+        """Yield (row slice, centered block in dtype, default self.dtype) of at most block_size rows."""
+        for start in range(0, data_matrix.shape[0], self.block_size):
+            block = np.array(data_matrix[start:start + self.block_size], dtype=dtype or self.dtype)
+            block -= self.mean_face
+            yield slice(start, start + block.shape[0]), block
+
+    def _fit_exact(self, data_matrix: np.ndarray) -> None:
+        """Eigendecomposition of the N x N Gram matrix (O(N^2 * D) time, O(N^2) memory)"""
+        print("Computing SVD...")
+        n_samples = data_matrix.shape[0]
+        # Use smaller covariance matrix (N x N) instead of (D x D), built block by block
+        C = np.empty((n_samples, n_samples), dtype=self.dtype)
+        for rows_i, block_i in self._centered_blocks(data_matrix):
+            for rows_j, block_j in self._centered_blocks(data_matrix[:rows_i.stop]):
+                C[rows_i, rows_j] = block_i @ block_j.T
+                C[rows_j, rows_i] = C[rows_i, rows_j].T
+        print(f"Small covariance matrix shape: {C.shape}")
+        
+        eigenvalues, eigenvectors = np.linalg.eigh(C)
+        del C
+        print("Eigendecomposition complete")
+
+        # Sort eigenvalues and eigenvectors in descending order, keep n_components
+        idx = np.argsort(eigenvalues)[::-1][:self.n_components]
+        eigenvalues = eigenvalues[idx]
+        eigenvectors = eigenvectors[:, idx]
+
+        # Get the actual principal components
+        print("Computing principal components...")
+        components = np.zeros((data_matrix.shape[1], len(idx)), dtype=self.dtype)
+        for rows, block in self._centered_blocks(data_matrix):
+            components += block.T @ eigenvectors[rows]
+        # Normalize the eigenvectors
+        norms = np.sqrt(np.sum(components ** 2, axis=0))
+        self._set_components(components / norms)
+
+        self.explained_variance = eigenvalues / (n_samples - 1)
+        self.singular_values = np.sqrt(np.maximum(eigenvalues, 0))
+        self.n_samples_seen = n_samples
+
+    def _fit_randomized(self, data_matrix: np.ndarray) -> None:
+        """
+        Randomized truncated SVD (Halko, Martinsson & Tropp).
+
+        Finds an orthonormal basis for the range of the data with a few
+        passes over it, then solves a small (k + oversamples) x D SVD. Extra
+        memory is O((N + D) * (k + oversamples)) instead of the N x N Gram matrix.
+        """
+        print("Computing randomized SVD...")
+        n_samples, n_features = data_matrix.shape
+        n_random = min(self.n_components + self.n_oversamples, n_samples, n_features)
+        rng = np.random.default_rng(self.random_state)
+
+        def times(right):  # centered_data @ right
+            out = np.empty((n_samples, right.shape[1]), dtype=self.dtype)
+            for rows, block in self._centered_blocks(data_matrix):
+                out[rows] = block @ right
+            return out
+
+        def transposed_times(left):  # centered_data.T @ left
+            out = np.zeros((n_features, left.shape[1]), dtype=self.dtype)
+            for rows, block in self._centered_blocks(data_matrix):
+                out += block.T @ left[rows]
+            return out
+
+        # Range finder with power iterations, re-orthonormalized each pass
+        omega = rng.standard_normal((n_features, n_random)).astype(self.dtype)
+        Q, _ = np.linalg.qr(times(omega))
+        for _ in range(self.n_power_iter):
+            Q, _ = np.linalg.qr(transposed_times(Q))
+            Q, _ = np.linalg.qr(times(Q))
+
+        # Small SVD of the projected data
+        B = transposed_times(Q).T  # Shape: (n_random x D)
+        _, singular_values, Vt = np.linalg.svd(B, full_matrices=False)
+        print("Randomized SVD complete")
+
+        self._set_components(np.ascontiguousarray(Vt[:self.n_components].T))
+        self.explained_variance = singular_values[:self.n_components] ** 2 / (n_samples - 1)
+        self.singular_values = singular_values[:self.n_components]
+        self.n_samples_seen = n_samples
+
+    def _fit_transform_incremental(self, data_matrix: np.ndarray) -> np.ndarray:
+        """Fit with partial_fit over mini-batches, then project every row"""
+        print(f"Fitting incremental PCA in batches of {self.batch_size}...")
+        self.n_samples_seen = 0
+        n_samples = data_matrix.shape[0]
+        for start in range(0, n_samples, self.batch_size):
+            batch = data_matrix[start:start + self.batch_size]
+            # Fold a too-small trailing batch into this one
+            if n_samples - (start + self.batch_size) < self.n_components:
+                batch = data_matrix[start:]
+                self.partial_fit(batch)
+                break
+            self.partial_fit(batch)
+
+        print("Projecting data...")
+        projected_data = self.transform(data_matrix)
+        print(f"Projection complete. Shape: {projected_data.shape}")
+        return projected_data
+
+    def partial_fit(self, batch: np.ndarray) -> None:
+        """
+        Update mean and components with a mini-batch (incremental PCA, Ross et al.).
+
+        The previous components, scaled by their singular values, are stacked
+        with the centered batch and a mean-shift correction row, and a small
+        SVD of that stack gives the updated model. Memory is O((k + batch) * D).
+        """
+        batch = np.asarray(batch, dtype=self.dtype)
+        n_new = batch.shape[0]
+        n_total = self.n_samples_seen + n_new
+        batch_mean = np.mean(batch, axis=0, dtype=np.float64).astype(self.dtype)
+
+        if self.n_samples_seen == 0:
+            stacked = batch - batch_mean
+            mean_total = batch_mean
+        else:
+            mean_total = ((self.n_samples_seen * self.mean_face + n_new * batch_mean) / n_total).astype(self.dtype)
+            correction = np.sqrt(self.n_samples_seen * n_new / n_total) * (self.mean_face - batch_mean)
+            stacked = np.vstack([
+                self.singular_values[:, None] * self.components.T,
+                batch - batch_mean,
+                correction
+            ]).astype(self.dtype, copy=False)
+
+        _, singular_values, Vt = np.linalg.svd(stacked, full_matrices=False)
+        self._set_components(np.ascontiguousarray(Vt[:self.n_components].T))
+        self.singular_values = singular_values[:self.n_components]
+        self.explained_variance = self.singular_values ** 2 / max(n_total - 1, 1)
+        self.mean_face = mean_total
+        self.n_samples_seen = n_total
+
+    def _set_components(self, components: np.ndarray) -> None:
+        """Store fitted components and the float64 copy transform projects with."""
+        self.components = components
+        self._components64 = np.asarray(components, dtype=np.float64)
+
     def transform(self, query_image: np.ndarray) -> np.ndarray:
-        """Transform new image into PCA space."""
+        """
+        Transform new image(s) into PCA space, centering block by block.
+
+        Projections are accumulated in float64: they are only N x k, and
+        similarity is sensitive to absolute distance, so float32 rounding of
+        large coordinates would keep identical images from scoring 100.
+        """
         if query_image.ndim == 1:
             query_image = query_image.reshape(1, -1)
-        centered_query = query_image - self.mean_face
-        return centered_query @ self.components
+        projected = np.empty((query_image.shape[0], self._components64.shape[1]))
+        for rows, block in self._centered_blocks(query_image, dtype=np.float64):
+            projected[rows] = block @ self._components64
+        return projected
 
     def compute_similarity(self, query_projection: np.ndarray, database_projections: np.ndarray) -> List[Tuple[int, float]]:
         """Compute similarity using Euclidean distance."""
-        distances = []
         query_projection = query_projection.reshape(-1)
+        distances = np.sqrt(np.sum((np.asarray(database_projections) - query_projection) ** 2, axis=1))
+        similarities = self.distance_to_similarity(distances)
         
-        for i, proj in enumerate(database_projections):
-            proj = proj.reshape(-1)
-            distance = np.sqrt(np.sum((query_projection - proj) ** 2))
-            similarity = 100 * np.exp(-distance / (2 * self.n_components))
-            distances.append((i, similarity))
-        
-        distances.sort(key=lambda x: x[1], reverse=True)
-        return distances
+        order = np.lexsort((np.arange(len(similarities)), -similarities))
+        return [(int(i), float(similarities[i])) for i in order]
+
+    def distance_to_similarity(self, distances: np.ndarray) -> np.ndarray:
+        """Map Euclidean distances in PCA space to 0-100 similarity scores."""
+        return 100 * np.exp(-np.asarray(distances) / (2 * self.n_components))
+
+    def similarity_to_distance(self, similarity: float) -> float:
+        """Largest distance whose similarity is still >= the given score."""
+        return -2 * self.n_components * np.log(similarity / 100)
+
+    def top_k_similarity(self, query_projections: np.ndarray, database_projections: np.ndarray,
+                         k: int = 5, min_similarity: float = 0.0,
+                         database_sq_norms: np.ndarray = None) -> List[List[Tuple[int, float]]]:
+        """
+        Best k database rows for each query, as [(index, similarity)] lists.
+
+        All squared distances come from one matrix product using
+        ||a||^2 + ||b||^2 - 2ab (pass precomputed database_sq_norms to skip
+        recomputing them), the similarity cut-off is applied as a distance
+        bound and the k best are picked with a partition, keeping every row
+        tied with the k-th. Distances of the selected rows are then
+        recomputed directly so identical images still score exactly 100, and
+        ties keep row order.
+        """
+        queries = np.atleast_2d(query_projections)
+        database = np.asarray(database_projections)
+        if database.size == 0:
+            return [[] for _ in queries]
+        if database_sq_norms is None:
+            database_sq_norms = np.einsum('ij,ij->i', database, database)
+
+        with SCORING_SECONDS.time():
+            sq_distances = (np.einsum('ij,ij->i', queries, queries)[:, None]
+                            + database_sq_norms[None, :]
+                            - 2 * (queries @ database.T))
+            np.maximum(sq_distances, 0, out=sq_distances)
+        if min_similarity > 0:
+            max_distance = self.similarity_to_distance(min_similarity)
+            # Small slack so rounding in the expansion cannot drop a borderline row
+            sq_bound = max_distance ** 2 * (1 + 1e-9) + 1e-9
+        else:
+            sq_bound = np.inf
+
+        results = []
+        with TOP_K_SECONDS.time():
+            for query, row in zip(queries, sq_distances):
+                candidates = np.flatnonzero(row <= sq_bound)
+                if len(candidates) > k:
+                    # Keep every row tied (up to rounding) with the k-th distance; the exact
+                    # distances below decide the order and the cut falls by row order
+                    kth = np.partition(row[candidates], k - 1)[k - 1]
+                    candidates = candidates[row[candidates] <= kth * (1 + 1e-9) + 1e-9]
+
+                distances = np.sqrt(np.sum((database[candidates] - query) ** 2, axis=1))
+                similarities = self.distance_to_similarity(distances)
+                keep = similarities >= min_similarity
+                candidates, similarities = candidates[keep], similarities[keep]
+                order = np.lexsort((candidates, -similarities))[:k]
+                results.append([(int(candidates[i]), float(similarities[i])) for i in order])
+        return results
+
+    def get_state(self) -> dict:
+        """Fitted model arrays, for persisting with a FeatureStore."""
+        return {
+            'mean_face': self.mean_face,
+            'components': self.components,
+            'explained_variance': self.explained_variance,
+            'singular_values': self.singular_values
+        }
+
+    def set_state(self, state: dict, n_samples_seen: int) -> None:
+        """Restore a model saved with get_state (arrays may be memory-mapped)."""
+        self.mean_face = state['mean_face']
+        self._set_components(state['components'])
+        self.explained_variance = state['explained_variance']
+        self.singular_values = state['singular_values']
+        self.n_samples_seen = n_samples_seen
 
     def cumulative_explained_variance_ratio(self) -> np.ndarray:
         """Get cumulative proportion of variance explained."""
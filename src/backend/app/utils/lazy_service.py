@@ -0,0 +1,78 @@
+# app/utils/lazy_service.py
+import threading
+import time
+
+
+class LazyService:
+    """
+    Builds a service on first use instead of at import time.
+
+    factory() should import the service module itself so heavy dependencies
+    (pretty_midi, PIL, numpy) are only paid when the service is needed.
+    get() constructs the service once, with concurrent callers waiting for
+    the same instance; warm_up() starts construction ahead of the first
+    request, optionally on a background thread.
+    """
+
+    def __init__(self, name, factory):
+        self.name = name
+        self.factory = factory
+        self._instance = None
+        self._error = None
+        self._started = None
+        self._seconds = None
+        self._lock = threading.Lock()
+
+    @property
+    def ready(self):
+        return self._instance is not None
+
+    def get(self):
+        """The service instance, constructing it on the first call"""
+        instance = self._instance
+        if instance is not None:
+            return instance
+        with self._lock:
+            if self._instance is None:
+                self._started = time.time()
+                self._error = None
+                try:
+                    self._instance = self.factory()
+                except Exception as e:
+                    self._error = str(e)
+                    raise
+                finally:
+                    self._seconds = round(time.time() - self._started, 3)
+            return self._instance
+
+    def warm_up(self, background=True):
+        """Construct the service now, on a daemon thread unless background is False"""
+        if self.ready:
+            return
+        if not background:
+            self.get()
+            return
+
+        def build():
+            try:
+                self.get()
+            except Exception as e:
+                print(f"Error warming up {self.name} service: {str(e)}")
+
+        threading.Thread(target=build, name=f'{self.name}-warmup', daemon=True).start()
+
+    def status(self):
+        if self._instance is not None:
+            state = 'ready'
+        elif self._error is not None:
+            state = 'failed'
+        elif self._lock.locked():
+            state = 'loading'
+        else:
+            state = 'idle'
+        return {
+            'state': state,
+            'error': self._error,
+            'seconds': (self._seconds if state != 'loading'
+                        else round(time.time() - (self._started or time.time()), 3))
+        }
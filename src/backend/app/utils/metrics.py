@@ -0,0 +1,259 @@
+# app/utils/metrics.py
+import bisect
+import os
+import threading
+import time
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# Seconds; covers sub-millisecond scoring up to multi-minute dataset reloads
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+
+
+def _format_value(value):
+    value = float(value)
+    if value != value:
+        return 'NaN'
+    if value in (float('inf'), float('-inf')):
+        return '+Inf' if value > 0 else '-Inf'
+    return str(int(value)) if value.is_integer() else repr(value)
+
+
+def _escape(value):
+    return str(value).replace('\\', r'\\').replace('\n', r'\n').replace('"', r'\"')
+
+
+def _label_text(pairs):
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+class Counter:
+    """Monotonically increasing count"""
+
+    def __init__(self):
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def samples(self, name, labels):
+        return [(name, labels, self.value)]
+
+
+class Gauge:
+    """Value that can go up and down, or is read from function() at scrape time"""
+
+    def __init__(self):
+        self.value = 0.0
+        self.function = None
+
+    def set(self, value):
+        self.value = value
+
+    def set_function(self, function):
+        self.function = function
+
+    def samples(self, name, labels):
+        value = self.value
+        if self.function is not None:
+            try:
+                value = self.function()
+            except Exception as e:
+                print(f"Error reading gauge {name}: {str(e)}")
+                return []
+        return [(name, labels, value)]
+
+
+class Histogram:
+    """
+    Bucketed distribution of observed values (Prometheus histogram semantics).
+
+    observe() is one bisect and three additions under a lock; buckets are
+    only made cumulative when the histogram is rendered.
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[i] += 1
+            self.sum += value
+            self.count += 1
+
+    def time(self):
+        """Context manager observing the wall-clock seconds spent in the with block"""
+        return _Timer(self)
+
+    def drain(self):
+        """(bucket counts, sum, count) observed since the last drain, then reset to empty"""
+        with self._lock:
+            state = (self.counts, self.sum, self.count)
+            self.counts = [0] * (len(self.buckets) + 1)
+            self.sum = 0.0
+            self.count = 0
+        return state
+
+    def merge(self, state):
+        """Add a drained (bucket counts, sum, count) from another process with the same buckets"""
+        counts, total, count = state
+        with self._lock:
+            self.counts = [a + b for a, b in zip(self.counts, counts)]
+            self.sum += total
+            self.count += count
+
+    def samples(self, name, labels):
+        with self._lock:
+            counts, total, count = list(self.counts), self.sum, self.count
+        samples = []
+        cumulative = 0
+        for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+            cumulative += bucket_count
+            samples.append((name + '_bucket', labels + (('le', _format_value(bound)),), cumulative))
+        samples.append((name + '_sum', labels, total))
+        samples.append((name + '_count', labels, count))
+        return samples
+
+
+class _Timer:
+    # A plain class is several times cheaper than a @contextmanager generator
+    __slots__ = ('histogram', 'start')
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.start)
+        return False
+
+
+class MetricFamily:
+    """A named metric with one child per label-value combination"""
+
+    def __init__(self, name, documentation, kind, labelnames=(), factory=None):
+        self.name = name
+        self.documentation = documentation
+        self.kind = kind
+        self.labelnames = tuple(labelnames)
+        self.factory = factory
+        self._children = {}
+        self._lock = threading.Lock()
+        if not self.labelnames:
+            self._children[()] = factory()
+
+    def labels(self, *values):
+        """Child metric for these label values (created on first use; no values for unlabelled families)"""
+        values = tuple(str(v) for v in values)
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f"{self.name} expects labels {self.labelnames}")
+            with self._lock:
+                child = self._children.setdefault(values, self.factory())
+        return child
+
+    def drain(self):
+        """{label values: drained state} of every child with new observations (histograms only)"""
+        with self._lock:
+            children = list(self._children.items())
+        return {values: child.drain() for values, child in children if child.count}
+
+    def merge(self, drained):
+        """Fold drain() output of the same family in another process into this one"""
+        for values, state in drained.items():
+            self.labels(*values).merge(state)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        for values, child in sorted(self._children.items()):
+            labels = tuple(zip(self.labelnames, values))
+            for name, sample_labels, value in child.samples(self.name, labels):
+                lines.append(f'{name}{_label_text(sample_labels)} {_format_value(value)}')
+        return lines
+
+
+class Registry:
+    """Holds metric families and renders them in the Prometheus text exposition format"""
+
+    def __init__(self):
+        self._families = {}
+        self._lock = threading.Lock()
+
+    def _register(self, name, documentation, kind, labelnames, factory):
+        with self._lock:
+            family = self._families.get(name)
+            if family is None:
+                family = MetricFamily(name, documentation, kind, labelnames, factory)
+                self._families[name] = family
+            return family
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(name, documentation, 'counter', labelnames, Counter)
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self._register(name, documentation, 'gauge', labelnames, Gauge)
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(name, documentation, 'histogram', labelnames,
+                              lambda: Histogram(buckets))
+
+    def render(self):
+        with self._lock:
+            families = list(self._families.values())
+        lines = []
+        for family in families:
+            lines.extend(family.render())
+        return '\n'.join(lines) + '\n'
+
+
+def resident_memory_bytes():
+    """Current resident set size (peak RSS where /proc is unavailable)"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        pass
+    if resource is None:
+        return 0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak if os.uname().sysname == 'Darwin' else peak * 1024
+
+
+REGISTRY = Registry()
+
+STAGE_SECONDS = REGISTRY.histogram(
+    'stage_duration_seconds', 'Time spent in each query and indexing stage', ('service', 'stage')
+)
+QUERIES = REGISTRY.counter('queries_total', 'Queries answered', ('service', 'kind'))
+QUERY_CACHE_HITS = REGISTRY.counter('query_cache_hits_total', 'Queries served from the result cache',
+                                    ('service',))
+INGEST_FAILURES = REGISTRY.counter('ingest_failures_total', 'Dataset files that could not be saved or indexed',
+                                   ('service',))
+INDEX_SIZE = REGISTRY.gauge('index_entries', 'Files in the published index', ('service',))
+INDEX_BYTES = REGISTRY.gauge('index_bytes', 'Bytes of the published index matrices', ('service',))
+REGISTRY.gauge('process_resident_memory_bytes', 'Resident memory of this process').labels().set_function(
+    resident_memory_bytes
+)
+
+
+def stage_timer(service, stage):
+    """Histogram for one service stage; use as `with stage_timer('audio', 'scoring').time():`"""
+    return STAGE_SECONDS.labels(service, stage)
@@ -0,0 +1,69 @@
+# app/utils/query_cache.py
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+
+class QueryCache:
+    """
+    Thread-safe LRU cache with a per-entry TTL for query results.
+
+    Keys are built from the SHA256 of the uploaded bytes plus whatever else
+    changes the answer (dataset version, top_n, search options), so a stale
+    entry can never be returned after the dataset changes.
+    """
+
+    def __init__(self, max_entries=1024, ttl=300):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(content, *parts):
+        """Cache key for uploaded content and the query parameters that affect its result"""
+        digest = hashlib.sha256(content).hexdigest()
+        return (digest,) + tuple(parts)
+
+    def get(self, key):
+        """Cached value for key, or None on a miss or an expired entry"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, key, value):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        """Drop every entry (hit/miss counters are kept)"""
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hitRate': round(self.hits / total, 4) if total else 0.0,
+                'size': len(self._entries),
+                'maxEntries': self.max_entries,
+                'ttl': self.ttl
+            }
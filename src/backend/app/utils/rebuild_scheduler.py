@@ -0,0 +1,141 @@
+# app/utils/rebuild_scheduler.py
+import itertools
+import threading
+import time
+from collections import OrderedDict
+
+
+class RebuildJob:
+    """
+    One scheduled rebuild and its progress.
+
+    paths is None for a full dataset reload, otherwise the files to index;
+    triggers counts how many requests were coalesced into this job.
+    """
+
+    def __init__(self, job_id, paths):
+        self.id = job_id
+        self.paths = None if paths is None else list(dict.fromkeys(paths))
+        self._queued_paths = set(self.paths or ())
+        self.status = 'queued'
+        self.triggers = 1
+        self.processed = 0
+        self.total = len(self.paths) if self.paths is not None else 0
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self.result = None
+        self.error = None
+
+    def merge(self, paths):
+        """Fold another trigger into this queued job (a full reload absorbs everything)"""
+        self.triggers += 1
+        if self.paths is None or paths is None:
+            self.paths = None
+        else:
+            for path in paths:
+                if path not in self._queued_paths:
+                    self._queued_paths.add(path)
+                    self.paths.append(path)
+        self.total = len(self.paths) if self.paths is not None else 0
+
+    def progress(self, processed, total):
+        """Progress callback handed to the rebuild function"""
+        self.processed = processed
+        self.total = total
+
+    def to_dict(self):
+        now = self.finished or time.time()
+        elapsed = now - self.started if self.started else 0.0
+        rate = self.processed / elapsed if elapsed > 0 else 0.0
+        eta = None
+        if self.status == 'running' and rate > 0:
+            eta = round((self.total - self.processed) / rate, 1)
+        return {
+            'id': self.id,
+            'status': self.status,
+            'kind': 'reload' if self.paths is None else 'add',
+            'triggers': self.triggers,
+            'processed': self.processed,
+            'total': self.total,
+            'filesPerSecond': round(rate, 2),
+            'eta': eta,
+            'elapsed': round(elapsed, 3),
+            'created': self.created,
+            'result': self.result,
+            'error': self.error
+        }
+
+
+class RebuildScheduler:
+    """
+    Runs dataset rebuilds on one background thread, one at a time.
+
+    Triggers that arrive while a job is queued are coalesced into it and get
+    the same job id back, so a burst of uploads costs at most one running
+    and one queued rebuild. rebuild(paths, progress) does the work (paths is
+    None for a full reload); services publish new indexes atomically, so
+    the old index keeps serving queries until the rebuild finishes.
+    """
+
+    def __init__(self, name, rebuild, history=50):
+        self.name = name
+        self.rebuild = rebuild
+        self.history = history
+        self._jobs = OrderedDict()
+        self._queued = None
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._thread = None
+
+    def trigger(self, paths=None):
+        """Schedule indexing of paths (None = full reload); returns the job id"""
+        with self._lock:
+            if self._queued is not None:
+                self._queued.merge(paths)
+                return self._queued.id
+
+            job = RebuildJob(f'{self.name}-{next(self._ids)}', paths)
+            self._queued = job
+            self._jobs[job.id] = job
+            while len(self._jobs) > self.history:
+                self._jobs.popitem(last=False)
+
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=self._run, name=f'{self.name}-rebuild', daemon=True
+                )
+                self._thread.start()
+            self._wakeup.notify()
+            return job.id
+
+    def status(self, job_id):
+        """Job status dict, or None for an unknown (or expired) id"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return job.to_dict() if job is not None else None
+
+    def jobs(self):
+        """Status of the most recent jobs, newest first"""
+        with self._lock:
+            return [job.to_dict() for job in reversed(self._jobs.values())]
+
+    def _run(self):
+        while True:
+            with self._lock:
+                while self._queued is None:
+                    self._wakeup.wait()
+                job = self._queued
+                self._queued = None
+                job.status = 'running'
+                job.started = time.time()
+
+            try:
+                job.result = self.rebuild(job.paths, job.progress)
+                job.status = 'done'
+            except Exception as e:
+                print(f"Error in {self.name} rebuild {job.id}: {str(e)}")
+                job.error = str(e)
+                job.status = 'failed'
+            job.finished = time.time()
@@ -0,0 +1,343 @@
+# app/utils/shard_pool.py
+import argparse
+import itertools
+import os
+import subprocess
+import sys
+import threading
+from collections import OrderedDict
+from multiprocessing.connection import Client, Listener
+import numpy as np
+from app.config import BASE_DIR
+from app.utils.metrics import stage_timer
+
+# Loaded generations each shard keeps, so queries on the previous snapshot still find their rows
+KEEP_GENERATIONS = 2
+# Printed by a shard host once it accepts connections, followed by host:port
+READY_LINE = 'Shard host listening on '
+BLAS_THREAD_VARS = ('OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS')
+
+
+class AudioShard:
+    """Contiguous rows of an AudioIndex, answering top_rows_batch / top_rows_transposed requests"""
+
+    def __init__(self, arrays, params):
+        from app.utils.audio.audio_index import AudioIndex
+        self.index = AudioIndex(range(len(arrays['atb'])), arrays['atb'], arrays['rtb'], arrays['ftb'])
+
+    def search(self, request):
+        if request['shifts'] is None:
+            return self.index.top_rows_batch(
+                request['queries'], request['similarity_threshold'],
+                request['top_n'], request['min_similarity']
+            )
+        return self.index.top_rows_transposed(
+            request['queries'], request['similarity_threshold'], request['shifts'],
+            request['top_n'], request['min_similarity']
+        )
+
+
+class ImageShard:
+    """Contiguous rows of the PCA projections, answering top_k_similarity requests"""
+
+    def __init__(self, arrays, params):
+        from app.utils.image.pca_processor import PCAProcessor
+        self.pca = PCAProcessor(n_components=params['n_components'], dtype=params['dtype'])
+        self.projections = arrays['projections']
+        self.sq_norms = arrays['sq_norms']
+
+    def search(self, request):
+        return self.pca.top_k_similarity(
+            request['queries'], self.projections, k=request['top_n'],
+            min_similarity=request['min_similarity'], database_sq_norms=self.sq_norms
+        )
+
+
+SHARD_KINDS = {'audio': AudioShard, 'image': ImageShard}
+
+
+def serve_connection(conn):
+    """
+    Answer shard requests on one connection until it closes.
+
+    ('load', generation, kind, arrays, params) replaces the oldest loaded
+    generation with a new shard; ('search', generation, request) returns
+    that shard's [(row, score, ...)] list per query. Every request gets
+    one ('ok', result) or ('error', message) reply.
+    """
+    shards = OrderedDict()
+    while True:
+        try:
+            message = conn.recv()
+        except (EOFError, OSError):
+            return
+        if message[0] == 'close':
+            conn.close()
+            return
+        try:
+            if message[0] == 'load':
+                _, generation, kind, arrays, params = message
+                shards[generation] = SHARD_KINDS[kind](arrays, params)
+                while len(shards) > KEEP_GENERATIONS:
+                    shards.popitem(last=False)
+                reply = ('ok', None)
+            else:
+                _, generation, request = message
+                shard = shards.get(generation)
+                if shard is None:
+                    reply = ('error', f'Generation {generation} is not loaded')
+                else:
+                    reply = ('ok', shard.search(request))
+        except Exception as e:
+            reply = ('error', str(e) or type(e).__name__)
+        conn.send(reply)
+
+
+def serve(address, authkey, once=False):
+    """
+    Run a shard host: every client connection gets its own thread and its own shards.
+
+    Port 0 picks a free port; the bound address is printed as READY_LINE.
+    With once, the host serves a single connection and exits when it
+    closes (local shards of a ShardPool, which die with their parent).
+    """
+    with Listener(address, authkey=authkey) as listener:
+        host, port = listener.address
+        print(f"{READY_LINE}{host}:{port}", flush=True)
+        if once:
+            # Nobody reads stdout after the ready line
+            sys.stdout = sys.stderr
+            serve_connection(listener.accept())
+            return
+        while True:
+            try:
+                conn = listener.accept()
+            except Exception as e:
+                print(f"Error accepting shard connection: {str(e)}")
+                continue
+            threading.Thread(target=serve_connection, args=(conn,), daemon=True).start()
+
+
+def parse_address(address):
+    """'host:port' -> (host, port)"""
+    host, _, port = address.strip().rpartition(':')
+    return host or 'localhost', int(port)
+
+
+def merge_top_k(shard_results, offsets, n_queries, top_n):
+    """
+    Merge per-shard [(row, score, ...)] lists into global ones, best first.
+
+    Rows are shifted by their shard's offset and ties keep global row
+    order. Each shard's own top-k already breaks ties by row, so the
+    merged lists match a search over the unsplit rows.
+    """
+    merged = []
+    for query in range(n_queries):
+        candidates = [
+            (int(offset) + match[0],) + tuple(match[1:])
+            for results, offset in zip(shard_results, offsets) if results is not None
+            for match in results[query]
+        ]
+        candidates.sort(key=lambda match: (-match[1], match[0]))
+        merged.append(candidates if top_n is None else candidates[:top_n])
+    return merged
+
+
+class ShardPool:
+    """
+    Scatter-gather search over index rows split across worker processes.
+
+    load() cuts the row arrays into contiguous slices, one per shard, and
+    ships them to shard hosts: workers local ones started as
+    ``python -m app.utils.shard_pool --once`` subprocesses (fresh
+    interpreters that never import the server's main module) plus any
+    started by hand with ``python -m app.utils.shard_pool --listen host:port``
+    (addresses). search() sends a request to every shard at once and merges
+    their top-k lists. Any transport error drops the pool back to its
+    unloaded state and returns 0 / None, so callers search in-process
+    until the next load() reconnects.
+    """
+
+    def __init__(self, name, workers=0, addresses=(), authkey=None):
+        self.name = name
+        self.workers = max(workers, 0)
+        self.addresses = [parse_address(a) for a in addresses if a.strip()]
+        if self.addresses and not authkey:
+            raise ValueError("Shard hosts need SHARD_AUTHKEY")
+        self.authkey = authkey.encode() if isinstance(authkey, str) else authkey
+        self.search_seconds = stage_timer(name, 'shard_search')
+        self._connections = []
+        self._locks = []
+        self._processes = []
+        # Local shards only talk to this pool, under a key nobody else knows
+        self._local_authkey = os.urandom(16).hex()
+        self._layouts = OrderedDict()
+        self._generations = itertools.count(1)
+        self._load_lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.workers > 0 or bool(self.addresses)
+
+    def _spawn_local(self):
+        """Start one local shard host and return (process, address)"""
+        env = dict(os.environ, SHARD_AUTHKEY=self._local_authkey)
+        # Shards share the cores; one BLAS thread pool per core would oversubscribe them
+        threads = str(max(1, (os.cpu_count() or 1) // self.workers))
+        for name in BLAS_THREAD_VARS:
+            env.setdefault(name, threads)
+        process = subprocess.Popen(
+            [sys.executable, '-m', 'app.utils.shard_pool', '--listen', 'localhost:0', '--once'],
+            cwd=BASE_DIR, env=env, stdout=subprocess.PIPE, text=True
+        )
+        for line in process.stdout:
+            if line.startswith(READY_LINE):
+                process.stdout.close()
+                return process, parse_address(line[len(READY_LINE):])
+        process.wait()
+        raise RuntimeError(f"Shard process exited with code {process.returncode}")
+
+    def _start(self):
+        if self._connections:
+            return
+        connections, processes = [], []
+        try:
+            for _ in range(self.workers):
+                process, address = self._spawn_local()
+                processes.append(process)
+                connections.append(Client(address, authkey=self._local_authkey.encode()))
+            for address in self.addresses:
+                connections.append(Client(address, authkey=self.authkey))
+        except Exception:
+            for conn in connections:
+                conn.close()
+            for process in processes:
+                process.kill()
+                process.wait()
+            raise
+        self._processes = processes
+        self._locks = [threading.Lock() for _ in connections]
+        self._connections = connections
+
+    def _reset(self):
+        connections, processes = self._connections, self._processes
+        self._connections, self._locks, self._processes = [], [], []
+        self._layouts = OrderedDict()
+        for conn in connections:
+            try:
+                conn.send(('close',))
+                conn.close()
+            except (OSError, ValueError):
+                pass
+        for process in processes:
+            try:
+                process.wait(timeout=1)
+            except subprocess.TimeoutExpired:
+                process.kill()
+                process.wait()
+
+    def close(self):
+        with self._load_lock:
+            self._reset()
+
+    def _exchange(self, messages):
+        """
+        Send messages[i] to shard i (None skips it) and return the replies in order.
+
+        Shard locks are taken in index order, so concurrent exchanges never
+        deadlock; all sends go out before the first reply is read, which is
+        what lets the shards work in parallel.
+        """
+        connections, locks = self._connections, self._locks
+        if len(connections) != len(messages):
+            raise RuntimeError('Shards were reset')
+        held = []
+        try:
+            for conn, lock, message in zip(connections, locks, messages):
+                if message is None:
+                    continue
+                lock.acquire()
+                held.append(lock)
+                conn.send(message)
+            return [
+                conn.recv() if message is not None else None
+                for conn, message in zip(connections, messages)
+            ]
+        finally:
+            for lock in held:
+                lock.release()
+
+    def load(self, kind, arrays, params=None):
+        """
+        Split arrays (equal-length rows) across the shards as a new generation.
+
+        Returns the generation to pass to search(), or 0 when the shards
+        could not be loaded.
+        """
+        with self._load_lock:
+            try:
+                self._start()
+                n_rows = len(next(iter(arrays.values())))
+                bounds = np.linspace(0, n_rows, len(self._connections) + 1).astype(np.intp)
+                generation = next(self._generations)
+                messages = [
+                    ('load', generation, kind,
+                     {name: np.asarray(array[start:stop]) for name, array in arrays.items()}, params)
+                    for start, stop in zip(bounds[:-1], bounds[1:])
+                ]
+                for status, result in self._exchange(messages):
+                    if status != 'ok':
+                        raise RuntimeError(result)
+            except Exception as e:
+                print(f"Error loading {self.name} shards: {str(e) or type(e).__name__}")
+                self._reset()
+                return 0
+            self._layouts[generation] = (bounds[:-1], np.diff(bounds))
+            while len(self._layouts) > KEEP_GENERATIONS:
+                self._layouts.popitem(last=False)
+            return generation
+
+    def search(self, generation, request, n_queries):
+        """
+        Fan request out to every non-empty shard of generation and merge the results.
+
+        request must carry 'top_n'; returns [(global row, score, ...)] per
+        query, or None when the generation is gone or a shard failed.
+        """
+        layout = self._layouts.get(generation)
+        if layout is None:
+            return None
+        offsets, counts = layout
+        messages = [('search', generation, request) if count else None for count in counts]
+        try:
+            with self.search_seconds.time():
+                replies = self._exchange(messages)
+        except Exception as e:
+            print(f"Error searching {self.name} shards: {str(e) or type(e).__name__}")
+            with self._load_lock:
+                # A reset or reload may already have replaced this generation
+                if generation in self._layouts:
+                    self._reset()
+            return None
+
+        results = []
+        for reply in replies:
+            if reply is not None and reply[0] != 'ok':
+                print(f"Error searching {self.name} shards: {reply[1]}")
+                return None
+            results.append(reply[1] if reply is not None else None)
+        return merge_top_k(results, offsets, n_queries, request['top_n'])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Serve index shards to remote ShardPools')
+    parser.add_argument('--listen', default='localhost:6100', help='host:port to listen on')
+    parser.add_argument('--authkey', default=os.environ.get('SHARD_AUTHKEY'),
+                        help='shared secret (default: SHARD_AUTHKEY)')
+    parser.add_argument('--once', action='store_true',
+                        help='serve one connection, then exit (used for local shards)')
+    args = parser.parse_args()
+    if not args.authkey:
+        parser.error('--authkey or SHARD_AUTHKEY is required')
+    serve(parse_address(args.listen), args.authkey.encode(), once=args.once)
@@ -0,0 +1,347 @@
+# benchmarks/run.py
+"""
+Benchmark harness for the audio and image hot paths.
+
+Generates (or reuses) synthetic corpora under --workdir, then measures
+feature extraction, cold and cached dataset loads, PCA fitting and query
+latency. Results are printed and written as JSON; --compare flags
+regressions against an earlier result file.
+
+    cd src/backend
+    python -m benchmarks.run --songs 500 --images 1000 --queries 200 --output bench.json
+    python -m benchmarks.run --output new.json --compare bench.json
+"""
+import argparse
+import gc
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_SEED_DIR = os.path.join(os.path.dirname(os.path.dirname(BACKEND_DIR)), 'test')
+
+
+def latency_stats(seconds):
+    """p50/p95/p99, mean and max of per-call latencies, in milliseconds"""
+    if not seconds:
+        return {'count': 0}
+    ms = np.asarray(seconds) * 1000
+    return {
+        'count': len(ms),
+        'p50': round(float(np.percentile(ms, 50)), 3),
+        'p95': round(float(np.percentile(ms, 95)), 3),
+        'p99': round(float(np.percentile(ms, 99)), 3),
+        'mean': round(float(ms.mean()), 3),
+        'max': round(float(ms.max()), 3)
+    }
+
+
+def timed(fn, *args, **kwargs):
+    """(result, seconds) of one call"""
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def peak_memory(fn, *args, **kwargs):
+    """Peak traced Python/NumPy allocation of one call in MiB (worker processes are not included)"""
+    gc.collect()
+    tracemalloc.start()
+    try:
+        fn(*args, **kwargs)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return round(peak / 2 ** 20, 2)
+
+
+def _recall(results, sources, key):
+    hits = sum(1 for matches, source in zip(results, sources) if matches and matches[0][key] == source)
+    return round(hits / len(sources), 4) if sources else None
+
+
+def _reset_dir(path):
+    shutil.rmtree(path, ignore_errors=True)
+    os.makedirs(path, exist_ok=True)
+
+
+def _prepare(paths_dir, count, generate):
+    """Reuse a corpus from an earlier run with the same size, else regenerate it"""
+    existing = sorted(os.listdir(paths_dir)) if os.path.isdir(paths_dir) else []
+    if len(existing) == count:
+        return [os.path.join(paths_dir, f) for f in existing], 0.0
+    _reset_dir(paths_dir)
+    return timed(generate)
+
+
+def bench_audio(args, workdir):
+    from app.config import AUDIO_DATASET_DIR, AUDIO_CACHE_DIR
+    from app.services.audio_service import AudioService
+    from benchmarks import synthetic
+
+    print(f"Audio: preparing {args.songs} songs...")
+    paths, gen_seconds = _prepare(AUDIO_DATASET_DIR, args.songs, lambda: synthetic.midi_corpus(
+        AUDIO_DATASET_DIR, args.songs, seed=args.seed, seed_dir=args.seed_dir
+    ))
+    query_dir = os.path.join(workdir, 'queries', 'midi')
+    _reset_dir(query_dir)
+    queries = synthetic.midi_queries(paths, query_dir, args.queries, seed=args.seed,
+                                     excerpt_notes=args.excerpt_notes)
+    query_paths = [q for q, _ in queries]
+    sources = [s for _, s in queries]
+
+    # Single-file extraction latency (serial, in this process)
+    sample = paths[:min(len(paths), args.extract_sample)]
+    extract_times = [timed(AudioService._extract_features, p)[1] for p in sample]
+
+    # Cold load: empty cache, extraction in the configured process pool
+    _reset_dir(AUDIO_CACHE_DIR)
+    service, cold_seconds = timed(AudioService, windowed=args.windowed)
+    # Warm load: everything comes from the feature cache
+    service, warm_seconds = timed(AudioService, windowed=args.windowed)
+
+    results = {
+        'corpus': {'songs': len(service.index), 'queries': len(queries),
+                   'generateSeconds': round(gen_seconds, 3)},
+        'extract': dict(latency_stats(extract_times),
+                        filesPerSecond=round(len(sample) / sum(extract_times), 2) if sample else None),
+        'ingest': {
+            'coldSeconds': round(cold_seconds, 3),
+            'coldFilesPerSecond': round(len(paths) / cold_seconds, 2),
+            'warmSeconds': round(warm_seconds, 3),
+            'report': service.last_load_report
+        },
+        'query': {}
+    }
+
+    modes = [('song', dict(windowed=False, exact=True)), ('song_ivf', dict(windowed=False, exact=False))]
+    if args.windowed:
+        modes.append(('window', dict(windowed=True)))
+    service.build_ann()
+    for name, options in modes:
+        service.find_matches(query_paths[0], **options)  # warm-up (BLAS init)
+        latencies = []
+        matches = []
+        for path in query_paths:
+            result, seconds = timed(service.find_matches, path, **options)
+            latencies.append(seconds)
+            matches.append(result)
+        batch, batch_seconds = timed(service.find_matches_batch, query_paths, **options)
+        results['query'][name] = dict(
+            latency_stats(latencies),
+            queriesPerSecond=round(len(latencies) / sum(latencies), 2),
+            batchQueriesPerSecond=round(len(query_paths) / batch_seconds, 2),
+            recallAt1=_recall(matches, sources, 'filename')
+        )
+
+    if args.memory:
+        print("Audio: measuring peak memory...")
+        _reset_dir(AUDIO_CACHE_DIR)
+        results['memoryMiB'] = {
+            'coldLoad': peak_memory(AudioService, windowed=args.windowed),
+            'warmLoad': peak_memory(AudioService, windowed=args.windowed),
+            'query': peak_memory(lambda: [service.find_matches(p) for p in query_paths[:20]]),
+            'batchQuery': peak_memory(service.find_matches_batch, query_paths)
+        }
+    return results
+
+
+def bench_image(args, workdir):
+    from app.config import IMAGE_DATASET_DIR, IMAGE_CACHE_DIR
+    from app.services.image_services import ImageService
+    from app.utils.image.image_loader import load_image_matrix
+    from benchmarks import synthetic
+
+    print(f"Image: preparing {args.images} images...")
+    size = (args.image_size, args.image_size)
+    paths, gen_seconds = _prepare(IMAGE_DATASET_DIR, args.images, lambda: synthetic.image_corpus(
+        IMAGE_DATASET_DIR, args.images, size=size, seed=args.seed
+    ))
+    query_dir = os.path.join(workdir, 'queries', 'images')
+    _reset_dir(query_dir)
+    queries = synthetic.image_queries(paths, query_dir, args.queries, seed=args.seed,
+                                      noise=args.image_noise)
+    query_paths = [q for q, _ in queries]
+    sources = [s for _, s in queries]
+
+    _reset_dir(IMAGE_CACHE_DIR)
+    service, cold_seconds = timed(ImageService)
+    service, warm_seconds = timed(ImageService)
+
+    # Decode and PCA fit on their own, with a fresh processor each time
+    (matrix, _, _), decode_seconds = timed(load_image_matrix, paths, workers=service.decode_workers)
+    pca = service._new_pca()
+    projections, fit_seconds = timed(pca.fit_transform, matrix)
+    similarity_times = [timed(pca.compute_similarity, projections[i], projections)[1]
+                        for i in range(min(len(projections), 200))]
+
+    latencies = []
+    matches = []
+    service.find_matches(query_paths[0])
+    for path in query_paths:
+        result, seconds = timed(service.find_matches, path)
+        latencies.append(seconds)
+        matches.append(result)
+    batch, batch_seconds = timed(service.find_matches_batch, query_paths)
+
+    results = {
+        'corpus': {'images': len(service.filenames), 'queries': len(queries),
+                   'size': list(size), 'generateSeconds': round(gen_seconds, 3)},
+        'ingest': {
+            'coldSeconds': round(cold_seconds, 3),
+            'coldFilesPerSecond': round(len(paths) / cold_seconds, 2),
+            'warmSeconds': round(warm_seconds, 3),
+            'decodeSeconds': round(decode_seconds, 3),
+            'fitTransformSeconds': round(fit_seconds, 3),
+            'solver': pca.solver
+        },
+        'computeSimilarity': latency_stats(similarity_times),
+        'query': {
+            'pca': dict(
+                latency_stats(latencies),
+                queriesPerSecond=round(len(latencies) / sum(latencies), 2),
+                batchQueriesPerSecond=round(len(query_paths) / batch_seconds, 2),
+                recallAt1=_recall(matches, sources, 'filename')
+            )
+        }
+    }
+
+    if args.memory:
+        print("Image: measuring peak memory...")
+        _reset_dir(IMAGE_CACHE_DIR)
+        results['memoryMiB'] = {
+            'coldLoad': peak_memory(ImageService),
+            'warmLoad': peak_memory(ImageService),
+            'fitTransform': peak_memory(service._new_pca().fit_transform, matrix),
+            'batchQuery': peak_memory(service.find_matches_batch, query_paths)
+        }
+    return results
+
+
+def _metadata(args):
+    try:
+        revision = subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=BACKEND_DIR,
+            capture_output=True, text=True, timeout=10
+        ).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        revision = None
+    return {
+        'revision': revision,
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'cpuCount': os.cpu_count(),
+        'params': {k: v for k, v in vars(args).items() if k not in ('output', 'compare')}
+    }
+
+
+# Metric names checked by --compare: (higher is better, smallest baseline value worth comparing).
+# The floors keep timer noise on sub-millisecond metrics from reading as regressions.
+COMPARED_METRICS = {
+    'p50': (False, 0.5), 'p95': (False, 0.5), 'p99': (False, 0.5),
+    'coldSeconds': (False, 0.05), 'warmSeconds': (False, 0.05), 'fitTransformSeconds': (False, 0.05),
+    'queriesPerSecond': (True, 0), 'batchQueriesPerSecond': (True, 0),
+    'filesPerSecond': (True, 0), 'coldFilesPerSecond': (True, 0)
+}
+
+
+def _flatten(results, prefix=''):
+    for key, value in results.items():
+        path = f'{prefix}.{key}' if prefix else key
+        if isinstance(value, dict):
+            yield from _flatten(value, path)
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            yield path, key, value
+
+
+def compare(current, baseline, tolerance):
+    """Metrics that got worse than baseline by more than tolerance, as printable lines"""
+    old = {path: value for path, _, value in _flatten(baseline)}
+    regressions = []
+    for path, key, value in _flatten(current):
+        if key not in COMPARED_METRICS or path.startswith('meta') or not old.get(path):
+            continue
+        higher_is_better, floor = COMPARED_METRICS[key]
+        if old[path] < floor:
+            continue
+        change = (value - old[path]) / old[path]
+        worse = -change if higher_is_better else change
+        if worse > tolerance:
+            regressions.append(f'{path}: {old[path]} -> {value} ({change:+.1%})')
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--songs', type=int, default=200, help='synthetic MIDI corpus size')
+    parser.add_argument('--images', type=int, default=300, help='synthetic image corpus size')
+    parser.add_argument('--queries', type=int, default=100, help='queries per modality')
+    parser.add_argument('--excerpt-notes', type=int, default=40, help='notes per audio query excerpt')
+    parser.add_argument('--image-noise', type=float, default=0.0, help='pixel noise std of image queries')
+    parser.add_argument('--image-size', type=int, default=256, help='side of the generated images in pixels')
+    parser.add_argument('--extract-sample', type=int, default=100, help='files timed one by one for extraction latency')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--seed-dir', default=DEFAULT_SEED_DIR if os.path.isdir(DEFAULT_SEED_DIR) else None,
+                        help='MIDI files the synthetic songs are partly derived from')
+    parser.add_argument('--workers', type=int, default=None, help='audio extraction processes')
+    parser.add_argument('--windowed', action='store_true', help='also build and query the window index')
+    parser.add_argument('--no-memory', dest='memory', action='store_false', help='skip the tracemalloc passes')
+    parser.add_argument('--only', choices=['audio', 'image'], help='benchmark one modality')
+    parser.add_argument('--workdir', help='corpus and cache directory (reused across runs); default: temporary')
+    parser.add_argument('--output', help='write the JSON results here')
+    parser.add_argument('--compare', help='earlier JSON results to check for regressions')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed relative slowdown for --compare')
+    args = parser.parse_args(argv)
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix='algeo-bench-')
+    # Must be set before app.config is imported: every service path derives from it
+    os.environ['STORAGE_DIR'] = os.path.join(os.path.abspath(workdir), 'storage')
+    if args.workers is not None:
+        os.environ['AUDIO_EXTRACT_WORKERS'] = str(args.workers)
+    sys.path.insert(0, BACKEND_DIR)
+
+    results = {'meta': _metadata(args)}
+    try:
+        if args.only in (None, 'audio'):
+            results['audio'] = bench_audio(args, workdir)
+        if args.only in (None, 'image'):
+            results['image'] = bench_image(args, workdir)
+    finally:
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+    if resource is not None:
+        # Linux reports ru_maxrss in KiB
+        results['meta']['maxRssMiB'] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+    text = json.dumps(results, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for line in regressions:
+            print(f"REGRESSION {line}")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,164 @@
+# benchmarks/synthetic.py
+"""Reproducible synthetic MIDI and image corpora for the benchmark harness."""
+import glob
+import os
+import warnings
+import numpy as np
+import pretty_midi
+from PIL import Image, ImageDraw, ImageFilter
+
+
+def _melody_notes(midi_path):
+    """(pitch, start, end, velocity) rows of every non-drum note, sorted by start"""
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        midi = pretty_midi.PrettyMIDI(midi_path)
+    notes = [
+        (note.pitch, note.start, note.end, note.velocity)
+        for instrument in midi.instruments if not instrument.is_drum
+        for note in instrument.notes
+    ]
+    notes.sort(key=lambda n: n[1])
+    return np.array(notes, dtype=np.float64).reshape(-1, 4)
+
+
+def load_seed_melodies(seed_dir):
+    """Note arrays of the MIDI files in seed_dir (e.g. the repo's test/ folder)"""
+    melodies = []
+    for path in sorted(glob.glob(os.path.join(seed_dir, '*.mid')) + glob.glob(os.path.join(seed_dir, '*.midi'))):
+        try:
+            notes = _melody_notes(path)
+        except Exception as e:
+            print(f"Skipping seed {path}: {str(e)}")
+            continue
+        if len(notes) > 0:
+            melodies.append(notes)
+    return melodies
+
+
+def random_melody(rng, n_notes, tempo=120.0):
+    """Random-walk melody in C major-ish steps with varied rhythm"""
+    beat = 60.0 / tempo
+    steps = rng.choice([-4, -3, -2, -1, 0, 1, 2, 3, 4, 5, 7, -5, -7], size=n_notes)
+    pitches = np.clip(rng.integers(55, 72) + np.cumsum(steps), 36, 96)
+    durations = rng.choice([0.25, 0.5, 0.5, 1.0, 1.0, 1.5, 2.0], size=n_notes) * beat
+    gaps = rng.choice([0.0, 0.0, 0.0, 0.25], size=n_notes) * beat
+    starts = np.concatenate([[0.0], np.cumsum(durations + gaps)[:-1]])
+    velocities = rng.integers(50, 120, size=n_notes)
+    return np.column_stack([pitches, starts, starts + durations, velocities]).astype(np.float64)
+
+
+def vary_melody(rng, notes, max_notes):
+    """A transposed, tempo-scaled excerpt of a seed melody"""
+    if len(notes) > max_notes:
+        first = rng.integers(0, len(notes) - max_notes + 1)
+        notes = notes[first:first + max_notes]
+    notes = notes.copy()
+    notes[:, 1:3] -= notes[0, 1]
+    notes[:, 1:3] *= rng.uniform(0.8, 1.25)
+    notes[:, 0] = np.clip(notes[:, 0] + rng.integers(-5, 6), 0, 127)
+    return notes
+
+
+def write_midi(path, notes, program=0):
+    midi = pretty_midi.PrettyMIDI(initial_tempo=120.0)
+    instrument = pretty_midi.Instrument(program=program)
+    for pitch, start, end, velocity in notes:
+        instrument.notes.append(pretty_midi.Note(
+            velocity=int(velocity), pitch=int(pitch), start=float(start), end=float(max(end, start + 0.01))
+        ))
+    midi.instruments.append(instrument)
+    midi.write(path)
+
+
+def midi_corpus(directory, n_songs, seed=0, seed_dir=None, min_notes=120, max_notes=600):
+    """
+    Write n_songs MIDI files into directory and return their paths.
+
+    When seed_dir holds MIDI files, half of the songs are variations of
+    those (realistic interval and rhythm statistics); the rest are random
+    walks.
+    """
+    os.makedirs(directory, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    seeds = load_seed_melodies(seed_dir) if seed_dir else []
+    paths = []
+    for i in range(n_songs):
+        if seeds and i % 2 == 0:
+            notes = vary_melody(rng, seeds[rng.integers(len(seeds))], max_notes)
+        else:
+            notes = random_melody(rng, int(rng.integers(min_notes, max_notes + 1)),
+                                  tempo=float(rng.uniform(80, 160)))
+        path = os.path.join(directory, f'song_{i:06d}.mid')
+        write_midi(path, notes)
+        paths.append(path)
+    return paths
+
+
+def midi_queries(paths, directory, n_queries, seed=0, excerpt_notes=40):
+    """Write short excerpts of random corpus songs; returns [(query_path, source_filename)]"""
+    os.makedirs(directory, exist_ok=True)
+    rng = np.random.default_rng(seed + 1)
+    queries = []
+    for i in range(n_queries):
+        source = paths[rng.integers(len(paths))]
+        notes = _melody_notes(source)
+        if len(notes) > excerpt_notes:
+            first = rng.integers(0, len(notes) - excerpt_notes + 1)
+            notes = notes[first:first + excerpt_notes]
+        notes[:, 1:3] -= notes[0, 1]
+        path = os.path.join(directory, f'query_{i:06d}.mid')
+        write_midi(path, notes)
+        queries.append((path, os.path.basename(source)))
+    return queries
+
+
+def random_image(rng, size):
+    """Smooth random grayscale-ish scene: blurred low-res noise plus a few shapes"""
+    base = rng.integers(0, 256, size=(8, 8, 3), dtype=np.uint8)
+    image = Image.fromarray(base, 'RGB').resize(size, Image.BICUBIC)
+    draw = ImageDraw.Draw(image)
+    for _ in range(int(rng.integers(2, 6))):
+        x0, y0 = rng.integers(0, size[0]), rng.integers(0, size[1])
+        x1, y1 = x0 + rng.integers(10, size[0] // 2), y0 + rng.integers(10, size[1] // 2)
+        color = tuple(int(c) for c in rng.integers(0, 256, size=3))
+        if rng.random() < 0.5:
+            draw.ellipse([x0, y0, x1, y1], fill=color)
+        else:
+            draw.rectangle([x0, y0, x1, y1], fill=color)
+    return image.filter(ImageFilter.GaussianBlur(1))
+
+
+def image_corpus(directory, n_images, size=(256, 256), seed=0):
+    """Write n_images synthetic images (alternating PNG and JPEG) and return their paths"""
+    os.makedirs(directory, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    paths = []
+    for i in range(n_images):
+        extension = 'png' if i % 2 == 0 else 'jpg'
+        path = os.path.join(directory, f'image_{i:06d}.{extension}')
+        random_image(rng, size).save(path)
+        paths.append(path)
+    return paths
+
+
+def image_queries(paths, directory, n_queries, seed=0, noise=0.0):
+    """
+    Write PNG copies of random corpus images; returns [(query_path, source_filename)].
+
+    With noise > 0 the copies also get Gaussian pixel noise of that standard
+    deviation and a random +-10% brightness change.
+    """
+    os.makedirs(directory, exist_ok=True)
+    rng = np.random.default_rng(seed + 1)
+    queries = []
+    for i in range(n_queries):
+        source = paths[rng.integers(len(paths))]
+        with Image.open(source) as img:
+            pixels = np.asarray(img.convert('RGB'), dtype=np.float64)
+        if noise > 0:
+            pixels = pixels * rng.uniform(0.9, 1.1) + rng.normal(0, noise, pixels.shape)
+        path = os.path.join(directory, f'query_{i:06d}.png')
+        Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8), 'RGB').save(path)
+        queries.append((path, os.path.basename(source)))
+    return queries
@@ -1,6 +1,9 @@
 from app import create_app
 
-app = create_app()
+# Worker processes started with spawn/forkserver re-import this file as __mp_main__;
+# they must not build (and warm up) another copy of the app
+if __name__ != '__mp_main__':
+    app = create_app()
 
 if __name__ == '__main__':
     print("Loading dataset...")
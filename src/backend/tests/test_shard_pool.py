@@ -0,0 +1,47 @@
+# tests/test_shard_pool.py
+import numpy as np
+from app.utils.audio.audio_index import AudioIndex, FEATURE_DIMS, query_matrices
+from app.utils.shard_pool import AudioShard, ImageShard, merge_top_k
+
+
+def split_search(shard_kind, arrays, params, request, n_queries, n_shards):
+    """Search arrays cut into n_shards contiguous shards and merge, as ShardPool.search does"""
+    n_rows = len(next(iter(arrays.values())))
+    bounds = np.linspace(0, n_rows, n_shards + 1).astype(np.intp)
+    results = [
+        shard_kind({name: array[start:stop] for name, array in arrays.items()}, params).search(request)
+        if stop > start else None
+        for start, stop in zip(bounds[:-1], bounds[1:])
+    ]
+    return merge_top_k(results, bounds[:-1], n_queries, request['top_n'])
+
+
+def test_audio_shards_match_local_search_with_ties_at_the_cut():
+    rng = np.random.default_rng(0)
+    songs = [{name: rng.random(dim) for name, dim in FEATURE_DIMS.items()} for _ in range(4)]
+    # Every song appears in several shards, so equal scores straddle shard boundaries
+    features = [songs[i] for i in rng.integers(0, 4, size=30)]
+    index = AudioIndex.from_features(range(30), features)
+    queries = query_matrices(songs)
+    arrays = {'atb': index.atb, 'rtb': index.rtb, 'ftb': index.ftb}
+    for top_n in (1, 3, 7, 12):
+        local = index.top_rows_batch(queries, 0.1, top_n, 0.0)
+        for n_shards in (2, 3, 5):
+            request = {'queries': queries, 'similarity_threshold': 0.1, 'shifts': None,
+                       'top_n': top_n, 'min_similarity': 0.0}
+            assert split_search(AudioShard, arrays, None, request, 4, n_shards) == local
+
+
+def test_image_shards_match_local_search_with_ties_at_the_cut():
+    from app.utils.image.pca_processor import PCAProcessor
+    pca = PCAProcessor(n_components=4)
+    rng = np.random.default_rng(1)
+    points = rng.normal(size=(3, 4)) * 50
+    projections = points[rng.integers(0, 3, size=30)]
+    arrays = {'projections': projections, 'sq_norms': np.einsum('ij,ij->i', projections, projections)}
+    params = {'n_components': 4, 'dtype': np.float32}
+    for k in (1, 4, 11):
+        local = pca.top_k_similarity(points, projections, k=k)
+        for n_shards in (2, 3, 5):
+            request = {'queries': points, 'top_n': k, 'min_similarity': 0.0}
+            assert split_search(ImageShard, arrays, params, request, 3, n_shards) == local
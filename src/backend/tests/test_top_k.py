@@ -0,0 +1,39 @@
+# tests/test_top_k.py
+import numpy as np
+from app.utils.audio.audio_index import top_indices
+
+
+def stable_top(scores, top_n, min_score):
+    """Reference: stable sort of every row by score, as the unsplit search did"""
+    order = sorted(np.flatnonzero(scores >= min_score), key=lambda row: -scores[row])
+    return order if top_n is None else order[:top_n]
+
+
+def test_top_indices_keeps_row_order_for_ties_at_the_cut():
+    scores = np.array([66.5, 80.25, 80.25, 100, 100, 100, 100, 100, 0, 0, 70, 66.5, 100, 80.25, 70, 70])
+    assert top_indices(scores, 2, 0.0).tolist() == [3, 4]
+    assert top_indices(scores, 7, 0.0).tolist() == [3, 4, 5, 6, 7, 12, 1]
+    assert top_indices(scores, None, 1.0).tolist() == stable_top(scores, None, 1.0)
+
+
+def test_top_indices_matches_stable_sort_on_rounded_scores():
+    rng = np.random.default_rng(0)
+    for _ in range(500):
+        scores = np.round(rng.choice([0.0, 50.0, 75.5, 99.99, 100.0], size=rng.integers(1, 40)), 2)
+        top_n = int(rng.integers(1, 10))
+        assert top_indices(scores, top_n, 10.0).tolist() == stable_top(scores, top_n, 10.0)
+
+
+def test_top_k_similarity_keeps_row_order_for_ties_at_the_cut():
+    from app.utils.image.pca_processor import PCAProcessor
+    pca = PCAProcessor(n_components=4)
+    rng = np.random.default_rng(1)
+    points = rng.normal(size=(3, 4)) * 50
+    # Rows repeat the same three points, so many distances tie exactly
+    database = points[rng.integers(0, 3, size=40)]
+    queries = np.vstack([points, rng.normal(size=(2, 4)) * 50])
+    for k in (1, 3, 8, 20):
+        results = pca.top_k_similarity(queries, database, k=k)
+        for query, matches in zip(queries, results):
+            expected = pca.compute_similarity(query, database)[:k]
+            assert [row for row, _ in matches] == [row for row, _ in expected]